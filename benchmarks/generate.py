@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+'''
+  generate synthetic somatic pipeline inputs for benchmarking
+  - the same seed and scale always produce the same files
+  - strelka snv and indel vcfs (AU/CU/GU/TU, TIR/TAR), a mutect2 vcf with vep CSQ strings and its vcf2tsv style tsv
+  - clinvar, cosmic and cadd like vcfs and a revel like csv for annotation
+  - capture and repeat beds, a maf and a fastq
+'''
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import random
+
+VERSION = 1
+
+# records per vcf, reads in the fastq, samples in the mutect2 vcf
+SCALES = {
+  'exome': {'records': 20000, 'reads': 200000, 'samples': 2},
+  'wgs': {'records': 400000, 'reads': 2000000, 'samples': 2},
+  'cohort': {'records': 50000, 'reads': 200000, 'samples': 40}
+}
+
+# grch37
+CHROMOSOMES = [('1', 249250621), ('2', 243199373), ('3', 198022430), ('4', 191154276), ('5', 180915260), ('6', 171115067), ('7', 159138663), ('8', 146364022), ('9', 141213431), ('10', 135534747), ('11', 135006516), ('12', 133851895), ('13', 115169878), ('14', 107349540), ('15', 102531392), ('16', 90354753), ('17', 81195210), ('18', 78077248), ('19', 59128983), ('20', 63025520), ('21', 48129895), ('22', 51304566), ('X', 155270560)]
+
+VEP_FORMAT = 'Consequence|IMPACT|Codons|Amino_acids|Gene|SYMBOL|Feature|EXON|PolyPhen|SIFT|Protein_position|BIOTYPE|HGVSc|HGVSp|cDNA_position|CDS_position|HGVSc|HGVSp|cDNA_position|CDS_position|gnomAD_AF|gnomAD_AFR_AF|gnomAD_AMR_AF|gnomAD_ASJ_AF|gnomAD_EAS_AF|gnomAD_FIN_AF|gnomAD_NFE_AF|gnomAD_OTH_AF|gnomAD_SAS_AF|MaxEntScan_alt|MaxEntScan_diff|MaxEntScan_ref|PICK|CANONICAL'
+CONSEQUENCES = [('missense_variant', 'MODERATE'), ('synonymous_variant', 'LOW'), ('stop_gained', 'HIGH'), ('intron_variant', 'MODIFIER'), ('frameshift_variant', 'HIGH'), ('splice_region_variant', 'LOW')]
+GENES = ['TP53', 'KRAS', 'APC', 'BRAF', 'POLE', 'POLD1', 'PIK3CA', 'SMAD4', 'MLH1', 'MSH2', 'ATM', 'BRCA1', 'BRCA2', 'PTEN', 'NRAS', 'CTNNB1']
+BASES = 'ACGT'
+
+def contigs():
+  return ''.join(['##contig=<ID={},length={}>\n'.format(chrom, length) for chrom, length in CHROMOSOMES])
+
+def capture(rng, count):
+  '''
+    sorted exon-like targets spread over the genome in proportion to chromosome length
+  '''
+  total = sum([length for _, length in CHROMOSOMES])
+  result = []
+  for chrom, length in CHROMOSOMES:
+    n = max(1, int(count * length / total))
+    starts = sorted(rng.sample(range(10000, length - 10000, 1000), n))
+    result.extend([(chrom, start, start + rng.randint(80, 400)) for start in starts])
+  return result
+
+def positions(rng, targets, count, on_target=0.8):
+  '''
+    sorted variant positions, mostly within targets
+  '''
+  result = set()
+  chrom_lengths = dict(CHROMOSOMES)
+  while len(result) < count:
+    if rng.random() < on_target:
+      chrom, start, end = rng.choice(targets)
+      pos = rng.randint(start + 1, end)
+    else:
+      chrom = rng.choice(CHROMOSOMES)[0]
+      pos = rng.randint(10000, chrom_lengths[chrom] - 10000)
+    result.add((chrom, pos))
+  order = dict((chrom, idx) for idx, (chrom, _) in enumerate(CHROMOSOMES))
+  return sorted(result, key=lambda x: (order[x[0]], x[1]))
+
+def snv(rng):
+  ref = rng.choice(BASES)
+  return ref, rng.choice([base for base in BASES if base != ref])
+
+def indel(rng):
+  base = rng.choice(BASES)
+  extra = ''.join([rng.choice(BASES) for _ in range(rng.randint(1, 6))])
+  if rng.random() < 0.5:
+    return base + extra, base
+  return base, base + extra
+
+def csq(rng, alt):
+  '''
+    a vep CSQ value with a few transcripts, one of them canonical and picked
+  '''
+  gene = rng.choice(GENES)
+  transcripts = []
+  count = rng.randint(1, 4)
+  for idx in range(count):
+    consequence, impact = rng.choice(CONSEQUENCES)
+    af = '{:.6f}'.format(rng.random() * 0.01)
+    values = [consequence, impact, 'gCc/gTc', 'A/V', 'ENSG{:011d}'.format(GENES.index(gene)), gene, 'NM_{:06d}.{}'.format(rng.randint(1, 999999), rng.randint(1, 5)), '{}/{}'.format(rng.randint(1, 20), 20), 'benign(0.1)', 'tolerated(0.3)', str(rng.randint(1, 1000)), 'protein_coding', 'c.{}C>T'.format(rng.randint(1, 3000)), 'p.Ala{}Val'.format(rng.randint(1, 1000)), str(rng.randint(1, 5000)), str(rng.randint(1, 3000))]
+    values += values[12:16] + [af] * 9 + ['{:.3f}'.format(rng.random() * 10)] * 3
+    values += ['1' if idx == 0 else '', 'YES' if idx == 0 else '']
+    transcripts.append('|'.join(values))
+  return ','.join(transcripts)
+
+def write_strelka_snvs(fh, rng, sites):
+  fh.write('##fileformat=VCFv4.1\n##source=strelka\n')
+  fh.write(contigs())
+  fh.write('##FILTER=<ID=LowEVS,Description="Somatic Empirical Variant Score (SomaticEVS) is below threshold">\n##FILTER=<ID=LowDepth,Description="Tumor or normal sample read depth at this locus is below 2">\n')
+  fh.write('##INFO=<ID=SOMATIC,Number=0,Type=Flag,Description="Somatic mutation">\n##INFO=<ID=QSS,Number=1,Type=Integer,Description="Quality score">\n##INFO=<ID=NT,Number=1,Type=String,Description="Genotype of the normal">\n##INFO=<ID=DP,Number=1,Type=Integer,Description="Combined depth">\n##INFO=<ID=MQ,Number=1,Type=Float,Description="RMS Mapping Quality">\n##INFO=<ID=SomaticEVS,Number=1,Type=Float,Description="Somatic Empirical Variant Score">\n')
+  fh.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">\n##FORMAT=<ID=FDP,Number=1,Type=Integer,Description="Filtered basecalls">\n##FORMAT=<ID=AU,Number=2,Type=Integer,Description="A tier1,tier2">\n##FORMAT=<ID=CU,Number=2,Type=Integer,Description="C tier1,tier2">\n##FORMAT=<ID=GU,Number=2,Type=Integer,Description="G tier1,tier2">\n##FORMAT=<ID=TU,Number=2,Type=Integer,Description="T tier1,tier2">\n')
+  fh.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNORMAL\tTUMOR\n')
+  for chrom, pos in sites:
+    ref, alt = snv(rng)
+    samples = []
+    for is_tumour in (False, True):
+      depth = rng.randint(5, 200)
+      alt_count = int(depth * rng.random() * 0.5) if is_tumour else rng.randint(0, 1)
+      counts = dict((base, 0) for base in BASES)
+      counts[ref] = depth - alt_count
+      counts[alt] = alt_count
+      samples.append('{}:0:{}'.format(depth, ':'.join(['{},{}'.format(counts[base], counts[base] + rng.randint(0, 2)) for base in BASES])))
+    depth = rng.randint(10, 400)
+    fh.write('{}\t{}\t.\t{}\t{}\t.\t{}\tSOMATIC;QSS={};NT=ref;DP={};MQ=60.00;SomaticEVS={:.2f}\tDP:FDP:AU:CU:GU:TU\t{}\n'.format(chrom, pos, ref, alt, rng.choice(['PASS'] * 8 + ['LowEVS', 'LowDepth']), rng.randint(1, 100), depth, rng.random() * 20, '\t'.join(samples)))
+
+def write_strelka_indels(fh, rng, sites):
+  fh.write('##fileformat=VCFv4.1\n##source=strelka\n')
+  fh.write(contigs())
+  fh.write('##FILTER=<ID=LowEVS,Description="Somatic Empirical Variant Score (SomaticEVS) is below threshold">\n')
+  fh.write('##INFO=<ID=SOMATIC,Number=0,Type=Flag,Description="Somatic mutation">\n##INFO=<ID=QSI,Number=1,Type=Integer,Description="Quality score">\n##INFO=<ID=RU,Number=1,Type=String,Description="Repeat unit">\n##INFO=<ID=RC,Number=1,Type=Integer,Description="Reference repeat count">\n##INFO=<ID=IC,Number=1,Type=Integer,Description="Indel repeat count">\n##INFO=<ID=SomaticEVS,Number=1,Type=Float,Description="Somatic Empirical Variant Score">\n')
+  fh.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">\n##FORMAT=<ID=DP2,Number=1,Type=Integer,Description="Read depth for tier2">\n##FORMAT=<ID=TAR,Number=2,Type=Integer,Description="Reads strongly supporting alternate allele for tiers 1,2">\n##FORMAT=<ID=TIR,Number=2,Type=Integer,Description="Reads strongly supporting indel allele for tiers 1,2">\n##FORMAT=<ID=TOR,Number=2,Type=Integer,Description="Other reads for tiers 1,2">\n')
+  fh.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNORMAL\tTUMOR\n')
+  for chrom, pos in sites:
+    ref, alt = indel(rng)
+    samples = []
+    for is_tumour in (False, True):
+      depth = rng.randint(5, 200)
+      tir = int(depth * rng.random() * 0.5) if is_tumour else rng.randint(0, 1)
+      samples.append('{}:{}:{},{}:{},{}:0,0'.format(depth, depth, depth - tir, depth - tir, tir, tir))
+    fh.write('{}\t{}\t.\t{}\t{}\t.\t{}\tSOMATIC;QSI={};RU={};RC={};IC={};SomaticEVS={:.2f}\tDP:DP2:TAR:TIR:TOR\t{}\n'.format(chrom, pos, ref, alt, rng.choice(['PASS'] * 9 + ['LowEVS']), rng.randint(1, 100), alt[1:] or ref[1:], rng.randint(1, 12), rng.randint(1, 12), rng.random() * 20, '\t'.join(samples)))
+
+def mutect2_sample_names(count):
+  if count == 2:
+    return ['TUMOUR', 'NORMAL']
+  return ['TUMOUR'] + ['S{:03d}'.format(idx) for idx in range(1, count)]
+
+def mutect2_records(rng, sites, sample_count):
+  '''
+    (chrom, pos, ref, alt, filter, dp, csq, [(ad_ref, ad_alt, af)...]) for each site
+  '''
+  for chrom, pos in sites:
+    ref, alt = snv(rng) if rng.random() < 0.85 else indel(rng)
+    samples = []
+    for _ in range(sample_count):
+      depth = rng.randint(5, 300)
+      alt_count = int(depth * rng.random() * 0.6)
+      samples.append((depth - alt_count, alt_count, alt_count / depth))
+    yield chrom, pos, ref, alt, rng.choice(['PASS'] * 7 + ['t_lod', 'clustered_events', 'str_contraction']), rng.randint(10, 600), csq(rng, alt), samples
+
+def write_mutect2(vcf_fh, tsv_fh, rng, sites, sample_count):
+  names = mutect2_sample_names(sample_count)
+  vcf_fh.write('##fileformat=VCFv4.2\n##source=Mutect2\n')
+  vcf_fh.write(contigs())
+  vcf_fh.write('##FILTER=<ID=PASS,Description="All filters passed">\n##FILTER=<ID=t_lod,Description="Tumor does not meet likelihood threshold">\n##FILTER=<ID=clustered_events,Description="Clustered events observed in the tumor">\n##FILTER=<ID=str_contraction,Description="Site filtered due to contraction of short tandem repeat region">\n')
+  vcf_fh.write('##INFO=<ID=DP,Number=1,Type=Integer,Description="Approximate read depth">\n##INFO=<ID=BAM_DEPTH,Number=1,Type=Integer,Description="Depth from the bam">\n##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations from Ensembl VEP. Format: {}">\n'.format(VEP_FORMAT))
+  vcf_fh.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">\n##FORMAT=<ID=AF,Number=A,Type=Float,Description="Allele fractions">\n##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Approximate read depth">\n')
+  vcf_fh.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}\n'.format('\t'.join(names)))
+  tsv_fh.write('CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tBAM_DEPTH\tCSQ\tDP\tVCF_SAMPLE_ID\tAD\tAF\tDP\tGT\n')
+  for chrom, pos, ref, alt, filter_value, dp, consequence, samples in mutect2_records(rng, sites, sample_count):
+    formatted = ['0/1:{},{}:{:.3f}:{}'.format(ad_ref, ad_alt, af, ad_ref + ad_alt) for ad_ref, ad_alt, af in samples]
+    vcf_fh.write('{}\t{}\t.\t{}\t{}\t.\t{}\tDP={};BAM_DEPTH={};CSQ={}\tGT:AD:AF:DP\t{}\n'.format(chrom, pos, ref, alt, filter_value, dp, dp, consequence, '\t'.join(formatted)))
+    for name, (ad_ref, ad_alt, af) in zip(names, samples):
+      tsv_fh.write('{}\t{}\t.\t{}\t{}\t.\t{}\t{}\t{}\t{}\t{}\t{},{}\t{:.3f}\t{}\t0/1\n'.format(chrom, pos, ref, alt, filter_value, dp, consequence, dp, name, ad_ref, ad_alt, af, ad_ref + ad_alt))
+
+def write_clinvar(fh, rng, sites):
+  fh.write('##fileformat=VCFv4.1\n##source=ClinVar\n')
+  fh.write(contigs())
+  fh.write('##INFO=<ID=CLNDN,Number=.,Type=String,Description="Disease name">\n##INFO=<ID=CLNSIG,Number=.,Type=String,Description="Clinical significance">\n')
+  fh.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+  for idx, (chrom, pos) in enumerate(sites):
+    ref, alt = snv(rng)
+    fh.write('{}\t{}\t{}\t{}\t{}\t.\t.\tCLNDN=Hereditary_cancer-predisposing_syndrome;CLNSIG={}\n'.format(chrom, pos, idx, ref, alt, rng.choice(['Benign', 'Likely_benign', 'Uncertain_significance', 'Pathogenic'])))
+
+def write_cosmic(fh, rng, sites):
+  fh.write('##fileformat=VCFv4.1\n##source=COSMIC\n')
+  fh.write(contigs())
+  fh.write('##INFO=<ID=CNT,Number=1,Type=Integer,Description="How many samples have this mutation">\n')
+  fh.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+  for idx, (chrom, pos) in enumerate(sites):
+    ref, alt = snv(rng)
+    fh.write('{}\t{}\tCOSV{}\t{}\t{}\t.\t.\tCNT={}\n'.format(chrom, pos, idx, ref, alt, rng.randint(1, 500)))
+
+def write_cadd(fh, rng, sites):
+  fh.write('##fileformat=VCFv4.1\n##source=CADD\n')
+  fh.write(contigs())
+  fh.write('##INFO=<ID=phred,Number=1,Type=Float,Description="CADD phred score">\n')
+  fh.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+  for chrom, pos in sites:
+    ref = rng.choice(BASES)
+    for alt in [base for base in BASES if base != ref]:
+      fh.write('{}\t{}\t.\t{}\t{}\t.\t.\tphred={:.3f}\n'.format(chrom, pos, ref, alt, rng.random() * 40))
+
+def write_revel(fh, rng, sites):
+  fh.write('chr,hg19_pos,grch38_pos,ref,alt,aaref,aaalt,REVEL\n')
+  for chrom, pos in sites:
+    ref = rng.choice(BASES)
+    for alt in [base for base in BASES if base != ref]:
+      fh.write('{},{},{},{},{},A,V,{:.3f}\n'.format(chrom, pos, pos + 1000, ref, alt, rng.random()))
+
+def write_maf(fh, rng, sites, samples):
+  fh.write('#version 2.4\n')
+  fh.write('Hugo_Symbol\tChromosome\tStart_Position\tEnd_Position\tVariant_Type\tReference_Allele\tTumor_Seq_Allele1\tTumor_Seq_Allele2\tTumor_Sample_Barcode\n')
+  for chrom, pos in sites:
+    if rng.random() < 0.3:
+      ref, alt = '-', ''.join([rng.choice(BASES) for _ in range(rng.randint(1, 4))])
+      variant_type = 'INS'
+    elif rng.random() < 0.3:
+      ref, alt = ''.join([rng.choice(BASES) for _ in range(rng.randint(1, 4))]), '-'
+      variant_type = 'DEL'
+    else:
+      ref, alt = snv(rng)
+      variant_type = 'SNP'
+    fh.write('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(rng.choice(GENES), chrom, pos, pos + len(ref), variant_type, ref, ref, alt, rng.choice(samples)))
+
+def write_fastq(fh, rng, reads, read_length=150):
+  for idx in range(reads):
+    sequence = ''.join(rng.choices(BASES, k=read_length))
+    fh.write('@read{}/1\n{}\n+\n{}\n'.format(idx, sequence, 'F' * read_length))
+
+def write_bed(fh, intervals, name=None):
+  for idx, (chrom, start, end) in enumerate(intervals):
+    if name is None:
+      fh.write('{}\t{}\t{}\n'.format(chrom, start, end))
+    else:
+      fh.write('{}\t{}\t{}\t{}{}\n'.format(chrom, start, end, name, idx))
+
+def generate(output_dir, scale, seed, records=None, reads=None, samples=None):
+  '''
+    writes the inputs to output_dir and returns the manifest, reusing existing files generated with the same settings
+  '''
+  settings = dict(SCALES[scale])
+  for name, value in (('records', records), ('reads', reads), ('samples', samples)):
+    if value is not None:
+      settings[name] = value
+  manifest_fn = os.path.join(output_dir, 'manifest.json')
+  key = {'version': VERSION, 'scale': scale, 'seed': seed, 'settings': settings}
+  if os.path.exists(manifest_fn):
+    manifest = json.load(open(manifest_fn, 'r'))
+    if manifest['key'] == key:
+      logging.info('using existing %s data in %s', scale, output_dir)
+      return manifest
+
+  logging.info('generating %s data in %s with seed %i: %s', scale, output_dir, seed, settings)
+  os.makedirs(output_dir, exist_ok=True)
+  rng = random.Random(seed)
+  count = settings['records']
+  targets = capture(rng, max(1000, count))
+  files = {}
+  def path(name):
+    files[name.split('.')[0]] = name
+    return os.path.join(output_dir, name)
+
+  with open(path('capture.bed'), 'w') as fh:
+    write_bed(fh, targets, 'target')
+  repeat_sites = positions(rng, targets, count, on_target=0.9)
+  with open(path('repeats.bed'), 'w') as fh:
+    write_bed(fh, [(chrom, pos - rng.randint(0, 10), pos + rng.randint(5, 30)) for chrom, pos in repeat_sites])
+
+  somatic_sites = positions(rng, targets, count)
+  shared_sites = sorted(rng.sample(somatic_sites, count // 2), key=somatic_sites.index)
+  with open(path('strelka_snvs.vcf'), 'w') as fh:
+    write_strelka_snvs(fh, rng, somatic_sites)
+  with open(path('strelka_indels.vcf'), 'w') as fh:
+    write_strelka_indels(fh, rng, positions(rng, targets, count))
+  mutect2_sites = sorted(set(shared_sites + positions(rng, targets, count - len(shared_sites))), key=lambda x: ([c for c, _ in CHROMOSOMES].index(x[0]), x[1]))
+  with open(path('mutect2.vcf'), 'w') as vcf_fh, open(path('mutect2.tsv'), 'w') as tsv_fh:
+    write_mutect2(vcf_fh, tsv_fh, rng, mutect2_sites, settings['samples'])
+
+  source_sites = sorted(set(rng.sample(mutect2_sites, len(mutect2_sites) // 2) + positions(rng, targets, count)), key=lambda x: ([c for c, _ in CHROMOSOMES].index(x[0]), x[1]))
+  with open(path('clinvar.vcf'), 'w') as fh:
+    write_clinvar(fh, rng, source_sites)
+  with open(path('cosmic.vcf'), 'w') as fh:
+    write_cosmic(fh, rng, source_sites)
+  with open(path('cadd.vcf'), 'w') as fh:
+    write_cadd(fh, rng, source_sites)
+  with gzip.open(path('revel.csv.gz'), 'wt') as fh:
+    write_revel(fh, rng, source_sites)
+  with gzip.open(path('somatic.maf.gz'), 'wt') as fh:
+    write_maf(fh, rng, positions(rng, targets, count), ['TCGA-{:02d}'.format(idx) for idx in range(max(1, settings['samples'] // 2))])
+  with gzip.open(path('reads_R1.fastq.gz'), 'wt') as fh:
+    write_fastq(fh, rng, settings['reads'])
+
+  manifest = {'key': key, 'files': files, 'records': {'vcf': count, 'mutect2': len(mutect2_sites), 'mutect2_tsv': len(mutect2_sites) * settings['samples'], 'sources': len(source_sites), 'reads': settings['reads'], 'targets': len(targets)}}
+  with open(manifest_fn, 'w') as fh:
+    json.dump(manifest, fh, indent=2)
+  logging.info('generating %s data: done', scale)
+  return manifest
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Generate synthetic inputs for benchmarking')
+  parser.add_argument('--output_dir', required=True, help='where to write the inputs')
+  parser.add_argument('--scale', required=False, default='exome', choices=sorted(SCALES), help='size of the inputs')
+  parser.add_argument('--seed', required=False, type=int, default=1, help='random seed')
+  parser.add_argument('--records', required=False, type=int, help='override records per vcf')
+  parser.add_argument('--reads', required=False, type=int, help='override reads in the fastq')
+  parser.add_argument('--samples', required=False, type=int, help='override samples in the mutect2 vcf')
+  parser.add_argument('--verbose', action='store_true', help='more logging')
+  args = parser.parse_args()
+  if args.verbose:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
+  else:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+  generate(args.output_dir, args.scale, args.seed, args.records, args.reads, args.samples)
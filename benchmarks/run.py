@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+'''
+  time the src/ scripts on synthetic data and keep a history of the results
+  - each case runs the script as the pipeline does, in its own process, with stdin and stdout redirected to files
+  - records per second and peak resident memory of the process are appended to the history with the current commit
+  - usage: benchmarks/run.py --scales exome wgs --compare
+'''
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+import generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+
+# name: (script, args, stdin, records) where args and stdin are formatted with the data and scratch directories
+# and records is the manifest count of what the case processes
+CASES = {
+  'vcf2tsv': ('vcf2tsv.py', ['{data}/mutect2.vcf', '--keep_rejected_calls'], None, 'mutect2'),
+  'vcf2tsv_projected': ('vcf2tsv.py', ['{data}/mutect2.vcf', '--keep_rejected_calls', '--samples', 'TUMOUR', '--columns', 'CSQ', 'AD', 'DP'], None, 'mutect2'),
+  'extract_vep': ('extract_vep.py', ['--header', generate.VEP_FORMAT, '--transcript', 'CANONICAL=YES', '--override', 'POLD1=Feature|NM_002691.4'], '{data}/mutect2.tsv', 'mutect2_tsv'),
+  'annotate_vcf_clinvar': ('annotate_vcf.py', ['--vcf', '{data}/clinvar.vcf', '--fields', 'CLNDN', 'CLNSIG', '--vcfs', '{scratch}/mutect2.vcf', '--suffix', 'clinvar'], None, 'mutect2'),
+  'annotate_vcf_revel': ('annotate_vcf.py', ['--vcf', '{data}/revel.csv.gz', '--is_tsv', '--tsv_zipped', '--tsv_chrom_column', 'chr', '--tsv_pos_column', 'hg19_pos', '--tsv_ref_column', 'ref', '--tsv_alt_column', 'alt', '--fields', 'REVEL', '--vcfs', '{scratch}/mutect2.vcf', '--suffix', 'revel'], None, 'mutect2'),
+  'annotate_vcf_cadd': ('annotate_vcf.py', ['--vcf', '{data}/cadd.vcf', '--fields', 'phred', '--rename', 'phred=cadd_phred', '--vcfs', '{scratch}/mutect2.vcf', '--suffix', 'cadd'], None, 'mutect2'),
+  'filter_af': ('filter_af.py', ['--sample', 'TUMOUR', '--af', '0.05', '--dp', '10', '--dp_field', 'BAM_DEPTH'], '{data}/mutect2.vcf', 'mutect2'),
+  'mutation_rate': ('mutation_rate.py', ['--vcfs', '{data}/strelka_snvs.vcf', '{data}/strelka_indels.vcf', '--bed', '{data}/capture.bed', '--sample_name', 'TUMOR', '--pass_only'], None, 'vcf'),
+  'msiseq': ('msiseq.py', ['--vcfs', '{data}/strelka_snvs.vcf', '{data}/strelka_indels.vcf', '--repeats', '{data}/repeats.bed', '--capture', '{data}/capture.bed'], None, 'vcf'),
+  'msiseq_maf': ('msiseq.py', ['--is_maf', '--vcfs', '{data}/somatic.maf.gz', '--repeats', '{data}/repeats.bed', '--capture', '{data}/capture.bed'], None, 'vcf'),
+  'annotate_af': ('annotate_af.py', ['TUMOR', '{data}/strelka_snvs.vcf'], None, 'vcf'),
+  'annotate_indel_af': ('annotate_indel_af.py', ['--sample', 'TUMOR', '--vcf', '{data}/strelka_indels.vcf'], None, 'vcf'),
+  'annotate_cosmic': ('annotate_cosmic.py', ['--cosmic', '{data}/cosmic.vcf'], '{data}/mutect2.vcf', 'mutect2'),
+  'run_stages': ('run_stages.py', ['--input', '{data}/strelka_snvs.vcf', 'annotate_af,cosmic,filter_af', ':', 'TUMOR', ':', '--cosmic', '{data}/cosmic.vcf', ':', '--sample', 'TUMOR', '--info_af', '--af', '0.05', '--dp', '10'], None, 'vcf'),
+  'vcf_intersect': ('vcf_intersect.py', ['--allowed_filters', 'str_contraction', 'LowDepth', '--inputs', '{data}/strelka_snvs.vcf', '{data}/mutect2.vcf'], None, 'vcf'),
+  'max_coverage': ('max_coverage.py', ['--bed', '{data}/capture.bed', '--fastqs', '{data}/reads_R1.fastq.gz'], None, 'reads')
+}
+
+def commit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+  except (OSError, subprocess.CalledProcessError):
+    return 'unknown'
+
+def run_case(name, data_dir, scratch_dir, records):
+  '''
+    runs a case in a child process and returns its result
+  '''
+  script, args, stdin_fn, record_name = CASES[name]
+  shutil.rmtree(scratch_dir, ignore_errors=True)
+  os.makedirs(scratch_dir)
+  # annotate_vcf writes next to its inputs so give it a copy in scratch
+  os.symlink(os.path.join(data_dir, 'mutect2.vcf'), os.path.join(scratch_dir, 'mutect2.vcf'))
+  args = [arg.format(data=data_dir, scratch=scratch_dir) for arg in args]
+  command = [sys.executable, os.path.join(SRC, script)] + args
+
+  logging.debug('running %s', ' '.join(command))
+  stdin = open(stdin_fn.format(data=data_dir), 'rb') if stdin_fn is not None else subprocess.DEVNULL
+  with open(os.path.join(scratch_dir, 'stdout'), 'wb') as stdout, open(os.path.join(scratch_dir, 'stderr'), 'wb') as stderr:
+    start = time.time()
+    process = subprocess.Popen(command, stdin=stdin, stdout=stdout, stderr=stderr, cwd=ROOT)
+    # wait4 gives the resource usage of this child alone
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.time() - start
+  process.returncode = os.waitstatus_to_exitcode(status)
+  if stdin_fn is not None:
+    stdin.close()
+
+  if process.returncode != 0:
+    logging.warn('%s failed with exit code %i: %s', name, process.returncode, ' '.join(open(os.path.join(scratch_dir, 'stderr'), 'r').readlines()[-5:]).strip())
+    return None
+  count = records[record_name]
+  return {'case': name, 'records': count, 'seconds': round(seconds, 3), 'records_per_sec': round(count / seconds, 1), 'peak_rss_mb': round(usage.ru_maxrss / 1024, 1)}
+
+def previous_run(history, current_commit):
+  '''
+    the latest run from a different commit
+  '''
+  for entry in reversed(history):
+    if entry['commit'] != current_commit:
+      return entry
+  return None
+
+def compare(entry, previous):
+  sys.stdout.write('scale\tcase\trecords_per_sec\tpeak_rss_mb\tprevious_records_per_sec\tprevious_peak_rss_mb\tspeedup\n')
+  before = {}
+  if previous is not None:
+    before = dict(((result['scale'], result['case']), result) for result in previous['results'])
+  for result in entry['results']:
+    old = before.get((result['scale'], result['case']))
+    if old is None:
+      sys.stdout.write('{}\t{}\t{}\t{}\t\t\t\n'.format(result['scale'], result['case'], result['records_per_sec'], result['peak_rss_mb']))
+    else:
+      sys.stdout.write('{}\t{}\t{}\t{}\t{}\t{}\t{:.2f}\n'.format(result['scale'], result['case'], result['records_per_sec'], result['peak_rss_mb'], old['records_per_sec'], old['peak_rss_mb'], result['records_per_sec'] / old['records_per_sec']))
+
+def main(scales, cases, seed, data_dir, history_fn, repeats, show_comparison):
+  entry = {'commit': commit(), 'date': datetime.datetime.now().isoformat(timespec='seconds'), 'host': platform.node(), 'python': platform.python_version(), 'seed': seed, 'results': []}
+  for scale in scales:
+    scale_dir = os.path.join(data_dir, '{}_{}'.format(scale, seed))
+    # generating in another process keeps this one small, as children start with the peak rss of their parent
+    subprocess.check_call([sys.executable, os.path.join(ROOT, 'benchmarks', 'generate.py'), '--output_dir', scale_dir, '--scale', scale, '--seed', str(seed)])
+    manifest = json.load(open(os.path.join(scale_dir, 'manifest.json'), 'r'))
+    for name in cases:
+      # best of repeats, as slower runs are usually interference from something else
+      best = None
+      for _ in range(repeats):
+        result = run_case(name, os.path.abspath(scale_dir), os.path.abspath(os.path.join(data_dir, 'scratch')), manifest['records'])
+        if result is not None and (best is None or result['seconds'] < best['seconds']):
+          best = result
+      if best is not None:
+        best['scale'] = scale
+        entry['results'].append(best)
+        logging.info('%s %s: %i records in %.1fs, %.0f records/s, peak rss %.0fMB', scale, name, best['records'], best['seconds'], best['records_per_sec'], best['peak_rss_mb'])
+  shutil.rmtree(os.path.join(data_dir, 'scratch'), ignore_errors=True)
+
+  history = []
+  if os.path.exists(history_fn):
+    history = json.load(open(history_fn, 'r'))
+  previous = previous_run(history, entry['commit'])
+  history.append(entry)
+  with open(history_fn, 'w') as fh:
+    json.dump(history, fh, indent=2)
+  logging.info('added %i results to %s', len(entry['results']), history_fn)
+
+  if show_comparison:
+    compare(entry, previous)
+  failed = len(scales) * len(cases) - len(entry['results'])
+  return 1 if failed > 0 else 0
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the pipeline scripts on synthetic data')
+  parser.add_argument('--scales', required=False, nargs='+', default=['exome'], choices=sorted(generate.SCALES), help='data sizes to run')
+  parser.add_argument('--cases', required=False, nargs='+', default=sorted(CASES), choices=sorted(CASES), help='scripts to run')
+  parser.add_argument('--seed', required=False, type=int, default=1, help='random seed for the data')
+  parser.add_argument('--data', required=False, default=os.path.join(ROOT, 'benchmarks', 'data'), help='where to generate data')
+  parser.add_argument('--history', required=False, default=os.path.join(ROOT, 'benchmarks', 'history.json'), help='results are appended here')
+  parser.add_argument('--repeats', required=False, type=int, default=1, help='run each case this many times and keep the fastest')
+  parser.add_argument('--compare', action='store_true', help='write a comparison with the last run from another commit to stdout')
+  parser.add_argument('--verbose', action='store_true', help='more logging')
+  args = parser.parse_args()
+  if args.verbose:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
+  else:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+  sys.exit(main(args.scales, args.cases, args.seed, args.data, args.history, args.repeats, args.compare))
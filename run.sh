@@ -28,14 +28,14 @@ chmod -R +w out
 # dry
 echo "dry run..."
 #snakemake --verbose -n -j $MAXJOBS --cluster-config cfg/cluster.yaml --rerun-incomplete --jobname "${PREFIX}-{rulename}-{jobid}" --cluster "sbatch -A {cluster.account} -p {cluster.partition} --ntasks={cluster.n}  -t {cluster.time} --mem={cluster.memory} --output=log/slurm-%j.out --error=log/slurm-%j.out"
-snakemake --reason --verbose -n -j $MAXJOBS --cluster-config cfg/cluster.yaml --rerun-incomplete --jobname "${PREFIX}-{rulename}-{jobid}" --cluster "sbatch -A {cluster.account} --ntasks={cluster.n}  -t {cluster.time} --mem={cluster.memory} --output=log/slurm-%j.out --error=log/slurm-%j.out"
+snakemake --reason --verbose -n -j $MAXJOBS --cluster-config cfg/cluster.yaml --rerun-incomplete --jobname "${PREFIX}-{rulename}-{jobid}" --cluster "sbatch -A {cluster.account} --ntasks={cluster.n}  -t {resources.runtime} --mem={resources.mem_mb} --output=log/slurm-%j.out --error=log/slurm-%j.out"
 echo "return to start pipeline, ctrl-c to quit"
 read -n 1 -p "Continue?"
 
 # real
 echo "starting live run at $(date)..."
 #snakemake -p -j $MAXJOBS --cluster-config cfg/cluster.yaml --stats log/snakemake_stats.json --rerun-incomplete --jobname "${PREFIX}-{rulename}-{jobid}" --cluster "sbatch -A {cluster.account} -p {cluster.partition} --ntasks={cluster.n}  -t {cluster.time} --mem={cluster.memory} --output=log/slurm-%j.out --error=log/slurm-%j.out"
-snakemake --reason -p -j $MAXJOBS --cluster-config cfg/cluster.yaml --stats log/snakemake_stats.json --rerun-incomplete --jobname "${PREFIX}-{rulename}-{jobid}" --cluster "sbatch -A {cluster.account} -p {cluster.partition} --ntasks={cluster.n} --nodes={cluster.nodes} -t {cluster.time} --mem={cluster.memory} --output=log/slurm-%j.out --error=log/slurm-%j.out"
+snakemake --reason -p -j $MAXJOBS --cluster-config cfg/cluster.yaml --stats log/snakemake_stats.json --rerun-incomplete --jobname "${PREFIX}-{rulename}-{jobid}" --cluster "sbatch -A {cluster.account} -p {cluster.partition} --ntasks={cluster.n} --nodes={cluster.nodes} -t {resources.runtime} --mem={resources.mem_mb} --output=log/slurm-%j.out --error=log/slurm-%j.out"
 
 echo "finished at $(date)"
 
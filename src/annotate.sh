@@ -17,7 +17,7 @@ REFERENCE=$3
 THREADS=$4
 ROOT=$5
 
-THREADS=1 # ignore threads parameter due to vep errors
+THREADS=1 # ignore threads parameter due to vep errors, src/annotate_parallel.py runs several of these on chunks instead
 
 # 94
 #VEPPATH=/data/projects/punim0567/programs/vep/ensembl-vep/
@@ -6,11 +6,13 @@
 import argparse
 import csv
 import logging
-import sys
 
 import cyvcf2
 
-def main(cosmic):
+import progress
+import vcf_io
+
+def read_cosmic(cosmic):
   logging.info('reading cosmic file...')
   #cds = collections.defaultdict(int)
   #aa = collections.defaultdict(int)
@@ -27,40 +29,61 @@ def main(cosmic):
 
   counts = {}
   total = 0
+  counter = progress.Progress('reading {}'.format(cosmic), unit='variants')
   for total, variant in enumerate(cyvcf2.VCF(cosmic)):
+    counter.update()
     position = '{}:{} {}/{}'.format(variant.CHROM, variant.POS, variant.REF, variant.ALT[0])
     counts[position] = variant.INFO['CNT'] # just overwrite repeats
-    if total % 100000 == 0:
-      logging.debug('read %i lines from COSMIC, last was %s: %i', total, position, counts[position])
+  counter.finish()
+
+  return counts
 
-  logging.info('annotating vcf...')
+def add_arguments(parser):
+  parser.add_argument('--cosmic', required=True, help='cosmic file')
 
-  vcf_in = cyvcf2.VCF('-')
+def stage(vcf_in, cosmic):
+  '''
+    adds cosmic to the header of vcf_in and returns a generator function that sets it on each record
+  '''
+  counts = read_cosmic(cosmic)
   vcf_in.add_info_to_header({'ID': 'cosmic', 'Description': 'Number of times position seen in COSMIC', 'Type':'Character', 'Number': '1'})
-  sys.stdout.write(vcf_in.raw_header)
-  total = seen = 0
-  summary = {'max': 0, 'sum': 0, 'maxpos': None}
-  for total, variant in enumerate(vcf_in):
-    position = '{}:{} {}/{}'.format(variant.CHROM, variant.POS, variant.REF, variant.ALT[0])
-    if position in counts:
-      variant.INFO['cosmic'] = counts[position]
-      seen += 1
-      if counts[position] > summary['max']:
-        summary['max'] = counts[position]
-        summary['maxpos'] = position
-      summary['sum'] += counts[position]
-    else:
-      variant.INFO['cosmic'] = 0 # not seen
-    if total % 1000 == 0:
-      logging.debug('read %i lines from vcf, last was %s', total, position)
-
-    sys.stdout.write(str(variant))
-
-  logging.info('done updating %i records. saw %i cosmic variants. max count %i at %s. total count %i', total, seen, summary['max'], summary['maxpos'], summary['sum'])
+
+  def transform(variants):
+    logging.info('annotating vcf...')
+    total = seen = 0
+    summary = {'max': 0, 'sum': 0, 'maxpos': None}
+    counter = progress.Progress('annotating vcf', unit='variants', details=lambda: 'saw {} cosmic variants'.format(seen))
+    for total, variant in enumerate(variants):
+      counter.update()
+      position = '{}:{} {}/{}'.format(variant.CHROM, variant.POS, variant.REF, variant.ALT[0])
+      if position in counts:
+        variant.INFO['cosmic'] = counts[position]
+        seen += 1
+        if counts[position] > summary['max']:
+          summary['max'] = counts[position]
+          summary['maxpos'] = position
+        summary['sum'] += counts[position]
+      else:
+        variant.INFO['cosmic'] = 0 # not seen
+
+      yield variant
+    counter.finish()
+    logging.info('done updating %i records. saw %i cosmic variants. max count %i at %s. total count %i', total, seen, summary['max'], summary['maxpos'], summary['sum'])
+
+  return transform
+
+def main(cosmic, output='-', threads=1):
+  vcf_in = vcf_io.reader('-', threads)
+  transform = stage(vcf_in, cosmic)
+  vcf_out = vcf_io.writer(output, vcf_in, threads)
+  for variant in transform(vcf_in):
+    vcf_out.write_record(variant)
+  vcf_out.close()
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Annotate VCF with COSMIC data')
-  parser.add_argument('--cosmic', required=True, help='cosmic file')
+  add_arguments(parser)
+  vcf_io.add_arguments(parser)
   parser.add_argument('--verbose', action='store_true', help='more logging')
   args = parser.parse_args()
   if args.verbose:
@@ -68,6 +91,6 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-  main(args.cosmic)
+  progress.run(main, args.cosmic, args.output, args.threads)
 
 
@@ -2,79 +2,122 @@
 '''
   adds AF and DP to strelka output
   - assume that this is a single sample
+  - the caller (pindel or strelka) is determined once from the FORMAT header
+  - records are processed in chunks so AF and DP are calculated with numpy
 '''
 
 import argparse
 import logging
-import sys
 
-import cyvcf2
-
-def main(sample_name):
-  logging.info('reading vcf from stdin...')
-  vcf_in = cyvcf2.VCF('-')
+import numpy
+
+import progress
+import vcf_io
+
+CHUNK_SIZE = 10000
+
+def format_ids(vcf_in):
+  return set(h['ID'] for h in vcf_in.header_iter() if h['HeaderType'] == 'FORMAT')
+
+def values(chunk, tag, sample_id, width):
+  '''
+    sample_id of the tag for each variant in the chunk as a (len(chunk), width) array, 0 if missing
+  '''
+  result = numpy.zeros((len(chunk), width), dtype=float)
+  for idx, variant in enumerate(chunk):
+    value = variant.format(tag)
+    if value is not None:
+      result[idx] = value[sample_id][:width]
+  return result
+
+def pindel_af_dp(chunk, sample_id):
+  # pindel uses the first sample
+  dp = values(chunk, 'PR', 0, 1)[:, 0] + values(chunk, 'NR', 0, 1)[:, 0]
+  alt = values(chunk, 'PP', 0, 1)[:, 0] + values(chunk, 'NP', 0, 1)[:, 0]
+  af = numpy.divide(alt, dp, out=numpy.zeros_like(alt), where=dp > 0)
+  return af, dp
+
+def strelka_af_dp(chunk, sample_id):
+  tir = values(chunk, 'TIR', sample_id, 2).sum(axis=1)
+  tar = values(chunk, 'TAR', sample_id, 2).sum(axis=1)
+  total = tir + tar
+  if (total == 0).any():
+    logging.warn('No reads found for TIR or TAR for %i variants', (total == 0).sum())
+  af = numpy.divide(tir, total, out=numpy.zeros_like(tir), where=total > 0)
+  # depth over all samples
+  dp = numpy.array([numpy.sum(variant.format('DP')) if variant.format('DP') is not None else 0 for variant in chunk], dtype=int)
+  return af, dp
+
+def unknown_af_dp(chunk, sample_id):
+  logging.warn('Failed to add AF to %i variants', len(chunk))
+  return numpy.zeros(len(chunk)), numpy.zeros(len(chunk))
+
+def caller_for(vcf_in):
+  '''
+    choose the AF/DP calculation from the FORMAT fields in the header
+  '''
+  available = format_ids(vcf_in)
+  if all([x in available for x in ('PP', 'NP', 'PR', 'NR')]):
+    logging.info('pindel format detected')
+    return pindel_af_dp, False
+  if all([x in available for x in ('TAR', 'TIR')]):
+    logging.info('strelka format detected')
+    return strelka_af_dp, True
+  logging.warn('neither pindel nor strelka format detected')
+  return unknown_af_dp, False
+
+def main(sample_name, vcf_fn, output, threads):
+  logging.info('reading vcf from %s...', vcf_fn)
+  vcf_in = vcf_io.reader(vcf_fn, threads)
 
   vcf_in.add_info_to_header({'ID': 'AF', 'Description': 'Calculated allele frequency', 'Type':'Float', 'Number': '1'})
   vcf_in.add_info_to_header({'ID': 'DP', 'Description': 'Calculated depth', 'Type':'Float', 'Number': '1'})
   sample_id = vcf_in.samples.index(sample_name)
 
-  sys.stdout.write(vcf_in.raw_header)
+  calculate, int_dp = caller_for(vcf_in)
+
+  vcf_out = vcf_io.writer(output, vcf_in, threads)
 
   stats = { 'min_af': 1e6, 'max_af': -1, 'min_dp': 1e6, 'max_dp': -1, 'allowed': 0, 'denied': 0}
+
+  def write(chunk):
+    af, dp = calculate(chunk, sample_id)
+    for variant, variant_af, variant_dp in zip(chunk, af, dp):
+      variant.INFO["AF"] = float(variant_af)
+      variant.INFO["DP"] = int(variant_dp) if int_dp else float(variant_dp)
+      vcf_out.write_record(variant)
+
+    stats['min_af'] = min(stats['min_af'], af.min())
+    stats['max_af'] = max(stats['max_af'], af.max())
+    stats['min_dp'] = min(stats['min_dp'], dp.min())
+    stats['max_dp'] = max(stats['max_dp'], dp.max())
+    stats['allowed'] += len(chunk)
+    logging.debug('stats: %s.', ', '.join(['{}: {}'.format(x, stats[x]) for x in stats]))
+
+  counter = progress.Progress('reading {}'.format(vcf_fn), unit='variants')
+  chunk = []
   for variant in vcf_in:
-    ok = True
-
-    # pindel
-    if all([x in variant.FORMAT for x in ('PP', 'NP', 'PR', 'NR')]):
-      dp = variant.format('PR')[0][0] + variant.format('NR')[0][0]
-      af = (variant.format('PP')[0][0] + variant.format('NP')[0][0]) / dp
-      variant.INFO["AF"] = af
-      variant.INFO["DP"] = float(dp)
-
-    # strelka
-    elif all([x in variant.FORMAT for x in ('TAR', 'TIR')]):
-      tir = sum(variant.format('TIR')[sample_id])
-      tar = sum(variant.format('TAR')[sample_id])
-      if tir + tar == 0:
-        logging.warn('No reads found for TIR or TAR')
-        af = 0.0
-      else:
-        af = tir / (tir + tar)
-
-      dp = int(sum([sum(x) for x in variant.format('DP')]))
-      variant.INFO["AF"] = af
-      variant.INFO["DP"] = dp
-
-    else: # not strelka or pindel
-      logging.warn('Failed to add AF to variant')
-      af = 0.0
-      dp = 0.0
-
-    stats['min_af'] = min(stats['min_af'], af)
-    stats['max_af'] = max(stats['max_af'], af)
-    stats['min_dp'] = min(stats['min_dp'], dp)
-    stats['max_dp'] = max(stats['max_dp'], dp)
-
-    if ok:
-      sys.stdout.write(str(variant))
-      stats['allowed'] += 1
-    else:
-      stats['denied'] += 1
-
-    if (stats['allowed']) % 100000 == 0:
-      logging.debug('stats: %s.', ', '.join(['{}: {}'.format(x, stats[x]) for x in stats]))
-    
+    counter.update()
+    chunk.append(variant)
+    if len(chunk) == CHUNK_SIZE:
+      write(chunk)
+      chunk = []
+  if len(chunk) > 0:
+    write(chunk)
+  counter.finish()
+
+  vcf_out.close()
   logging.info('done. stats: %s.', ', '.join(['{}: {}'.format(x, stats[x]) for x in stats]))
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Extract samples from VCF')
   parser.add_argument('--verbose', action='store_true', help='more logging')
   parser.add_argument('--sample', required=True, help='sample name')
+  parser.add_argument('--vcf', required=False, default='-', help='input vcf (default stdin)')
+  vcf_io.add_arguments(parser)
   args = parser.parse_args()
   if args.verbose:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
-  main(args.sample)
-
-
+  progress.run(main, args.sample, args.vcf, args.output, args.threads)
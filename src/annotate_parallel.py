@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+'''
+  run an annotator such as vep on chunks of a vcf in parallel
+  - the input is split into chunks with similar numbers of records, only breaking between positions
+  - the command is run once per chunk with {input} and {output} replaced by the chunk filenames
+  - failed chunks are retried, then the outputs are merged in order under a combined header
+  - usage: annotate_parallel.py --input in.vcf.gz --output out.vcf.gz --jobs 4 --command 'src/annotate.sh {input} {output} reference/genome.fa 1 .'
+'''
+
+import argparse
+import concurrent.futures
+import gzip
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+
+def open_vcf(fn):
+  '''
+    plain or (b)gzipped vcf as text
+  '''
+  with open(fn, 'rb') as fh:
+    magic = fh.read(2)
+  if magic == b'\x1f\x8b':
+    return gzip.open(fn, 'rt')
+  return open(fn, 'r')
+
+def record_key(line):
+  fields = line.split('\t', 2)
+  return fields[0], fields[1]
+
+def split(input_fn, working, chunks):
+  '''
+    write up to chunks vcfs to working, returns their filenames
+  '''
+  header = []
+  total = 0
+  for line in open_vcf(input_fn):
+    if line.startswith('#'):
+      header.append(line)
+    else:
+      total += 1
+  logging.info('%s has %i records', input_fn, total)
+  chunks = max(1, min(chunks, total))
+
+  filenames = []
+  out = None
+  written = 0
+  last_key = None
+  for line in open_vcf(input_fn):
+    if line.startswith('#'):
+      continue
+    key = record_key(line)
+    # start the next chunk once this one has its share, but never between records at the same position
+    if out is None or (written >= total * len(filenames) / chunks and key != last_key):
+      if out is not None:
+        out.close()
+      filenames.append(os.path.join(working, 'chunk_{:04d}.vcf'.format(len(filenames) + 1)))
+      out = open(filenames[-1], 'w')
+      out.writelines(header)
+    out.write(line)
+    written += 1
+    last_key = key
+
+  if out is None:
+    # no records, the annotator still produces a header
+    filenames.append(os.path.join(working, 'chunk_0001.vcf'))
+    out = open(filenames[-1], 'w')
+    out.writelines(header)
+  out.close()
+  logging.info('split %i records into %i chunks', total, len(filenames))
+  return filenames
+
+def annotate(command, chunk_fn, retries):
+  '''
+    run command on chunk_fn, returns the output filename or raises after retries further attempts
+  '''
+  output_fn = '{}.out.vcf.gz'.format(chunk_fn[:-4])
+  args = [token.format(input=chunk_fn, output=output_fn) for token in shlex.split(command)]
+  for attempt in range(retries + 1):
+    log_fn = '{}.log'.format(chunk_fn[:-4])
+    with open(log_fn, 'w') as log:
+      code = subprocess.call(args, stdout=log, stderr=subprocess.STDOUT)
+    if code == 0 and os.path.exists(output_fn):
+      logging.debug('%s: done', chunk_fn)
+      return output_fn
+    logging.warn('%s: attempt %i of %i failed with exit code %i. last output: %s', chunk_fn, attempt + 1, retries + 1, code, ' '.join(open(log_fn, 'r').readlines()[-5:]).strip())
+  raise Exception('{} failed after {} attempts. see {}'.format(chunk_fn, retries + 1, log_fn))
+
+def header_key(line):
+  '''
+    header lines with the same key are the same definition, e.g. ##INFO=<ID=CSQ,... or ##VEP=...
+  '''
+  name, _, value = line[2:].partition('=')
+  if value.startswith('<ID='):
+    return name, value[4:].split(',', 1)[0].rstrip('>\n')
+  return name, None
+
+def merge(output_fns, output):
+  '''
+    header lines from every chunk in order of first appearance followed by the records of each chunk
+  '''
+  header = []
+  seen = set()
+  column_line = None
+  for fn in output_fns:
+    for line in open_vcf(fn):
+      if not line.startswith('#'):
+        break
+      if line.startswith('#CHROM'):
+        column_line = column_line or line
+      elif header_key(line) not in seen:
+        seen.add(header_key(line))
+        header.append(line)
+  header.append(column_line)
+
+  if output.endswith('.gz'):
+    import pysam
+    out = pysam.BGZFile(output, 'wb')
+    write = lambda line: out.write(line.encode('utf-8'))
+  elif output == '-':
+    out = None
+    write = sys.stdout.write
+  else:
+    out = open(output, 'w')
+    write = out.write
+
+  for line in header:
+    write(line)
+  records = 0
+  for fn in output_fns:
+    for line in open_vcf(fn):
+      if not line.startswith('#'):
+        write(line)
+        records += 1
+  if out is not None:
+    out.close()
+  logging.info('wrote %i records from %i chunks to %s', records, len(output_fns), output)
+
+def main(input_fn, output, command, jobs, chunks, retries, working, keep):
+  if working is None:
+    working = '{}.chunks'.format(output)
+  os.makedirs(working, exist_ok=True)
+  chunk_fns = split(input_fn, working, chunks or jobs)
+
+  logging.info('annotating %i chunks with %i jobs...', len(chunk_fns), jobs)
+  try:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+      output_fns = list(executor.map(lambda chunk_fn: annotate(command, chunk_fn, retries), chunk_fns))
+  except Exception as ex:
+    logging.error('annotation failed: %s', ex)
+    sys.exit(1)
+
+  merge(output_fns, output)
+  if not keep:
+    shutil.rmtree(working)
+  logging.info('done')
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Annotate a vcf in parallel chunks')
+  parser.add_argument('--input', required=True, help='vcf to annotate')
+  parser.add_argument('--output', required=True, help='annotated vcf, bgzipped if it ends with .gz')
+  parser.add_argument('--command', required=True, help='annotator command with {input} and {output} for each chunk, writing a plain or gzipped vcf')
+  parser.add_argument('--jobs', required=False, type=int, default=1, help='chunks to annotate at once')
+  parser.add_argument('--chunks', required=False, type=int, help='number of chunks (default jobs)')
+  parser.add_argument('--retries', required=False, type=int, default=2, help='times to retry a failed chunk')
+  parser.add_argument('--working', required=False, help='directory for chunks (default output.chunks)')
+  parser.add_argument('--keep', action='store_true', help='keep the chunks')
+  parser.add_argument('--verbose', action='store_true', help='more logging')
+  args = parser.parse_args()
+  if args.verbose:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
+  else:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+  main(args.input, args.output, args.command, args.jobs, args.chunks, args.retries, args.working, args.keep)
@@ -10,9 +10,11 @@ import csv
 import gzip
 import logging
 import os.path
-import sys
 
-import cyvcf2
+import numpy
+
+import progress
+import vcf_io
 
 CANONICAL='CANONICAL'
 CANONICAL_VALUE='YES'
@@ -23,15 +25,17 @@ def make_key(variant, alt):
   else:
     return (int(variant.POS), variant.REF, variant.ALT[0])
 
-def annotate_vcf(annotations, fields, vcf_in, vcf_out, new_names):
+def annotate_vcf(annotations, fields, vcf_in, output, new_names, threads=1):
     for field in fields:
       vcf_in.add_info_to_header({'ID': new_names.get(field, field), 'Description': 'Annotated field {}'.format(new_names.get(field, field)), 'Type':'Character', 'Number': '1'})
-    vcf_out.write(vcf_in.raw_header)
+    vcf_out = vcf_io.writer(output, vcf_in, threads)
   
     annotated = 0
     count = 0
     seen = set()
+    counter = progress.Progress('annotating', unit='variants', details=lambda: '{} annotated'.format(annotated))
     for count, variant in enumerate(vcf_in):
+      counter.update()
       chr = variant.CHROM.replace('chr', '')
       if chr in annotations:
         key = make_key(variant, variant.ALT[0]) #'{}/{}/{}'.format(variant.POS, variant.REF, variant.ALT[0])
@@ -49,24 +53,22 @@ def annotate_vcf(annotations, fields, vcf_in, vcf_out, new_names):
         if chr not in seen:
           seen.add(chr)
           logging.warn('chromosome %s not seen in annotations', chr)
-      vcf_out.write(str(variant))
-      if (count + 1) % 100000 == 0:
-        logging.info('reading %s: %i lines processed %i annotated', chr, count + 1, annotated)
+      vcf_out.write_record(variant)
+    counter.finish()
     
+    vcf_out.close()
     logging.info('done. annotated %i of %i variants', annotated, count)
 
 
-def main(vcf_in, vcfs, fields, definitions, suffix, rename, no_overwrite):
-  logging.info('reading source vcf...')
-
-  new_names = {}
-  if rename is not None:
-    for r in rename:
-      src, dest = r.split('=')
-      new_names[src] = dest
-
+def vcf_annotations(vcf_in, fields):
+  '''
+    chrom -> key -> values of fields from a vcf
+  '''
   annotations = {}
+  # annotation sources such as cadd have billions of records
+  counter = progress.Progress('reading source', every=10000000, unit='records')
   for count, variant in enumerate(vcf_in):
+    counter.update()
     chr = variant.CHROM.replace('chr', '')
     if chr not in annotations:
       annotations[chr] = {}
@@ -114,18 +116,31 @@ def main(vcf_in, vcfs, fields, definitions, suffix, rename, no_overwrite):
     #      annotations[chr][key].append(variant.INFO[name])
     #except KeyError:
     #  logging.debug('line %i %s:%i: extended fields not found', count, chr, variant.POS)
-
-    if (count + 1) % 10000000 == 0:
-      logging.info('%i lines...', count + 1)
+  counter.finish()
   logging.debug('reading %s: %i lines processed', chr, count + 1)
+  return annotations
+
+def main(source, tsv_format, vcfs, fields, definitions, suffix, rename, no_overwrite, output='-', threads=1):
+  logging.info('reading source %s...', source)
+
+  new_names = {}
+  if rename is not None:
+    for r in rename:
+      src, dest = r.split('=')
+      new_names[src] = dest
 
-  logging.info('reading src vcf: done')
+  if tsv_format is None:
+    annotations = vcf_annotations(vcf_io.reader(source, threads), fields)
+  else:
+    annotations = tsv_annotations(source, tsv_format, fields, query_chromosomes(vcfs))
+
+  logging.info('reading source: done')
 
   # now annotate input
   if vcfs is None:
     logging.info('reading from stdin...')
-    vcf_in = cyvcf2.VCF('-')
-    annotate_vcf(annotations, fields, vcf_in, sys.stdout, new_names)
+    vcf_in = vcf_io.reader('-', threads)
+    annotate_vcf(annotations, fields, vcf_in, output, new_names, threads)
 
   else:
     logging.info('processing %i vcfs...', len(vcfs))
@@ -136,12 +151,8 @@ def main(vcf_in, vcfs, fields, definitions, suffix, rename, no_overwrite):
         continue
 
       logging.info('reading from {} and writing to {}...'.format(vcf_fn, vcf_out_fn))
-      vcf_in = cyvcf2.VCF(vcf_fn)
-      if vcf_out_fn.endswith('.gz'):
-        vcf_out = gzip.open(vcf_out_fn, 'wt')
-      else:
-        vcf_out = open(vcf_out_fn, 'w')
-      annotate_vcf(annotations, fields, vcf_in, vcf_out, new_names)
+      vcf_in = vcf_io.reader(vcf_fn, threads)
+      annotate_vcf(annotations, fields, vcf_in, vcf_out_fn, new_names, threads)
       if vcf_count % 100 == 0:
         logging.debug('processed %i of %i vcfs...', vcf_count, len(vcfs))
 
@@ -151,22 +162,111 @@ def open_file(fn, is_gzipped):
   else:
     return open(fn, 'rt')
 
-def tsv_to_vcf(vcf, chrom_col, pos_col, ref_col, alt_col, delimiter, is_zipped, fields):
+# columns of a tsv annotation source
+TsvFormat = collections.namedtuple('TsvFormat', 'chrom pos ref alt delimiter is_zipped')
 
-  Variant = collections.namedtuple('Variant', 'CHROM POS REF ALT INFO')
+def query_chromosomes(vcfs):
+  '''
+    chromosomes of the vcfs to annotate without the chr prefix, or None if not known
+  '''
+  if vcfs is None:
+    return None # stdin
+  result = set()
+  for vcf_fn in vcfs:
+    seqnames = vcf_io.reader(vcf_fn).seqnames
+    if len(seqnames) == 0:
+      return None
+    result.update([seqname.replace('chr', '') for seqname in seqnames])
+  return result
 
-  # enumeration a maf into a variant
-  logging.debug('reading %s as tsv...', vcf)
-  for line, row in enumerate(csv.DictReader(open_file(vcf, is_zipped), delimiter=delimiter)):
-    chrom = row[chrom_col].replace('chr', '')
-    pos = int(row[pos_col])
-    ref = row[ref_col]
-    alt = row[alt_col]
-    info = {}
-    for field in fields:
-      info[field] = row[field]
+def tsv_blocks(fn, columns, delimiter, is_zipped, block_size=1<<24):
+  '''
+    the named columns of a tsv as lists, about block_size bytes of the file at a time
+    a block is split in one go and the columns taken as slices, unless its rows are quoted or ragged
+  '''
+  fh = open_file(fn, is_zipped)
+  header = next(csv.reader([fh.readline()], delimiter=delimiter))
+  missing = [column for column in columns if column not in header]
+  if len(missing) > 0:
+    raise ValueError('{}: columns not found: {}'.format(fn, ', '.join(missing)))
+  indexes = [header.index(column) for column in columns]
+  width = len(header)
+  while True:
+    text = fh.read(block_size)
+    if text == '':
+      break
+    text = (text + fh.readline()).replace('\r', '').rstrip('\n')
+    if text == '':
+      continue
+    rows = text.count('\n') + 1
+    fields = text.replace('\n', delimiter).split(delimiter)
+    if '"' not in text and len(fields) == rows * width:
+      yield [fields[idx::width] for idx in indexes]
+      continue
+    # quoted, ragged or blank lines
+    lines = [line for line in text.split('\n') if line != '']
+    parsed = list(csv.reader(lines, delimiter=delimiter))
+    yield [[row[idx] for row in parsed] for idx in indexes]
+  fh.close()
+
+def allele_codes(values, code):
+  '''
+    code(value) for each value as an array, calculated once per distinct value
+  '''
+  codes = dict((value, code(value)) for value in set(values))
+  return numpy.array(list(map(codes.__getitem__, values)), dtype=numpy.int64)
+
+def add_tsv_rows(target, positions, refs, alts, values):
+  '''
+    add rows of one chromosome to its annotations, with the same keys as make_key
+  '''
+  positions = numpy.array(list(map(int, positions)), dtype=numpy.int64)
+  # make_key uses pos * (1 + base) for snvs
+  ref_codes = allele_codes(refs, lambda ref: 1 if ref in 'ACGT' else 0)
+  alt_codes = allele_codes(alts, lambda alt: 1 + 'ACGT'.index(alt) if alt in 'ACGT' else 0)
+  short = (ref_codes > 0) & (alt_codes > 0)
+  keys = (positions * alt_codes).tolist()
+  if short.all():
+    target.update(zip(keys, values))
+    return
+  positions = positions.tolist()
+  for row, is_short in enumerate(short.tolist()):
+    if is_short:
+      target[keys[row]] = values[row]
+    else:
+      target[(positions[row], refs[row], alts[row])] = values[row]
 
-    yield Variant(chrom, pos, ref, (alt,), info)
+def tsv_annotations(fn, tsv_format, fields, chromosomes=None):
+  '''
+    chrom -> key -> values of fields from a tsv, with the same keys as make_key
+    only rows on chromosomes are kept if given
+  '''
+  logging.debug('reading %s as tsv...', fn)
+  annotations = {}
+  counter = progress.Progress('reading source', every=10000000, unit='records')
+  skipped = 0
+  for block in tsv_blocks(fn, [tsv_format.chrom, tsv_format.pos, tsv_format.ref, tsv_format.alt] + list(fields), tsv_format.delimiter, tsv_format.is_zipped):
+    counter.update(len(block[0]))
+    stripped = dict((name, name.replace('chr', '')) for name in set(block[0]))
+    if len(set(stripped.values())) == 1:
+      groups = [(stripped.popitem()[1], None)] # usual case of a block within one chromosome
+    else:
+      chroms = list(map(stripped.__getitem__, block[0]))
+      chrom_names, chrom_codes = numpy.unique(numpy.array(chroms), return_inverse=True)
+      groups = [(name, numpy.nonzero(chrom_codes == code)[0].tolist()) for code, name in enumerate(chrom_names.tolist())]
+    for chrom, rows in groups:
+      if chromosomes is not None and chrom not in chromosomes:
+        skipped += len(block[0]) if rows is None else len(rows)
+        continue
+      if chrom not in annotations:
+        annotations[chrom] = {}
+        logging.info('adding %s to annotations', chrom)
+      columns = block[1:] if rows is None else [[column[row] for row in rows] for column in block[1:]]
+      add_tsv_rows(annotations[chrom], columns[0], columns[1], columns[2], list(zip(*columns[3:])))
+  counter.finish()
+  if skipped > 0:
+    logging.info('skipped %i records on chromosomes not in the vcfs to annotate', skipped)
+  return annotations
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Annotate VCF with another VCF or TSV')
@@ -185,6 +285,7 @@ if __name__ == '__main__':
   parser.add_argument('--suffix', required=False, default='annot', help='new filename')
   parser.add_argument('--definitions', required=False, nargs='*', help='definitions of fields e.g. CSQ=a|b|...')
   parser.add_argument('--no_overwrite', action='store_true', help='do not overwrite existing vcf')
+  vcf_io.add_arguments(parser)
 
   parser.add_argument('--verbose', action='store_true', help='more logging')
   args = parser.parse_args()
@@ -193,9 +294,8 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
+  tsv_format = None
   if args.is_tsv:
-    vcf_in = tsv_to_vcf(args.vcf, args.tsv_chrom_column, args.tsv_pos_column, args.tsv_ref_column, args.tsv_alt_column, args.tsv_delimiter, args.tsv_zipped, args.fields)
-  else:
-    vcf_in = cyvcf2.VCF(args.vcf)
-  main(vcf_in, args.vcfs, args.fields, args.definitions, args.suffix, args.rename, args.no_overwrite)
+    tsv_format = TsvFormat(args.tsv_chrom_column, args.tsv_pos_column, args.tsv_ref_column, args.tsv_alt_column, args.tsv_delimiter, args.tsv_zipped)
+  progress.run(main, args.vcf, tsv_format, args.vcfs, args.fields, args.definitions, args.suffix, args.rename, args.no_overwrite, args.output, args.threads)
 
@@ -1,34 +1,117 @@
 #!/usr/bin/env python
 '''
-  given tumour and normal vcf pairs, explore msi status
+  given loh beds, write the genes affected by loh for each sample
+  - transcripts are indexed into sorted start/end/gene arrays per chromosome
+  - the index is cached next to the transcripts file and rebuilt only if the transcripts file changes
 '''
 
 import argparse
+import collections
 import csv
 import gzip
 import logging
+import os
 import sys
 
-import intervaltree
-
-def main(lohs, transcripts, min_accept):
-  logging.info('processing %s', transcripts)
-  chroms = {}
-  rows = 0
-  for rows, row in enumerate(csv.DictReader(gzip.open(transcripts, 'rt'), delimiter='\t')):
-    chrom = row['chrom'].replace('chr', '')
-    if chrom not in chroms:
-      chroms[chrom] = intervaltree.IntervalTree()
-      logging.info('added %s', chrom)
-    chroms[chrom][int(row['txStart']):int(row['txEnd'])] = row['name2']
-  logging.info('%i records processed', rows)
-
-  written = set()
+import numpy as np
+
+class TranscriptIndex(object):
+  '''
+    sorted transcript starts, ends and gene ids for each chromosome
+  '''
+  def __init__(self, genes, chroms):
+    self.genes = genes # gene id -> name
+    self.chroms = chroms # chrom -> (starts, ends, gene ids) sorted by start
+    self.max_length = dict((chrom, int((chroms[chrom][1] - chroms[chrom][0]).max()) if len(chroms[chrom][0]) > 0 else 0) for chrom in chroms)
+
+  @staticmethod
+  def build(transcripts):
+    logging.info('processing %s', transcripts)
+    gene_ids = {}
+    intervals = collections.defaultdict(list)
+    rows = 0
+    for rows, row in enumerate(csv.DictReader(gzip.open(transcripts, 'rt'), delimiter='\t')):
+      chrom = row['chrom'].replace('chr', '')
+      if chrom not in intervals:
+        logging.info('added %s', chrom)
+      gene_id = gene_ids.setdefault(row['name2'], len(gene_ids))
+      intervals[chrom].append((int(row['txStart']), int(row['txEnd']), gene_id))
+    logging.info('%i records processed', rows)
+
+    genes = np.array(sorted(gene_ids, key=gene_ids.get))
+    chroms = {}
+    for chrom in intervals:
+      values = np.array(sorted(intervals[chrom]), dtype=np.int64).reshape(-1, 3)
+      chroms[chrom] = (values[:, 0], values[:, 1], values[:, 2])
+    return TranscriptIndex(genes, chroms)
+
+  @staticmethod
+  def load(cache_fn, key):
+    if not os.path.exists(cache_fn):
+      return None
+    try:
+      with np.load(cache_fn, allow_pickle=False) as cache:
+        if list(cache['key']) != key:
+          logging.info('cache %s is out of date', cache_fn)
+          return None
+        chroms = {}
+        for chrom in cache['chroms']:
+          chroms[chrom] = (cache['starts_{}'.format(chrom)], cache['ends_{}'.format(chrom)], cache['genes_{}'.format(chrom)])
+        logging.info('loaded transcript index from %s', cache_fn)
+        return TranscriptIndex(cache['genes'], chroms)
+    except (OSError, ValueError, KeyError) as ex:
+      logging.warn('unable to read cache %s: %s', cache_fn, ex)
+      return None
+
+  def save(self, cache_fn, key):
+    arrays = {'key': np.array(key, dtype=np.int64), 'genes': self.genes, 'chroms': np.array(sorted(self.chroms))}
+    for chrom in self.chroms:
+      arrays['starts_{}'.format(chrom)], arrays['ends_{}'.format(chrom)], arrays['genes_{}'.format(chrom)] = self.chroms[chrom]
+    tmp_fn = '{}.{}.tmp.npz'.format(cache_fn, os.getpid())
+    try:
+      np.savez(tmp_fn, **arrays)
+      os.replace(tmp_fn, cache_fn)
+      logging.info('wrote transcript index to %s', cache_fn)
+    except OSError as ex:
+      logging.warn('unable to write cache %s: %s', cache_fn, ex)
+
+  def overlaps(self, chrom, starts, finishes):
+    '''
+      returns (segment index, gene id) for every transcript overlapping each segment, ordered by segment
+    '''
+    tx_starts, tx_ends, tx_genes = self.chroms[chrom]
+    starts = np.asarray(starts, dtype=np.int64)
+    finishes = np.asarray(finishes, dtype=np.int64)
+    # transcripts starting before the segment finishes and not so early that they must end before it starts
+    lo = np.searchsorted(tx_starts, starts - self.max_length[chrom], side='left')
+    hi = np.searchsorted(tx_starts, finishes, side='left')
+    counts = np.maximum(hi - lo, 0)
+    segments = np.repeat(np.arange(len(starts)), counts)
+    candidates = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    keep = tx_ends[candidates] > starts[segments]
+    return segments[keep], tx_genes[candidates[keep]]
+
+def transcript_index(transcripts, cache_fn):
+  if cache_fn is None:
+    return TranscriptIndex.build(transcripts)
+  stat = os.stat(transcripts)
+  key = [stat.st_size, stat.st_mtime_ns]
+  index = TranscriptIndex.load(cache_fn, key)
+  if index is None:
+    index = TranscriptIndex.build(transcripts)
+    index.save(cache_fn, key)
+  return index
+
+def main(lohs, transcripts, min_accept, cache_fn):
+  index = transcript_index(transcripts, cache_fn)
+
+  total = 0
   sys.stdout.write('sample\tgene\taccept\n')
   for loh in lohs:
     logging.info('processing %s', loh)
     sample = loh.split('/')[-1].split('.')[0]
-    for line in open(loh, 'r'):
+    segments = collections.defaultdict(lambda: ([], [], [], [])) # line, start, finish, accept
+    for line_count, line in enumerate(open(loh, 'r')):
       #12      6709614 6711147 50.0    1       0       1       1533
       #chr	start finish accept_pct accepts supports neutrals length
       fields = line.strip('\n').split('\t')
@@ -36,22 +119,35 @@ def main(lohs, transcripts, min_accept):
       if accept < min_accept:
         continue
       chrom = chrom.replace('chr', '')
-      if chrom in chroms:
-        overlaps = chroms[chrom][start:finish]
-        for overlap in overlaps:
-          if (sample, overlap.data) not in written:
-            sys.stdout.write('{}\t{}\t{}\n'.format(sample, overlap.data, accept))
-            written.add((sample, overlap.data))
+      if chrom in index.chroms:
+        for values, value in zip(segments[chrom], (line_count, start, finish, accept)):
+          values.append(value)
       else:
         logging.warn('chrom %s in %s not found in %s', chrom, loh, transcripts)
 
-  logging.info('done. wrote %i records for %i samples', len(written), len(lohs))
+    # overlaps for all segments on each chromosome, then reported in file order
+    found = []
+    for chrom, (lines, starts, finishes, accepts) in segments.items():
+      segment_idxs, gene_ids = index.overlaps(chrom, starts, finishes)
+      found.extend([(lines[s], accepts[s], g) for s, g in zip(segment_idxs, gene_ids)])
+    found.sort(key=lambda x: x[0])
+
+    written = set()
+    for _, accept, gene_id in found:
+      if gene_id not in written:
+        sys.stdout.write('{}\t{}\t{}\n'.format(sample, index.genes[gene_id], accept))
+        written.add(gene_id)
+    total += len(written)
+
+  logging.info('done. wrote %i records for %i samples', total, len(lohs))
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Combine LOH')
   parser.add_argument('--lohs', required=True, nargs='+', help='loh files')
   parser.add_argument('--transcripts', required=True, help='transcripts')
   parser.add_argument('--min_accept', required=False, default=1, type=int, help='transcripts')
+  parser.add_argument('--cache', required=False, help='transcript index cache (default transcripts.idx.npz)')
+  parser.add_argument('--no_cache', action='store_true', help='always rebuild the transcript index')
   parser.add_argument('--verbose', action='store_true', help='more logging')
   args = parser.parse_args()
   if args.verbose:
@@ -59,4 +155,11 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-  main(args.lohs, args.transcripts, args.min_accept)
+  if args.no_cache:
+    cache_fn = None
+  elif args.cache is not None:
+    cache_fn = args.cache
+  else:
+    cache_fn = '{}.idx.npz'.format(args.transcripts)
+
+  main(args.lohs, args.transcripts, args.min_accept, cache_fn)
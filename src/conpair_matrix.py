@@ -1,71 +1,266 @@
 #!/usr/bin/env python
 '''
   run conpair on all combinations
+  - pileups and comparisons run concurrently with --jobs
+  - a pileup is reused if its bam fingerprint (size and mtime) is unchanged
+  - a comparison is reused if its output is newer than both pileups
+  - --engine numpy computes the whole concordance matrix in process instead of running verify_concordance.py per pair
 '''
 
 import argparse
+import collections
+import concurrent.futures
 import logging
 import os
+import queue
+import subprocess
 import sys
 
+import numpy as np
+
+PILEUP_CMD = "python {tools}/Conpair/scripts/run_gatk_pileup_for_sample.py --reference {reference} --conpair_dir {tools}/Conpair --gatk {tools}/GenomeAnalysisTK-3.8-1-0-gf15c1c3ef/GenomeAnalysisTK.jar -B {bam} -O {working}/{name}.pileup"
+DEFAULT_MARKERS = "{tools}/Conpair/data/markers/GRCh37.autosomes.phase3_shapeit2_mvncall_integrated.20130502.SNV.genotype.sscore.AF_10_AF_90.txt"
+COMPARISON_CMD = "PYTHONPATH={tools}/Conpair/modules CONPAIR_DIR={tools}/Conpair python {tools}/Conpair/scripts/verify_concordance.py -T {working}/{tname}.pileup -N {working}/{nname}.pileup --outfile {working}/{tname}.{nname}.concordance --normal_homozygous_markers_only"
+
 def execute(cmd):
   logging.debug('executing %s...', cmd)
-  result = os.system(cmd)
+  result = subprocess.call(cmd, shell=True)
   if result != 0:
     logging.warn('executing %s FAILED', cmd)
   logging.debug('executing %s: done', cmd)
   return result == 0
 
-def main(tumours, normals, working, output, reference, skip_pileup, skip_comparison, tooldir, fullpath):
+def sample_name(s, fullpath):
+  if fullpath:
+    return s.replace('/', '_')
+  return s.split('/')[-1].split('.')[0]
+
+def fingerprint(bam):
+  stat = os.stat(bam)
+  return '{}\t{}'.format(stat.st_size, stat.st_mtime_ns)
+
+def pileup_current(bam, pileup):
+  '''
+    true if pileup exists and was generated from this version of the bam
+  '''
+  fingerprint_fn = '{}.fingerprint'.format(pileup)
+  if not os.path.exists(pileup) or not os.path.exists(fingerprint_fn):
+    return False
+  with open(fingerprint_fn, 'r') as fh:
+    return fh.read().strip('\n') == fingerprint(bam)
+
+def run_pileup(bam, pileup, cmd):
+  if not execute(cmd):
+    return False
+  with open('{}.fingerprint'.format(pileup), 'w') as fh:
+    fh.write('{}\n'.format(fingerprint(bam)))
+  return True
+
+def comparison_current(concordance, tpileup, npileup):
+  if not os.path.exists(concordance):
+    return False
+  mtime = os.path.getmtime(concordance)
+  return mtime >= os.path.getmtime(tpileup) and mtime >= os.path.getmtime(npileup)
+
+def read_concordance(fn):
+  for line in open(fn).readlines():
+    if line.startswith('Concordance:'):
+      return line.strip('\n').split(' ')[1].replace('%', '')
+  logging.warn('no concordance found in %s', fn)
+  return None
+
+def load_markers(fn):
+  '''
+    conpair marker file: chrom, pos, ref, alt, ...
+    returns chrom:pos -> marker index, ref alleles, alt alleles
+  '''
+  markers = {}
+  refs = []
+  alts = []
+  for line in open(fn, 'r'):
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) < 4 or not fields[1].isdigit():
+      continue
+    markers['{}:{}'.format(fields[0], fields[1])] = len(refs)
+    refs.append(fields[2].upper())
+    alts.append(fields[3].upper())
+  logging.info('%i markers loaded from %s', len(refs), fn)
+  return markers, refs, alts
+
+def pileup_bases(bases, quals, ref):
+  '''
+    yield (base, quality) from a pileup base string
+  '''
+  i = q = 0
+  while i < len(bases):
+    c = bases[i]
+    if c == '^': # read start, next character is mapping quality
+      i += 2
+      continue
+    if c == '$':
+      i += 1
+      continue
+    if c in '+-': # indel, skip the inserted or deleted sequence
+      j = i + 1
+      while j < len(bases) and bases[j].isdigit():
+        j += 1
+      i = j + int(bases[i+1:j])
+      continue
+    if c in '.,':
+      c = ref
+    if q < len(quals):
+      yield c.upper(), ord(quals[q]) - 33
+    q += 1
+    i += 1
+
+def pileup_counts(fn, markers, refs, alts, min_base_quality):
+  '''
+    (markers x (ref, alt)) count matrix for one sample's pileup
+  '''
+  counts = np.zeros((len(refs), 2), dtype=np.int32)
+  for line in open(fn, 'r'):
+    fields = line.split()
+    if len(fields) < 5:
+      continue
+    idx = markers.get('{}:{}'.format(fields[0], fields[1]))
+    if idx is None:
+      continue
+    # gatk pileup is chrom pos ref bases quals, samtools style includes depth before bases
+    if fields[3].isdigit():
+      bases, quals = fields[4], fields[5] if len(fields) > 5 else ''
+    else:
+      bases, quals = fields[3], fields[4]
+    for base, quality in pileup_bases(bases, quals, fields[2].upper()):
+      if quality < min_base_quality:
+        continue
+      if base == refs[idx]:
+        counts[idx, 0] += 1
+      elif base == alts[idx]:
+        counts[idx, 1] += 1
+  return counts
+
+def genotypes(counts, min_coverage, error=0.01):
+  '''
+    most likely genotype (0=AA, 1=AB, 2=BB) for each sample and marker, and whether the marker has enough coverage
+    counts is (samples x markers x 2)
+  '''
+  ref = counts[..., 0].astype(float)
+  alt = counts[..., 1].astype(float)
+  likelihoods = np.stack([
+    ref * np.log(1 - error) + alt * np.log(error),
+    (ref + alt) * np.log(0.5),
+    ref * np.log(error) + alt * np.log(1 - error)], axis=-1)
+  return likelihoods.argmax(axis=-1), (ref + alt) >= min_coverage
 
-  if not skip_pileup:
-    logging.info('generating pileups...')
-    samples = set(tumours + normals)
-    for s in samples:
+def concordance_matrix(tumour_counts, normal_counts, min_coverage, normal_homozygous_markers_only=True):
+  '''
+    percentage of shared covered markers with the same genotype for every tumour x normal pair
+  '''
+  tumour_gt, tumour_covered = genotypes(tumour_counts, min_coverage)
+  normal_gt, normal_covered = genotypes(normal_counts, min_coverage)
+  if normal_homozygous_markers_only:
+    normal_covered = normal_covered & (normal_gt != 1)
+
+  concordant = np.zeros((len(tumour_counts), len(normal_counts)))
+  for genotype in (0, 1, 2):
+    concordant += ((tumour_gt == genotype) & tumour_covered).astype(float) @ ((normal_gt == genotype) & normal_covered).astype(float).T
+  total = tumour_covered.astype(float) @ normal_covered.astype(float).T
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return 100.0 * concordant / total
+
+def numpy_concordance(tumours, normals, pairs, pileup, markers_fn, min_base_quality, min_coverage):
+  markers, refs, alts = load_markers(markers_fn)
+  counts = {}
+  for s in sorted(set(tumours + normals)):
+    logging.debug('loading pileup for %s...', s)
+    counts[s] = pileup_counts(pileup(s), markers, refs, alts, min_base_quality)
+
+  logging.info('calculating concordance for %i tumours and %i normals...', len(tumours), len(normals))
+  matrix = concordance_matrix(np.array([counts[t] for t in tumours]), np.array([counts[n] for n in normals]), min_coverage)
+  tumour_idx = dict((t, idx) for idx, t in enumerate(tumours))
+  normal_idx = dict((n, idx) for idx, n in enumerate(normals))
+  results = {}
+  for t, n in pairs:
+    value = matrix[tumour_idx[t], normal_idx[n]]
+    results[(t, n)] = None if np.isnan(value) else '{:.2f}'.format(value) # same text as verify_concordance.py
+  return results
+
+def main(tumours, normals, working, output, reference, skip_pileup, skip_comparison, tooldir, fullpath, jobs=1, engine='conpair', markers=None, min_base_quality=20, min_coverage=10):
+  names = dict((s, sample_name(s, fullpath)) for s in set(tumours + normals))
+  pileup = lambda s: '{working}/{name}.pileup'.format(working=working, name=names[s])
+  concordance = lambda t, n: '{working}/{tname}.{nname}.concordance'.format(working=working, tname=names[t], nname=names[n])
+  pairs = [(t, n) for t in tumours for n in normals if t != n]
+
+  results = {}
+  ready = set() # samples with a pileup available
+  pending = collections.defaultdict(list) # sample -> comparisons not yet started that involve it
+  for t, n in pairs:
+    pending[t].append((t, n))
+    pending[n].append((t, n))
+  running = {}
+  finished = queue.Queue() # futures are collected in the order they complete
+
+  def submit(executor, fn, args, item):
+    future = executor.submit(fn, *args)
+    running[future] = item
+    future.add_done_callback(finished.put)
+
+  def pileup_ready(executor, s):
+    '''
+      start the comparisons that were only waiting on this sample
+    '''
+    ready.add(s)
+    for t, n in pending.pop(s, []):
+      if (n if s == t else t) not in ready:
+        continue
+      if engine != 'conpair':
+        continue
+      if skip_comparison or comparison_current(concordance(t, n), pileup(t), pileup(n)):
+        logging.debug('reusing comparison of %s to %s', t, n)
+        results[(t, n)] = read_concordance(concordance(t, n))
+        continue
+      logging.info('comparing %s to %s...', t, n)
+      cmd = COMPARISON_CMD.format(tools=tooldir, working=working, nname=names[n], tname=names[t])
+      submit(executor, execute, (cmd,), ('comparison', (t, n)))
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    # comparisons start as soon as both pileups are available and are collected as they finish
+    logging.info('generating pileups and running comparisons...')
+    for s in sorted(names):
+      if skip_pileup or pileup_current(s, pileup(s)):
+        logging.info('reusing pileup for %s', s)
+        pileup_ready(executor, s)
+        continue
       logging.info('generating pileup for %s...', s)
-      if fullpath:
-        name = s.replace('/', '_')
-      else:
-        name = s.split('/')[-1].split('.')[0]
-      if not execute("python {tools}/Conpair/scripts/run_gatk_pileup_for_sample.py --reference {reference} --conpair_dir {tools}/Conpair --gatk {tools}/GenomeAnalysisTK-3.8-1-0-gf15c1c3ef/GenomeAnalysisTK.jar -B {bam} -O {working}/{name}.pileup".format(tools=tooldir, reference=reference, bam=s, working=working, name=name)):
+      cmd = PILEUP_CMD.format(tools=tooldir, reference=reference, bam=s, working=working, name=names[s])
+      submit(executor, run_pileup, (s, pileup(s), cmd), ('pileup', s))
+
+    while len(running) > 0:
+      future = finished.get()
+      kind, item = running.pop(future)
+      if not future.result():
+        for other in running:
+          other.cancel()
         sys.exit(1)
+      if kind == 'pileup':
+        pileup_ready(executor, item)
+      else:
+        results[item] = read_concordance(concordance(*item))
+        logging.debug('%i of %i comparisons complete', len(results), len(pairs))
 
-  if not skip_comparison:
-    logging.info('running comparisons...')
-    for t in tumours:
-      for n in normals:
-        if t == n:
-          continue
-        logging.info('comparing %s to %s...', t, n)
-        if fullpath:
-          tname = t.replace('/', '_')
-          nname = n.replace('/', '_')
-        else:
-          tname = t.split('/')[-1].split('.')[0]
-          nname = n.split('/')[-1].split('.')[0]
-        if not execute("PYTHONPATH={tools}/Conpair/modules CONPAIR_DIR={tools}/Conpair python {tools}/Conpair/scripts/verify_concordance.py -T {working}/{tname}.pileup -N {working}/{nname}.pileup --outfile {working}/{tname}.{nname}.concordance --normal_homozygous_markers_only".format(tools=tooldir, working=working, nname=nname, tname=tname)):
-          sys.exit(1)
+  # the numpy engine keeps no per pair results, so it always compares the pileups
+  if engine == 'numpy':
+    results = numpy_concordance(tumours, normals, pairs, pileup, markers or DEFAULT_MARKERS.format(tools=tooldir), min_base_quality, min_coverage)
 
   logging.info('merging results...')
   with open(output, 'w') as fh:
     fh.write('Tumour\tNormal\tConcordance\n')
-    for t in tumours:
-      for n in normals:
-        if t == n:
-          continue
-        if fullpath:
-          tname = t.replace('/', '_')
-          nname = n.replace('/', '_')
-        else:
-          tname = t.split('/')[-1].split('.')[0]
-          nname = n.split('/')[-1].split('.')[0]
-        for line in open('{working}/{tname}.{nname}.concordance'.format(working=working, tname=tname, nname=nname)).readlines():
-          if line.startswith('Concordance:'):
-            fh.write('{}\t{}\t{}\n'.format(tname, nname, line.strip('\n').split(' ')[1].replace('%', '')))
-            break
+    for t, n in pairs:
+      if results.get((t, n)) is not None:
+        fh.write('{}\t{}\t{}\n'.format(names[t], names[n], results[(t, n)]))
 
   #logging.info('plotting results...')
-  #plotme.heatmap.plot_heat(open('{}.png'.format(output), 'w'), 
+  #plotme.heatmap.plot_heat(open('{}.png'.format(output), 'w'),
   logging.info('done')
 
 #    "python src/conpair_matrix.py --tumours {input.tumours} --germlines {input.germlines} --reference {input.reference} --output tmp/conpair > {output} 2>{log.stderr}"
@@ -78,13 +273,18 @@ if __name__ == '__main__':
   parser.add_argument('--reference', required=True, help='temp directory')
   parser.add_argument('--verbose', action='store_true', help='more logging')
   parser.add_argument('--skip_pileup', action='store_true', help='pileup has already been run')
-  parser.add_argument('--skip_comparison', action='store_true', help='comparison has already been run')
+  parser.add_argument('--skip_comparison', action='store_true', help='comparison has already been run (conpair engine only, the numpy engine always compares the pileups)')
   parser.add_argument('--fullpath', action='store_true', help='full path in output')
   parser.add_argument('--tooldir', required=False, default='tools', help='tools directory')
+  parser.add_argument('--jobs', required=False, type=int, default=1, help='number of pileups and comparisons to run concurrently')
+  parser.add_argument('--engine', required=False, default='conpair', choices=('conpair', 'numpy'), help='run verify_concordance.py per pair or calculate all pairs in process')
+  parser.add_argument('--markers', required=False, help='conpair marker file for the numpy engine')
+  parser.add_argument('--min_base_quality', required=False, type=int, default=20, help='minimum base quality for the numpy engine')
+  parser.add_argument('--min_coverage', required=False, type=int, default=10, help='minimum marker coverage for the numpy engine')
   args = parser.parse_args()
   if args.verbose:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-  main(args.tumours, args.germlines, args.working, args.output, args.reference, args.skip_pileup, args.skip_comparison, args.tooldir, args.fullpath)
+  main(args.tumours, args.germlines, args.working, args.output, args.reference, args.skip_pileup, args.skip_comparison, args.tooldir, args.fullpath, args.jobs, args.engine, args.markers, args.min_base_quality, args.min_coverage)
@@ -1,41 +1,68 @@
 #!/usr/bin/env python
 # generates symlinks to data
+# the source directory is listed once and each line of data.tsv is looked up in that listing
 # usage:
 # python data.py < data.tsv
 
 import argparse
-import glob
+import bisect
 import logging
 import os
 import os.path
 import sys
 
-def run(cmd):
-  logging.info('{}...\n'.format(cmd))
-  result = os.system(cmd)
-  if result != 0:
-    logging.warn('ERROR executing {}'.format(cmd))
-    sys.exit(result)
-  logging.info('{}: done\n'.format(cmd))
+def index(source):
+  '''
+    sorted names in source, without hidden files as glob would
+  '''
+  logging.info('listing %s...', source)
+  names = sorted([name for name in os.listdir(source) if not name.startswith('.')])
+  logging.info('listing %s: %i files', source, len(names))
+  return names
 
-def main(source, dest):
+def matching(names, prefix):
+  '''
+    names that start with prefix_, as glob('{prefix}_*') would match
+  '''
+  start = '{}_'.format(prefix)
+  idx = bisect.bisect_left(names, start)
+  while idx < len(names) and names[idx].startswith(start):
+    yield names[idx]
+    idx += 1
+
+def link(source_file, target_file, dry_run):
+  if dry_run:
+    sys.stdout.write('ln -s {} {}\n'.format(source_file, target_file))
+    return
+  logging.debug('linking %s to %s', source_file, target_file)
+  try:
+    os.symlink(source_file, target_file)
+  except OSError as ex:
+    logging.warn('ERROR linking {} to {}: {}'.format(source_file, target_file, ex))
+    sys.exit(1)
+
+def main(source, dest, dry_run=False):
+  names = index(source)
   logging.info('reading from stdin...')
+  count = 0
   for line in sys.stdin:
     fields = line.strip('\n').split('\t') # A08978_25945    0151010101_BC
-    files = '{source}/{prefix}_*'.format(source=source, prefix=fields[0])
-    logging.debug('looking for %s', files)
-    for f in glob.glob(files):
-      target=os.path.basename(f).replace(fields[0], fields[1])
-      run("ln -s {source_file} {dest}/{target}".format(source_file=f, dest=dest, target=target))
+    logging.debug('looking for %s_* in %s', fields[0], source)
+    for name in matching(names, fields[0]):
+      target = name.replace(fields[0], fields[1])
+      link(os.path.join(source, name), '{dest}/{target}'.format(dest=dest, target=target), dry_run)
+      count += 1
+  logging.info('linked %i files', count)
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Assess MSI')
   parser.add_argument('--source_dir', required=True, help='source of fastq')
   parser.add_argument('--target_dir', required=True, help='in directory')
+  parser.add_argument('--dry_run', action='store_true', help='write the ln commands to stdout instead of linking')
   parser.add_argument('--verbose', action='store_true', help='more logging')
   args = parser.parse_args()
   if args.verbose:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
-  main(args.source_dir, args.target_dir)
+  main(args.source_dir, args.target_dir, args.dry_run)
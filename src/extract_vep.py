@@ -8,6 +8,8 @@ import csv
 import logging
 import sys
 
+import progress
+
 
 def main(vep_header, transcript, override):
   logging.info('starting...')
@@ -25,7 +27,9 @@ def main(vep_header, transcript, override):
 
   header = None
   writer = csv.writer(sys.stdout, delimiter='\t')
+  counter = progress.Progress('reading stdin', unit='rows')
   for row_count, row in enumerate(csv.reader(sys.stdin, delimiter='\t')):
+    counter.update()
     if header is None:
       header = row
       csq = header.index('CSQ')
@@ -67,9 +71,7 @@ def main(vep_header, transcript, override):
 
     else:
       logging.warn('skipping line %i: only %i rows, need %i', row_count, len(row), csq + 1)
-
-    if row_count % 10000 == 0:
-      logging.info('%i records read...', row_count)
+  counter.finish()
 
   logging.info('done')
 
@@ -85,5 +87,5 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-  main(args.header, args.transcript, args.override)
+  progress.run(main, args.header, args.transcript, args.override)
 
@@ -5,100 +5,117 @@
 
 import argparse
 import logging
-import sys
 
 import numpy
 
-import cyvcf2
+import progress
+import vcf_io
 
-def main(sample, af_threshold, dp_threshold, info_af, pass_only, dp_field, min_sample_ad, max_af, max_dp):
-
-  logging.info('reading from stdin...')
+def add_arguments(parser):
+  parser.add_argument('--sample', required=True,  help='sample name for af filter')
+  parser.add_argument('--af', type=float, required=False,  help='minimum af')
+  parser.add_argument('--max_af', type=float, required=False, default=1000,  help='maximum af')
+  parser.add_argument('--dp', type=int, required=True,  help='minimum dp')
+  parser.add_argument('--max_dp', type=float, required=False, default=1e9,  help='maximum dp')
+  parser.add_argument('--dp_field', required=False, default='DP',  help='name of DP field')
+  parser.add_argument('--info_af', action='store_true', help='use af from info')
+  parser.add_argument('--pass_only', action='store_true', help='reject non-pass')
+  parser.add_argument('--min_sample_ad', nargs='*', required=False,  help='minimum ad sum for sample in the form sample=ad...')
 
-  vcf_in = cyvcf2.VCF("-")  
+def stage(vcf_in, sample, af, dp, info_af=False, pass_only=False, dp_field='DP', min_sample_ad=None, max_af=1000, max_dp=1e9):
+  '''
+    adds AF to the header of vcf_in and returns a generator function that yields the records passing the filter
+  '''
+  af_threshold, dp_threshold = af, dp
   vcf_in.add_info_to_header({'ID': 'AF', 'Description': 'Calculated allele frequency', 'Type':'Float', 'Number': '1'})
+  sample_id = vcf_in.samples.index(sample)
 
-  sys.stdout.write(vcf_in.raw_header)
+  def transform(variants):
+    variant_count = 0
+    skipped_pass = skipped_dp = skipped_af = skipped_ad = allowed = 0
+    counter = progress.Progress('filtering', unit='variants', details=lambda: 'allowed {}'.format(allowed))
+    for variant_count, variant in enumerate(variants):
+      # GL000220.1      135366  .       T       C       .       LowEVS;LowDepth SOMATIC;QSS=1;TQSS=1;NT=ref;QSS_NT=1;TQSS_NT=1;SGT=TT->TT;DP=2;MQ=60.00;MQ0=0;ReadPosRankSum=0.00;SNVSB=0.00;SomaticEVS=0.71    DP:FDP:SDP:SUBDP:AU:CU:GU:TU    1:0:0:0:0,0:0,0:0,0:1,1 1:0:0:0:0,0:1,1:0,0:0,0
+      counter.update()
 
-  variant_count = 0
-  skipped_pass = skipped_dp = skipped_af = skipped_ad = allowed = 0
-  sample_id = vcf_in.samples.index(sample)
-  for variant_count, variant in enumerate(vcf_in):
-    # GL000220.1      135366  .       T       C       .       LowEVS;LowDepth SOMATIC;QSS=1;TQSS=1;NT=ref;QSS_NT=1;TQSS_NT=1;SGT=TT->TT;DP=2;MQ=60.00;MQ0=0;ReadPosRankSum=0.00;SNVSB=0.00;SomaticEVS=0.71    DP:FDP:SDP:SUBDP:AU:CU:GU:TU    1:0:0:0:0,0:0,0:0,0:1,1 1:0:0:0:0,0:1,1:0,0:0,0
-    if (variant_count + 1 ) % 100000 == 0:
-      logging.info('%i variants processed...', variant_count + 1)
-
-    if len(variant.ALT) > 1:
-      logging.warn('variant %i is multi-allelic', variant_count + 1)
-
-    if pass_only and variant.FILTER is not None and variant.FILTER != 'alleleBias': # PASS only, or alleleBias for platypus
-      skipped_pass += 1
-      continue
-
-    if dp_threshold > 0:
-      try:
-        if variant.INFO[dp_field] < dp_threshold or variant.INFO[dp_field] > max_dp: # somatic + germline
-          logging.debug('variant at %i skipped with info depth %i', variant.POS, variant.INFO[dp_field])
-          skipped_dp += 1
+      if len(variant.ALT) > 1:
+        logging.warn('variant %i is multi-allelic', variant_count + 1)
+
+      if pass_only and variant.FILTER is not None and variant.FILTER != 'alleleBias': # PASS only, or alleleBias for platypus
+        skipped_pass += 1
+        continue
+
+      if dp_threshold > 0:
+        try:
+          if variant.INFO[dp_field] < dp_threshold or variant.INFO[dp_field] > max_dp: # somatic + germline
+            logging.debug('variant at %i skipped with info depth %i', variant.POS, variant.INFO[dp_field])
+            skipped_dp += 1
+            continue
+        except:
+          if variant.format(dp_field)[sample_id][0] < dp_threshold or variant.format(dp_field)[sample_id][0] > max_dp: # somatic
+            logging.debug('variant at %i skipped with sample depth %i', variant.POS, variant.format(dp_field)[sample_id][0])
+            skipped_dp += 1
+            continue
+
+      logging.debug('variant at %i has OK depth', variant.POS)
+
+      if info_af:
+        try:
+          af = variant.INFO["AF"]
+        except:
+          skipped_af += 1
+          logging.debug('variant at %i has no info AF', variant.POS)
           continue
-      except:
-        if variant.format(dp_field)[sample_id][0] < dp_threshold or variant.format(dp_field)[sample_id][0] > max_dp: # somatic
-          logging.debug('variant at %i skipped with sample depth %i', variant.POS, variant.format(dp_field)[sample_id][0])
-          skipped_dp += 1
+      else:
+        try:
+          af = variant.format("AF")[sample_id][0] 
+        except:
+          skipped_af += 1
+          logging.debug('variant at %i has no sample AF', variant.POS)
           continue
 
-    logging.debug('variant at %i has OK depth', variant.POS)
-
-    if info_af:
-      try:
-        af = variant.INFO["AF"]
-      except:
+      if af_threshold is not None and (af < af_threshold or af > max_af):
         skipped_af += 1
-        logging.debug('variant at %i has no info AF', variant.POS)
-        continue
-    else:
-      try:
-        af = variant.format("AF")[sample_id][0] 
-      except:
-        skipped_af += 1
-        logging.debug('variant at %i has no sample AF', variant.POS)
         continue
 
-    if af_threshold is not None and (af < af_threshold or af > max_af):
-      skipped_af += 1
-      continue
-
-    if min_sample_ad is not None:
-      low_ad = False
-      for msad in min_sample_ad:
-        soi, min_ad = msad.split('=')
-        min_ad = int(min_ad)
-        soi_idx = vcf_in.samples.index(soi)
-        if sum(variant.format("AD")[soi_idx]) < min_ad:
-          skipped_ad += 1
-          logging.debug('variant at %i has low AD', variant.POS)
-          low_ad = True
-          break
-      if low_ad:
-        continue
+      if min_sample_ad is not None:
+        low_ad = False
+        for msad in min_sample_ad:
+          soi, min_ad = msad.split('=')
+          min_ad = int(min_ad)
+          soi_idx = vcf_in.samples.index(soi)
+          if sum(variant.format("AD")[soi_idx]) < min_ad:
+            skipped_ad += 1
+            logging.debug('variant at %i has low AD', variant.POS)
+            low_ad = True
+            break
+        if low_ad:
+          continue
+
+      logging.debug('variant at %i is OK', variant.POS)
+      allowed += 1
+      yield variant
+    counter.finish()
+
+    logging.info('processed %i variants. no pass %i. low af %i. low dp %i. low sample ad %i. allowed %i', variant_count + 1, skipped_pass, skipped_af, skipped_dp, skipped_ad, allowed)
 
-    logging.debug('variant at %i is OK', variant.POS)
-    allowed += 1
-    sys.stdout.write(str(variant))
+  return transform
 
-  logging.info('processed %i variants. no pass %i. low af %i. low dp %i. low sample ad %i. allowed %i', variant_count + 1, skipped_pass, skipped_af, skipped_dp, skipped_ad, allowed)
+def main(sample, af_threshold, dp_threshold, info_af, pass_only, dp_field, min_sample_ad, max_af, max_dp, output='-', threads=1):
+
+  logging.info('reading from stdin...')
+
+  vcf_in = vcf_io.reader('-', threads)
+  transform = stage(vcf_in, sample, af_threshold, dp_threshold, info_af, pass_only, dp_field, min_sample_ad, max_af, max_dp)
+  vcf_out = vcf_io.writer(output, vcf_in, threads)
+  for variant in transform(vcf_in):
+    vcf_out.write_record(variant)
+  vcf_out.close()
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Filter VCF')
-  parser.add_argument('--sample', required=True,  help='sample name for af filter')
-  parser.add_argument('--af', type=float, required=False,  help='minimum af')
-  parser.add_argument('--max_af', type=float, required=False, default=1000,  help='maximum af')
-  parser.add_argument('--dp', type=int, required=True,  help='minimum dp')
-  parser.add_argument('--max_dp', type=float, required=False, default=1e9,  help='maximum dp')
-  parser.add_argument('--dp_field', required=False, default='DP',  help='name of DP field')
-  parser.add_argument('--info_af', action='store_true', help='use af from info')
-  parser.add_argument('--pass_only', action='store_true', help='reject non-pass')
-  parser.add_argument('--min_sample_ad', nargs='*', required=False,  help='minimum ad sum for sample in the form sample=ad...')
+  add_arguments(parser)
+  vcf_io.add_arguments(parser)
   parser.add_argument('--verbose', action='store_true', help='more logging')
   args = parser.parse_args()
   if args.verbose:
@@ -107,4 +124,4 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
   # sample af vcf
-  main(args.sample, args.af, args.dp, args.info_af, args.pass_only, args.dp_field, args.min_sample_ad, args.max_af, args.max_dp)
+  progress.run(main, args.sample, args.af, args.dp, args.info_af, args.pass_only, args.dp_field, args.min_sample_ad, args.max_af, args.max_dp, args.output, args.threads)
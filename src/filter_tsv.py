@@ -8,6 +8,8 @@ import csv
 import logging
 import sys
 
+import progress
+
 def main(column, values, contains, delimiter='\t'):
 
   logging.info('reading from stdin...')
@@ -16,7 +18,9 @@ def main(column, values, contains, delimiter='\t'):
   accepted = row_idx = 0
   writer = csv.writer(sys.stdout, delimiter=delimiter)
 
+  counter = progress.Progress('reading stdin', unit='rows', details=lambda: 'wrote {}'.format(accepted))
   for row_idx, row in enumerate(csv.reader(sys.stdin, delimiter=delimiter)):
+    counter.update()
     if first:
       first = False
       column_idx = row.index(column)
@@ -33,9 +37,7 @@ def main(column, values, contains, delimiter='\t'):
     elif row[column_idx] in values:
       writer.writerow(row)
       accepted += 1
-
-    if (row_idx + 1) % 100000 == 0:
-      logging.info('wrote %i of %i', accepted, row_idx + 1)
+  counter.finish()
 
   logging.info('wrote %i of %i', accepted, row_idx)
 
@@ -51,4 +53,4 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
   # sample af vcf
-  main(args.column, args.values, args.contains)
+  progress.run(main, args.column, args.values, args.contains)
@@ -6,11 +6,23 @@
 
 import argparse
 import collections
+import concurrent.futures
 import csv
 import gzip
+import hashlib
+import html
+import io
+import json
 import logging
+import os
+import queue
 import re
+import subprocess
 import sys
+import threading
+
+import style_report
+import variant_store
 
 #  173348 .
 #    342 Benign
@@ -55,8 +67,220 @@ def tsv_to_md(in_fh, out_fh):
       out_fh.write('\n')
   out_fh.write('\n')
 
-def main(versions, signatures, burden, msisensor, qc, selected_somatic_variants, all_somatic_variants, all_germline_variants, signature_detail, no_category):
+def decompressed_lines(fn, size_hint=1<<20):
+  '''
+    lines of a gzipped file, decompressed in a separate thread
+  '''
+  chunks = queue.Queue(maxsize=16)
+  def read():
+    try:
+      with gzip.open(fn, 'rt') as fh:
+        while True:
+          lines = fh.readlines(size_hint)
+          if len(lines) == 0:
+            break
+          chunks.put(lines)
+      chunks.put(None)
+    except Exception as ex:
+      chunks.put(ex)
+  reader = threading.Thread(target=read, daemon=True)
+  reader.start()
+  while True:
+    lines = chunks.get()
+    if lines is None:
+      break
+    if isinstance(lines, Exception):
+      raise lines
+    for line in lines:
+      yield line
+  reader.join()
+
+def variants_of_interest(fn, fields, store=None):
+  '''
+    rows with a genotype that are possibly pathogenic in clinvar, as dicts of the requested fields
+    the filter columns are checked on the split line so only passing rows are turned into dicts
+    if fn is loaded in the variant store and unchanged, the rows come from its indexes instead of a scan
+  '''
+  if store is not None and store.current(fn):
+    logging.info('using %s for %s', store.fn, fn)
+    if 'clinvar_pathogenic' not in store.header(store.file_id(fn)):
+      return
+    for idx, row in enumerate(store.rows(sources=[fn], clinvar=CLINVAR_PASS, genotyped=True)):
+      yield idx, dict((x, row[x]) for x in fields if x in row)
+    return
+
+  if fn.endswith('.parquet'):
+    import pyarrow.parquet # only needed for columnar input
+    columns = pyarrow.parquet.read_schema(fn).names
+    if 'clinvar_pathogenic' not in columns:
+      return
+    table = pyarrow.parquet.read_table(fn, columns=[x for x in fields if x in columns], filters=[('GT', 'not in', ['0/0', './.']), ('clinvar_pathogenic', 'in', sorted(CLINVAR_PASS))])
+    for idx, row in enumerate(table.to_pylist()):
+      yield idx, row
+    return
+
+  lines = decompressed_lines(fn)
+  header = next(csv.reader([next(lines)], delimiter='\t'))
+  if 'clinvar_pathogenic' not in header:
+    return # nothing annotated as possibly pathogenic
+  sample_idx, gt_idx, clinvar_idx = [header.index(x) for x in ('VCF_SAMPLE_ID', 'GT', 'clinvar_pathogenic')]
+  minimum = max(sample_idx, gt_idx, clinvar_idx) + 1
+  wanted = [(x, header.index(x)) for x in fields if x in header]
+  for idx, line in enumerate(lines):
+    if '"' in line:
+      row = next(csv.reader([line], delimiter='\t'))
+    else:
+      row = line.rstrip('\r\n').split('\t')
+    if len(row) < minimum:
+      continue # skip missing sample
+    if row[gt_idx] == '0/0' or row[gt_idx] == './.':
+      continue # skip no genotype
+    if row[clinvar_idx] not in CLINVAR_PASS:
+      continue # skip not annotated as possibly pathogenic
+    yield idx, dict((x, row[i] if i < len(row) else None) for x, i in wanted)
+
+def add_variants(samples, fn, section, no_category, log_every, cosmic=False, store=None):
+  logging.info('processing %s...', fn)
+  fields = ['VCF_SAMPLE_ID', 'GT', 'clinvar_pathogenic', 'vep_SYMBOL', 'vep_Consequence', 'vep_HGVSc', 'vep_PolyPhen', 'vep_SIFT', 'CHROM', 'POS', 'REF', 'ALT']
+  if cosmic:
+    fields.append('cosmic')
+  sample_categories = {} # VCF_SAMPLE_ID -> (sample, category)
+  added = 0
+  last = 0
+  for idx, row in variants_of_interest(fn, fields, store):
+    if idx // log_every > last // log_every or added > 0 and added % 100 == 0:
+      logging.info('%i variants processed, added %i...', idx, added)
+    last = idx
+    if row['VCF_SAMPLE_ID'] not in sample_categories:
+      if no_category:
+        sample_categories[row['VCF_SAMPLE_ID']] = (row['VCF_SAMPLE_ID'], 'uncategorized')
+      else:
+        sample_categories[row['VCF_SAMPLE_ID']] = tuple(re.split('[-_]', row['VCF_SAMPLE_ID'], 1))
+    sample, category = sample_categories[row['VCF_SAMPLE_ID']]
+    if category not in samples[sample]:
+      samples[sample][category] = {}
+    if section not in samples[sample][category]:
+      samples[sample][category][section] = []
+    item = {'gene': row['vep_SYMBOL'], 'category': row['vep_Consequence'], 'cchange': row['vep_HGVSc'], 'polyphen': row['vep_PolyPhen'], 'sift': row['vep_SIFT'], 'clinvar': row['clinvar_pathogenic'], 'gnomad': 'https://gnomad.broadinstitute.org/variant/{CHROM}-{POS}-{REF}-{ALT}'.format(**row)}
+    if cosmic:
+      item['cosmic'] = row['cosmic']
+    samples[sample][category][section].append(item)
+    added += 1
+  logging.info('processed %s, added %i', fn, added)
+
+def write_sample(out, sample, categories):
+  for category in categories:
+    out.write('\n## {} {}\n'.format(sample, category))
+    if 'qc' in categories[category]:
+      out.write('### QC\n')
+      assessment = categories[category]['qc']
+      out.write('* {}\n'.format(highlight_if(assessment != 'OK', assessment)))
+    
+    if 'sigs' in categories[category]:
+      out.write('\n### COSMIC Signatures\n')
+      items = categories[category]['sigs']
+      for item in items:
+        out.write('* {}\n'.format(item))
+    
+    if 'genome' in categories[category]:
+      out.write('\n### Burden\n')
+      items = categories[category]['genome']
+      for item in items:
+        out.write('* {}\n'.format(item))
+
+    if 'somatic_variants' in categories[category]:
+      out.write('\n### Somatic variants of interest ({})\n'.format(len(categories[category]['somatic_variants'])))
+      out.write('|Gene|c change|Category|Polyphen|SIFT|Clinvar|COSMIC|Links|\n')
+      out.write('|-|-|-|-|-|-|-|-|\n')
+      items = categories[category]['somatic_variants']
+      for item in items:
+        out.write('|{}|{}|{}|{}|{}|{}|{}|[Gnomad]({})|\n'.format(item['gene'], item['cchange'], item['category'], item['polyphen'], item['sift'], item['clinvar'], item['cosmic'], item['gnomad']))
+
+    if 'germline_variants' in categories[category]:
+      out.write('\n### Germline variants of interest ({})\n'.format(len(categories[category]['germline_variants'])))
+      out.write('|Gene|c change|Category|Polyphen|SIFT|Clinvar|Links|\n')
+      out.write('|-|-|-|-|-|-|-|\n')
+      items = categories[category]['germline_variants']
+      for item in items:
+        out.write('|{}|{}|{}|{}|{}|{}|[Gnomad]({})|\n'.format(item['gene'], item['cchange'], item['category'], item['polyphen'], item['sift'], item['clinvar'], item['gnomad']))
+
+    if 'selected_somatic_variants' in categories[category]:
+      out.write('\n### Somatic variants of interest ({})\n'.format(len(categories[category]['selected_somatic_variants'])))
+      out.write('|Gene|c change|Category|Polyphen|SIFT|Clinvar|Links|\n')
+      out.write('|-|-|-|-|-|-|-|\n')
+      items = categories[category]['selected_somatic_variants']
+      for item in items:
+        out.write('|{}|{}|{}|{}|{}|{}|[Gnomad]({})|\n'.format(item['gene'], item['cchange'], item['category'], item['polyphen'], item['sift'], item['clinvar'], item['gnomad']))
+
+def write_versions(out, versions):
+  out.write('## Versions\n')
+  out.write('Tool|Version\n-|-\n')
+  for line in csv.DictReader(open(versions, 'rt'), delimiter='\t'):
+    out.write('{} | {}\n'.format(line['Tool'], line['Version']))
+
+def fragment_name(sample):
+  return re.sub('[^A-Za-z0-9_.-]', '_', sample)
+
+def fragment_current(fragments, sample, digest):
+  '''
+    true if the sample was rendered from the same data on a previous run
+  '''
+  name = fragment_name(sample)
+  html_fn = os.path.join(fragments, '{}.html'.format(name))
+  digest_fn = os.path.join(fragments, '{}.sha1'.format(name))
+  return os.path.exists(html_fn) and os.path.exists(digest_fn) and open(digest_fn, 'r').read().strip() == digest
+
+def render_fragment(fragments, sample, categories, digest, pandoc):
+  '''
+    write markdown and html for a single sample
+  '''
+  name = fragment_name(sample)
+  md_fn = os.path.join(fragments, '{}.md'.format(name))
+  html_fn = os.path.join(fragments, '{}.html'.format(name))
+  digest_fn = os.path.join(fragments, '{}.sha1'.format(name))
+  with open(md_fn, 'w') as out:
+    write_sample(out, sample, categories)
+  rendered = subprocess.run([pandoc, md_fn], check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+  with open(html_fn, 'w') as out:
+    style_report.process(io.StringIO(rendered), out)
+  with open(digest_fn, 'w') as out:
+    out.write('{}\n'.format(digest))
+
+def write_fragments(fragments, samples, versions, processes, pandoc):
+  '''
+    one report per sample, rendered concurrently, and an index page linking to them
+  '''
+  if not os.path.isdir(fragments):
+    os.makedirs(fragments)
+
+  logging.info('rendering %i samples to %s...', len(samples), fragments)
+  with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+    jobs = []
+    for sample in samples:
+      digest = hashlib.sha1(json.dumps(samples[sample], sort_keys=True).encode('utf-8')).hexdigest()
+      if not fragment_current(fragments, sample, digest):
+        jobs.append(executor.submit(render_fragment, fragments, sample, samples[sample], digest, pandoc))
+    for job in concurrent.futures.as_completed(jobs):
+      job.result()
+  rendered = len(jobs)
+  logging.info('rendered %i samples, %i unchanged', rendered, len(samples) - rendered)
+
+  # lightweight index
+  index = ['<h1>Samples</h1>', '<table>', '<thead><tr><th>Sample</th><th>Categories</th></tr></thead>', '<tbody>']
+  for sample in sorted(samples):
+    index.append('<tr><td><a href="{}.html">{}</a></td><td>{}</td></tr>'.format(fragment_name(sample), html.escape(sample), html.escape(', '.join(samples[sample]))))
+  index.extend(['</tbody>', '</table>'])
+  if versions is not None:
+    index.extend(['<h2>Versions</h2>', '<table>', '<thead><tr><th>Tool</th><th>Version</th></tr></thead>', '<tbody>'])
+    for line in csv.DictReader(open(versions, 'rt'), delimiter='\t'):
+      index.append('<tr><td>{}</td><td>{}</td></tr>'.format(html.escape(line['Tool']), html.escape(line['Version'])))
+    index.extend(['</tbody>', '</table>'])
+  with open(os.path.join(fragments, 'index.html'), 'w') as out:
+    style_report.process(io.StringIO('\n'.join(index)), out)
+
+def main(versions, signatures, burden, msisensor, qc, selected_somatic_variants, all_somatic_variants, all_germline_variants, signature_detail, no_category, fragments=None, processes=1, pandoc='pandoc', store_fn=None):
   logging.info('starting...')
+  store = variant_store.VariantStore(store_fn, readonly=True) if store_fn is not None else None
 
   samples = collections.defaultdict(dict)
   category = 'uncategorized'
@@ -132,105 +356,24 @@ def main(versions, signatures, burden, msisensor, qc, selected_somatic_variants,
       samples[sample][category]['selected_somatic_variants'].append({'gene': row['vep_SYMBOL'], 'category': row['vep_Consequence'], 'cchange': row['vep_HGVSc'], 'polyphen': row['vep_PolyPhen'], 'sift': row['vep_SIFT'], 'clinvar': row.get('clinvar_pathogenic', 'unavailable'), 'gnomad': 'https://gnomad.broadinstitute.org/variant/{CHROM}-{POS}-{REF}-{ALT}'.format(**row)})
 
   if all_somatic_variants is not None:
-    logging.info('processing %s...', all_somatic_variants)
-    # germline variants of interest
-    added = 0
-    for idx, row in enumerate(csv.DictReader(gzip.open(all_somatic_variants, 'rt'), delimiter='\t')):
-      if idx % 100000 == 0 or added > 0 and added % 100 == 0:
-        logging.info('%i variants processed, added %i...', idx, added)
-      if row['VCF_SAMPLE_ID'] is None:
-        continue # skip missing sample
-      if row['GT'] == '0/0' or row['GT'] == './.':
-        continue # skip no genotype
-      if row.get('clinvar_pathogenic', 'unavailable') not in CLINVAR_PASS:
-        continue # skip not annotated as possibly pathogenic
-      if no_category:
-        sample = row['VCF_SAMPLE_ID']
-      else:
-        sample, category = re.split('[-_]', row['VCF_SAMPLE_ID'], 1)
-      if category not in samples[sample]:
-        samples[sample][category] = {}
-      if 'somatic_variants' not in samples[sample][category]:
-        samples[sample][category]['somatic_variants'] = []
-      samples[sample][category]['somatic_variants'].append({'gene': row['vep_SYMBOL'], 'category': row['vep_Consequence'], 'cchange': row['vep_HGVSc'], 'polyphen': row['vep_PolyPhen'], 'sift': row['vep_SIFT'], 'clinvar': row.get('clinvar_pathogenic', 'unavailable'), 'cosmic': row['cosmic'], 'gnomad': 'https://gnomad.broadinstitute.org/variant/{CHROM}-{POS}-{REF}-{ALT}'.format(**row)})
-      added += 1
-
+    # somatic variants of interest
+    add_variants(samples, all_somatic_variants, 'somatic_variants', no_category, 100000, cosmic=True, store=store)
 
   if all_germline_variants is not None:
-    logging.info('processing %s...', all_germline_variants)
     # germline variants of interest
-    added = 0
-    for idx, row in enumerate(csv.DictReader(gzip.open(all_germline_variants, 'rt'), delimiter='\t')):
-      if idx % 1000000 == 0 or added > 0 and added % 100 == 0:
-        logging.info('%i variants processed, added %i...', idx, added)
-      if row['VCF_SAMPLE_ID'] is None:
-        continue # skip missing sample
-      if row['GT'] == '0/0' or row['GT'] == './.':
-        continue # skip no genotype
-      if row.get('clinvar_pathogenic', 'unavailable') not in CLINVAR_PASS:
-        continue # skip not annotated as possibly pathogenic
-      if no_category:
-        sample = re.split('[-_]', row['VCF_SAMPLE_ID'])
-      else:
-        sample, category = re.split('[-_]', row['VCF_SAMPLE_ID'], 1)
-      if category not in samples[sample]:
-        samples[sample][category] = {}
-      if 'germline_variants' not in samples[sample][category]:
-        samples[sample][category]['germline_variants'] = []
-      samples[sample][category]['germline_variants'].append({'gene': row['vep_SYMBOL'], 'category': row['vep_Consequence'], 'cchange': row['vep_HGVSc'], 'polyphen': row['vep_PolyPhen'], 'sift': row['vep_SIFT'], 'clinvar': row.get('clinvar_pathogenic', 'unavailable'), 'gnomad': 'https://gnomad.broadinstitute.org/variant/{CHROM}-{POS}-{REF}-{ALT}'.format(**row)})
-      added += 1
+    add_variants(samples, all_germline_variants, 'germline_variants', no_category, 1000000, store=store)
 
+  if fragments is not None:
+    write_fragments(fragments, samples, versions, processes, pandoc)
+    logging.info('done.')
+    return
 
   # write out results for each sample
   for sample in samples:
-    for category in samples[sample]:
-      sys.stdout.write('\n## {} {}\n'.format(sample, category))
-      if 'qc' in samples[sample][category]:
-        sys.stdout.write('### QC\n')
-        assessment = samples[sample][category]['qc']
-        sys.stdout.write('* {}\n'.format(highlight_if(assessment != 'OK', assessment)))
-      
-      if 'sigs' in samples[sample][category]:
-        sys.stdout.write('\n### COSMIC Signatures\n')
-        items = samples[sample][category]['sigs']
-        for item in items:
-          sys.stdout.write('* {}\n'.format(item))
-      
-      if 'genome' in samples[sample][category]:
-        sys.stdout.write('\n### Burden\n')
-        items = samples[sample][category]['genome']
-        for item in items:
-          sys.stdout.write('* {}\n'.format(item))
-
-      if 'somatic_variants' in samples[sample][category]:
-        sys.stdout.write('\n### Somatic variants of interest ({})\n'.format(len(samples[sample][category]['somatic_variants'])))
-        sys.stdout.write('|Gene|c change|Category|Polyphen|SIFT|Clinvar|COSMIC|Links|\n')
-        sys.stdout.write('|-|-|-|-|-|-|-|-|\n')
-        items = samples[sample][category]['somatic_variants']
-        for item in items:
-          sys.stdout.write('|{}|{}|{}|{}|{}|{}|{}|[Gnomad]({})|\n'.format(item['gene'], item['cchange'], item['category'], item['polyphen'], item['sift'], item['clinvar'], item['cosmic'], item['gnomad']))
-
-      if 'germline_variants' in samples[sample][category]:
-        sys.stdout.write('\n### Germline variants of interest ({})\n'.format(len(samples[sample][category]['germline_variants'])))
-        sys.stdout.write('|Gene|c change|Category|Polyphen|SIFT|Clinvar|Links|\n')
-        sys.stdout.write('|-|-|-|-|-|-|-|\n')
-        items = samples[sample][category]['germline_variants']
-        for item in items:
-          sys.stdout.write('|{}|{}|{}|{}|{}|{}|[Gnomad]({})|\n'.format(item['gene'], item['cchange'], item['category'], item['polyphen'], item['sift'], item['clinvar'], item['gnomad']))
-
-      if 'selected_somatic_variants' in samples[sample][category]:
-        sys.stdout.write('\n### Somatic variants of interest ({})\n'.format(len(samples[sample][category]['selected_somatic_variants'])))
-        sys.stdout.write('|Gene|c change|Category|Polyphen|SIFT|Clinvar|Links|\n')
-        sys.stdout.write('|-|-|-|-|-|-|-|\n')
-        items = samples[sample][category]['selected_somatic_variants']
-        for item in items:
-          sys.stdout.write('|{}|{}|{}|{}|{}|{}|[Gnomad]({})|\n'.format(item['gene'], item['cchange'], item['category'], item['polyphen'], item['sift'], item['clinvar'], item['gnomad']))
+    write_sample(sys.stdout, sample, samples[sample])
 
   if versions is not None:
-    sys.stdout.write('## Versions\n')
-    sys.stdout.write('Tool|Version\n-|-\n')
-    for line in csv.DictReader(open(versions, 'rt'), delimiter='\t'):
-      sys.stdout.write('{} | {}\n'.format(line['Tool'], line['Version']))
+    write_versions(sys.stdout, versions)
   
   logging.info('done.')
 
@@ -247,6 +390,10 @@ if __name__ == '__main__':
   parser.add_argument('--all_somatic_variants', help='all found variants')
   parser.add_argument('--all_germline_variants', required=False, help='all found variants')
   parser.add_argument('--no_category', action='store_true', help='do not infer category')
+  parser.add_argument('--fragments', required=False, help='write a report per sample and an index page to this directory instead of a single markdown report')
+  parser.add_argument('--processes', required=False, type=int, default=1, help='number of sample reports to render concurrently')
+  parser.add_argument('--pandoc', required=False, default='pandoc', help='pandoc executable for rendering fragments')
+  parser.add_argument('--store', required=False, help='variant store (variant_store.py) to query instead of scanning variant files loaded in it')
   parser.add_argument('--verbose', action='store_true', help='more logging')
   args = parser.parse_args()
   if args.verbose:
@@ -254,5 +401,5 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-  main(args.versions, args.signatures, args.burden, args.msisensor, args.qc, args.selected_somatic_variants, args.all_somatic_variants, args.all_germline_variants, args.signature_detail, args.no_category)
+  main(args.versions, args.signatures, args.burden, args.msisensor, args.qc, args.selected_somatic_variants, args.all_somatic_variants, args.all_germline_variants, args.signature_detail, args.no_category, args.fragments, args.processes, args.pandoc, args.store)
 
@@ -8,6 +8,8 @@ import gzip
 import logging
 import sys
 
+import progress
+
 def main(bed, fastqs):
   logging.info('calculating bed coverage...')
   seen = set()
@@ -51,14 +53,15 @@ def main(bed, fastqs):
     current = 0
     min_rl = 1e6
     max_rl = -1
+    counter = progress.Progress(fastq, every=10000000, unit='lines', details=lambda: '{} sequence. read length: {} to {}'.format(current, min_rl, max_rl))
     for idx, line in enumerate(gzip.open(fastq, 'r')):
+      counter.update()
       if idx % 4 == 1:
         rl = len(str(line).strip('\n'))
         min_rl = min(min_rl, rl)
         max_rl = max(max_rl, rl)
         current += rl
-      if (idx + 1) % 10000000 == 0:
-        logging.debug('%s: %i lines. %i sequence. read length: %i to %i', fastq, idx + 1, current, min_rl, max_rl)
+    counter.finish()
     logging.info('%s: %i sequence. read length: %i to %i', fastq, current, min_rl, max_rl)
     sequence += current
     total_min_rl = min(min_rl, total_min_rl)
@@ -83,4 +86,4 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-  main(args.bed, args.fastqs)
+  progress.run(main, args.bed, args.fastqs)
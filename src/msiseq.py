@@ -18,6 +18,8 @@ import intervaltree
 
 import cyvcf2
 
+import progress
+
 def add_intersect(tree, chrom, s, f):
   tree[chrom][s:f] = True
 
@@ -25,7 +27,9 @@ def bed_to_tree(bed):
   logging.info('parsing {}...'.format(bed))
   tree = {}
   size = overlaps = skipped = included = 0
+  counter = progress.Progress('parsing {}'.format(bed), unit='lines', details=lambda: 'skipped {}. {} overlaps. size {}'.format(skipped, overlaps, size))
   for line_count, line in enumerate(open(bed, 'r')):
+    counter.update()
     fields = line.strip('\n').split('\t')
     if len(fields) < 3:
       skipped += 1
@@ -58,9 +62,7 @@ def bed_to_tree(bed):
       size += (new_end - new_begin) - (f - s)
       s = new_begin
       f = new_end
-
-    if line_count % 100000 == 0:
-      logging.debug('parsing {}: {} lines parsed. skipped {}. {} overlaps. size {}'.format(bed, line_count, skipped, overlaps, size))
+  counter.finish()
   logging.info('parsing {}: done. lines skipped: {}. size: {}. count: {}'.format(bed, skipped, size, included))
   return tree, size
 
@@ -88,7 +90,9 @@ def msiseq(vcfs, repeats, capture, threshold, capture_size, is_maf):
   sys.stdout.write('Sample\tS.ind.count\tS.ind\tT.ind\tClass\n')
   for vcf, vcf_in in vcf_list(vcfs, is_maf):
     count = reject_capture = reject_repeat = 0
+    counter = progress.Progress('processing {}'.format(vcf), unit='variants', details=lambda: 'count {}'.format(count))
     for v in vcf_in:
+      counter.update()
       if is_indel(v): 
         if v.CHROM.startswith('chr'):
           chrom = v.CHROM[3:]
@@ -105,6 +109,7 @@ def msiseq(vcfs, repeats, capture, threshold, capture_size, is_maf):
         else:
           # it's an indel not in the capture
           reject_capture += 1
+    counter.finish()
 
     logging.info('processing %s: count %i outside capture: %i in capture but not in a repeat: %i', vcf, count, reject_capture, reject_repeat)
     per_mb = count / capture_size * 1000000
@@ -145,10 +150,9 @@ def maf_to_vcf(maf, sample, sample_col='Tumor_Sample_Barcode', chrom_col='Chromo
 
   # enumeration a maf into a variant
   header = None
-  for line, row in enumerate(csv.reader(open_file(maf, True), delimiter='\t')):
-    if line % 1000 == 0:
-      logging.debug('processed %i lines of %s...', line, maf)
-
+  counter = progress.Progress('reading {}'.format(maf), unit='lines')
+  for row in csv.reader(open_file(maf, True), delimiter='\t'):
+    counter.update()
     if row[0].startswith('#'):
       continue
     if header is None:
@@ -170,6 +174,7 @@ def maf_to_vcf(maf, sample, sample_col='Tumor_Sample_Barcode', chrom_col='Chromo
     alt = get_value(header, alt_col, row).replace('-', '')
 
     yield Variant(chrom, pos, ref, (alt,))
+  counter.finish()
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Classify MSI using msiseq algorithm')
@@ -185,5 +190,5 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
-  msiseq(args.vcfs, args.repeats, args.capture, args.threshold, args.capture_size, args.is_maf)
+  progress.run(msiseq, args.vcfs, args.repeats, args.capture, args.threshold, args.capture_size, args.is_maf)
 
@@ -16,12 +16,16 @@ import sys
 import cyvcf2
 import intervaltree
 
+import progress
+
 def main(vcfs, bed, min_dp, min_af, min_qual, indels, sample_name, signature_artefacts, signature_artefact_penalty, pass_only):
   size = overlaps = skipped = included = 0
   if bed is not None:
     logging.info('parsing %s...', bed)
     tree = {}
+    counter = progress.Progress('parsing {}'.format(bed), unit='lines', details=lambda: 'skipped {}. {} overlaps. size {}'.format(skipped, overlaps, size))
     for line_count, line in enumerate(open(bed, 'r')):
+      counter.update()
       fields = line.strip('\n').split('\t')
       if len(fields) < 4:
         skipped += 1
@@ -48,8 +52,7 @@ def main(vcfs, bed, min_dp, min_af, min_qual, indels, sample_name, signature_art
           size += (new_end - new_begin) - (f - s)
           s = new_begin
           f = new_end
-      if line_count % 100000 == 0:
-        logging.debug('parsing {}: {} lines parsed. skipped {}. {} overlaps. size {}'.format(bed, line_count, skipped, overlaps, size))
+    counter.finish()
     logging.info('parsing {}: done. lines skipped: {}. size: {}. count: {}'.format(bed, skipped, size, included))
   else:
     tree = None
@@ -74,7 +77,9 @@ def main(vcfs, bed, min_dp, min_af, min_qual, indels, sample_name, signature_art
     else:
       sample_id = vcf_in.samples.index(sample_name)
 
+    counter = progress.Progress('parsing {}'.format(vcf), unit='variants', details=lambda: 'accepted {:.0f}'.format(accept))
     for variant in vcf_in:
+      counter.update()
       logging.debug('assessing %s...', variant)
       if variant.QUAL is not None and variant.QUAL < min_qual:
         reject_filter += 1
@@ -133,6 +138,7 @@ def main(vcfs, bed, min_dp, min_af, min_qual, indels, sample_name, signature_art
           else:
             accept += 1
           #sys.stdout.write('{}:{}\n'.format(variant.CHROM, variant.POS))
+    counter.finish()
     if size == 0:
       size = 1
     if included == 0:
@@ -159,4 +165,4 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-  main(args.vcfs, args.bed, args.min_dp, args.min_af, args.min_qual, args.indels_only, args.sample_name, args.signature_artefacts, args.signature_artefact_penalty, args.pass_only)
+  progress.run(main, args.vcfs, args.bed, args.min_dp, args.min_af, args.min_qual, args.indels_only, args.sample_name, args.signature_artefacts, args.signature_artefact_penalty, args.pass_only)
@@ -21,6 +21,8 @@ from matplotlib.offsetbox import AnchoredText
 
 import cyvcf2
 
+import progress
+
 SQUIGGEM=0.013
 YSQUIGGEM=0.01
 DPI=300
@@ -81,10 +83,10 @@ def main(samples, dp_threshold, target, info_af, log, filter, just_pass, use_lik
   
     sample_id = vcf_in.samples.index(sample)
   
+    counter = progress.Progress('reading {}'.format(vcf), unit='variants')
     for variant_count, variant in enumerate(vcf_in):
       # GL000220.1      135366  .       T       C       .       LowEVS;LowDepth SOMATIC;QSS=1;TQSS=1;NT=ref;QSS_NT=1;TQSS_NT=1;SGT=TT->TT;DP=2;MQ=60.00;MQ0=0;ReadPosRankSum=0.00;SNVSB=0.00;SomaticEVS=0.71    DP:FDP:SDP:SUBDP:AU:CU:GU:TU    1:0:0:0:0,0:0,0:0,0:1,1 1:0:0:0:0,0:1,1:0,0:0,0
-      if (variant_count + 1 ) % 100000 == 0:
-        logging.info('%i variants processed...', variant_count + 1)
+      counter.update()
   
       if len(variant.ALT) > 1:
         logging.warn('variant %i is multi-allelic', variant_count + 1)
@@ -156,6 +158,7 @@ def main(samples, dp_threshold, target, info_af, log, filter, just_pass, use_lik
         if is_pass or not just_pass:
           if sig is not None:
             sig_ads[sig].append(value)
+    counter.finish()
     vcf_ads[name] = (ads, ads_nopass)
     logging.info("finished reading %s", name)
 
@@ -339,4 +342,4 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
   # sample af vcf
-  main(args.sample, args.dp, args.target, args.info_af, args.log, args.filter, args.just_pass, args.signature_likelihoods, args.percent, args.title, args.genes, args.consequences, args.vep_format, args.impacts, args.gene_colors, args.annotate, args.vcfs, args.vcf_names, args.width, args.height, args.annotate_graph)
+  progress.run(main, args.sample, args.dp, args.target, args.info_af, args.log, args.filter, args.just_pass, args.signature_likelihoods, args.percent, args.title, args.genes, args.consequences, args.vep_format, args.impacts, args.gene_colors, args.annotate, args.vcfs, args.vcf_names, args.width, args.height, args.annotate_graph)
@@ -0,0 +1,153 @@
+'''
+  progress and resource reporting for the record loops in src/
+  - Progress logs records per second, elapsed time, current rss and bytes read every N records
+  - run() calls a script's main and logs a final METRICS line of json with every counter, the peak rss and bytes read
+  - if SOMATIC_PIPELINE_PROFILE is set, run() also profiles main with cProfile
+    1 writes <log>.prof next to the log that stderr is redirected to (or <script>.<pid>.prof in the current directory),
+    any other value is a directory to write <script>.<pid>.prof to
+'''
+
+import cProfile
+import json
+import logging
+import os
+import resource
+import sys
+import time
+
+PROFILE_ENV = 'SOMATIC_PIPELINE_PROFILE'
+EVERY = 100000
+
+# counters created since run() was last called
+counters = []
+
+def peak_rss_mb():
+  # ru_maxrss is in KB on linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def rss_mb():
+  try:
+    with open('/proc/self/statm', 'r') as fh:
+      return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+  except (OSError, ValueError, IndexError):
+    return peak_rss_mb()
+
+def bytes_read():
+  '''
+    bytes read by this process so far including by htslib, or None if not available
+  '''
+  try:
+    with open('/proc/self/io', 'r') as fh:
+      for line in fh:
+        if line.startswith('rchar:'):
+          return int(line.split()[1])
+  except (OSError, ValueError):
+    pass
+  return None
+
+def megabytes(value):
+  return None if value is None else round(value / 1024 / 1024, 1)
+
+class Progress(object):
+  '''
+    counts records in a loop, call update() once per record and finish() after the loop
+    - details is an optional function returning extra text for the log, only called when logging
+  '''
+  def __init__(self, name, every=EVERY, unit='records', details=None):
+    self.name = name
+    self.every = every
+    self.unit = unit
+    self.details = details
+    self.count = 0
+    self.next_log = every
+    self.start = time.time()
+    self.start_read = bytes_read()
+    self.end = self.end_read = None
+    counters.append(self)
+
+  def update(self, count=1):
+    self.count += count
+    if self.count >= self.next_log:
+      self.log()
+      self.next_log = (self.count // self.every + 1) * self.every
+
+  def finish(self):
+    if self.end is None:
+      self.end = time.time()
+      self.end_read = bytes_read()
+
+  def elapsed(self):
+    return (self.end or time.time()) - self.start
+
+  def rate(self):
+    elapsed = self.elapsed()
+    return self.count / elapsed if elapsed > 0 else 0.0
+
+  def read(self):
+    current = self.end_read if self.end is not None else bytes_read()
+    if current is None or self.start_read is None:
+      return None
+    return current - self.start_read
+
+  def log(self, level=logging.INFO):
+    read = self.read()
+    message = '{}: {} {} in {:.1f}s ({:.0f}/s). rss {:.0f}MB'.format(self.name, self.count, self.unit, self.elapsed(), self.rate(), rss_mb())
+    if read is not None:
+      message += '. read {:.1f}MB'.format(read / 1024 / 1024)
+    if self.details is not None:
+      message += '. {}'.format(self.details())
+    logging.log(level, message)
+
+  def metrics(self):
+    return {'name': self.name, 'unit': self.unit, 'count': self.count, 'seconds': round(self.elapsed(), 3), 'per_second': round(self.rate(), 1), 'read_mb': megabytes(self.read())}
+
+def profile_filename(script):
+  setting = os.environ.get(PROFILE_ENV, '')
+  if setting in ('', '0'):
+    return None
+  if setting != '1':
+    os.makedirs(setting, exist_ok=True)
+    return os.path.join(setting, '{}.{}.prof'.format(script, os.getpid()))
+  try:
+    log_fn = os.readlink('/proc/self/fd/2')
+    if os.path.isfile(log_fn):
+      return '{}.prof'.format(log_fn)
+  except OSError:
+    pass
+  return '{}.{}.prof'.format(script, os.getpid())
+
+def run(main, *args, **kwargs):
+  '''
+    call main(*args, **kwargs) with metrics and optional profiling, returns what main returns
+  '''
+  del counters[:]
+  script = os.path.basename(sys.argv[0]).replace('.py', '')
+  start = time.time()
+  start_read = bytes_read()
+  profile_fn = profile_filename(script)
+  profiler = None
+  if profile_fn is not None:
+    profiler = cProfile.Profile()
+    profiler.enable()
+  ok = False
+  try:
+    result = main(*args, **kwargs)
+    ok = True
+    return result
+  finally:
+    if profiler is not None:
+      profiler.disable()
+      profiler.dump_stats(profile_fn)
+      logging.info('wrote profile to %s', profile_fn)
+    for counter in counters:
+      counter.finish()
+    read = bytes_read()
+    metrics = {
+      'script': script,
+      'ok': ok,
+      'seconds': round(time.time() - start, 3),
+      'peak_rss_mb': round(peak_rss_mb(), 1),
+      'read_mb': megabytes(None if read is None or start_read is None else read - start_read),
+      'counters': [counter.metrics() for counter in counters]
+    }
+    logging.info('METRICS %s', json.dumps(metrics, sort_keys=True))
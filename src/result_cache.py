@@ -0,0 +1,123 @@
+'''
+  content addressed cache of the results of src/ commands
+  - the key is a hash of the script, the local modules it imports, its arguments and the content of its inputs
+  - arguments are kept as given, since scripts may write input filenames into their output and choose the output format from the output filename
+  - file digests are remembered by size and modification time so unchanged inputs are only read once
+  - each entry is a directory of outputs and a manifest, written elsewhere and renamed into place when complete
+'''
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+
+VERSION = 2
+BLOCK_SIZE = 1024 * 1024
+
+def stream_digest(fh):
+  digest = hashlib.sha256()
+  while True:
+    block = fh.read(BLOCK_SIZE)
+    if not block:
+      break
+    digest.update(block)
+  return digest.hexdigest()
+
+def write_json(fn, value):
+  tmp_fn = '{}.{}.tmp'.format(fn, os.getpid())
+  with open(tmp_fn, 'w') as fh:
+    json.dump(value, fh)
+  os.replace(tmp_fn, fn)
+
+def local_modules(script):
+  '''
+    modules next to script that it imports, whose changes should also invalidate its results
+  '''
+  directory = os.path.dirname(script)
+  source = open(script, 'r').read()
+  result = []
+  for fn in sorted(os.listdir(directory)):
+    name = fn[:-3]
+    if fn.endswith('.py') and os.path.join(directory, fn) != script and re.search(r'^\s*(import|from)\s+{}\b'.format(re.escape(name)), source, re.MULTILINE):
+      result.append(os.path.join(directory, fn))
+  return result
+
+class ResultCache(object):
+  def __init__(self, directory):
+    self.directory = directory
+    os.makedirs(os.path.join(directory, 'digests'), exist_ok=True)
+
+  def file_digest(self, fn):
+    stat = os.stat(fn)
+    key = [stat.st_size, stat.st_mtime_ns]
+    memo_fn = os.path.join(self.directory, 'digests', '{}.json'.format(hashlib.sha1(os.path.abspath(fn).encode('utf-8')).hexdigest()))
+    try:
+      memo = json.load(open(memo_fn, 'r'))
+      if memo['key'] == key:
+        return memo['digest']
+    except (OSError, ValueError, KeyError):
+      pass
+    logging.debug('calculating digest of %s...', fn)
+    with open(fn, 'rb') as fh:
+      digest = stream_digest(fh)
+    try:
+      write_json(memo_fn, {'key': key, 'digest': digest})
+    except OSError as ex:
+      logging.warn('unable to write digest %s: %s', memo_fn, ex)
+    return digest
+
+  def key(self, script, args, inputs, outputs, stdin_digest=None, stdout=False):
+    '''
+      inputs and outputs are filenames, stdin_digest is the digest of the content on stdin if any
+    '''
+    details = {
+      'version': VERSION,
+      'code': [self.file_digest(fn) for fn in [script] + local_modules(script)],
+      'args': list(args),
+      'inputs': [self.file_digest(fn) for fn in inputs],
+      'stdin': stdin_digest,
+      'outputs': len(outputs),
+      'stdout': stdout
+    }
+    return hashlib.sha256(json.dumps(details, sort_keys=True).encode('utf-8')).hexdigest()
+
+  def entry(self, key):
+    return os.path.join(self.directory, key[:2], key)
+
+  def outputs(self, key):
+    '''
+      cached output filenames for key in the order they were stored, or None if there is no result for key
+    '''
+    entry = self.entry(key)
+    try:
+      manifest = json.load(open(os.path.join(entry, 'manifest.json'), 'r'))
+    except (OSError, ValueError):
+      return None
+    return [os.path.join(entry, 'output{}'.format(idx)) for idx in range(manifest['outputs'])]
+
+  def store(self, key, outputs, description):
+    entry = self.entry(key)
+    if os.path.exists(entry):
+      return
+    tmp_entry = '{}.{}.tmp'.format(entry, os.getpid())
+    try:
+      os.makedirs(tmp_entry)
+      for idx, fn in enumerate(outputs):
+        shutil.copyfile(fn, os.path.join(tmp_entry, 'output{}'.format(idx)))
+      write_json(os.path.join(tmp_entry, 'manifest.json'), {'outputs': len(outputs), 'description': description})
+      os.rename(tmp_entry, entry)
+      logging.info('stored %i outputs in %s', len(outputs), entry)
+    except OSError as ex:
+      # another process may have stored the same result first
+      logging.warn('unable to store %s: %s', entry, ex)
+      shutil.rmtree(tmp_entry, ignore_errors=True)
+
+def restore(cached_fn, fn):
+  '''
+    copy a cached output to fn, replacing it only once complete
+  '''
+  tmp_fn = '{}.{}.tmp'.format(fn, os.getpid())
+  shutil.copyfile(cached_fn, tmp_fn)
+  os.replace(tmp_fn, fn)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+'''
+  run several vcf scripts as stages of one process over a single stream of records
+  - a stage is a src/ script with add_arguments(parser) and stage(vcf_in, **args), which returns a generator function over records
+  - records are parsed once, passed between stages as cyvcf2 variants and written once, giving the same result as piping the scripts together
+  - stage names are script names, the annotate_ prefix is optional
+  - the arguments of each stage follow the list of stages, separated by :
+  - --regions reads only records whose POS is in the given regions of an indexed input, so regions that cut through a long record do not both emit it. give it after the stages
+  - usage: run_stages.py --input in.vcf.gz --output out.vcf.gz annotate_af,cosmic,filter_af : TUMOR : --cosmic cosmic.vcf.gz : --sample TUMOR --af 0.05 --dp 10
+'''
+
+import argparse
+import importlib
+import logging
+import sys
+
+import progress
+import vcf_io
+
+STAGES = ('annotate_af', 'annotate_cosmic', 'filter_af')
+SEPARATOR = ':'
+
+def stage_module(name):
+  for candidate in (name, 'annotate_{}'.format(name)):
+    if candidate in STAGES:
+      return importlib.import_module(candidate)
+  raise ValueError('unknown stage {}. available: {}'.format(name, ', '.join(STAGES)))
+
+def split_arguments(argv):
+  '''
+    the arguments before the first separator, and a list of arguments for each stage
+  '''
+  chunks = [[]]
+  for arg in argv:
+    if arg == SEPARATOR:
+      chunks.append([])
+    else:
+      chunks[-1].append(arg)
+  return chunks[0], chunks[1:]
+
+def in_regions(vcf_in, regions):
+  '''
+    records with POS in each chrom or chrom:start-end region in turn
+  '''
+  for region in regions:
+    if ':' not in region:
+      for variant in vcf_in(region):
+        yield variant
+      continue
+    start, end = [int(x.replace(',', '')) for x in region.rsplit(':', 1)[1].split('-')]
+    for variant in vcf_in(region):
+      if start <= variant.POS <= end:
+        yield variant
+
+def main(names, stage_arguments, input_fn='-', output='-', threads=1, regions=None):
+  if len(stage_arguments) > len(names):
+    raise ValueError('arguments for {} stages given for {} stages'.format(len(stage_arguments), len(names)))
+  stage_arguments = stage_arguments + [[]] * (len(names) - len(stage_arguments))
+
+  vcf_in = vcf_io.reader(input_fn, threads)
+  variants = vcf_in
+  if regions is not None:
+    variants = in_regions(vcf_in, regions)
+  # each stage updates the header when it is created so all are created before the writer
+  for name, args in zip(names, stage_arguments):
+    module = stage_module(name)
+    parser = argparse.ArgumentParser(prog=name)
+    module.add_arguments(parser)
+    logging.info('adding stage %s %s', name, ' '.join(args))
+    variants = module.stage(vcf_in, **vars(parser.parse_args(args)))(variants)
+
+  vcf_out = vcf_io.writer(output, vcf_in, threads)
+  counter = progress.Progress('writing {}'.format(output), unit='variants')
+  for variant in variants:
+    counter.update()
+    vcf_out.write_record(variant)
+  counter.finish()
+  vcf_out.close()
+  logging.info('wrote %i variants after %i stages', counter.count, len(names))
+
+if __name__ == '__main__':
+  arguments, stage_arguments = split_arguments(sys.argv[1:])
+  parser = argparse.ArgumentParser(description='Run vcf scripts as stages of one process')
+  parser.add_argument('stages', help='comma separated stages, from {}'.format(', '.join(STAGES)))
+  parser.add_argument('--input', required=False, default='-', help='input vcf (default stdin)')
+  parser.add_argument('--regions', required=False, nargs='+', help='only records with POS in these chrom or chrom:start-end regions of an indexed input')
+  vcf_io.add_arguments(parser)
+  parser.add_argument('--verbose', action='store_true', help='more logging')
+  args = parser.parse_args(arguments)
+  if args.verbose:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
+  else:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+  progress.run(main, args.stages.split(','), stage_arguments, args.input, args.output, args.threads, args.regions)
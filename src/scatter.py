@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+'''
+  split the genome into shards of similar work for scattered variant calling and post-processing
+  - work is the number of target bases, or of callable bases if no targets are given
+  - callable bases exclude gaps (e.g. runs of N) and, if given, anything outside the accessible regions
+  - shards are contiguous in genome order and break between targets or across gaps at least min_gap long
+  - a stretch of work without such a break that is larger than a shard is split at fixed intervals
+  - each shard is written as a bed of the intervals to call, and a territory bed so that every position belongs to exactly one shard
+'''
+
+import argparse
+import collections
+import logging
+import math
+import os
+import sys
+
+Unit = collections.namedtuple('Unit', ['chrom', 'intervals', 'weight'])
+
+# work without a break is split into pieces this many times smaller than a shard, so shards can be packed evenly
+PIECES_PER_SHARD = 8
+
+def read_lengths(fn):
+  '''
+    chromosome lengths in genome order from a faidx or chrom\\tlength file
+  '''
+  result = []
+  for line in open(fn, 'r'):
+    if line.startswith('#') or len(line.strip()) == 0:
+      continue
+    fields = line.strip('\n').split('\t')
+    result.append((fields[0], int(fields[1])))
+  return result
+
+def read_bed(fn):
+  '''
+    sorted and merged intervals for each chromosome
+  '''
+  intervals = collections.defaultdict(list)
+  for line in open(fn, 'r'):
+    if line.startswith(('#', 'track', 'browser')) or len(line.strip()) == 0:
+      continue
+    fields = line.strip('\n').split('\t')
+    intervals[fields[0]].append((int(fields[1]), int(fields[2])))
+  return dict((chrom, merge(intervals[chrom])) for chrom in intervals)
+
+def merge(intervals):
+  result = []
+  for start, end in sorted(intervals):
+    if len(result) > 0 and start <= result[-1][1]:
+      result[-1] = (result[-1][0], max(result[-1][1], end))
+    elif end > start:
+      result.append((start, end))
+  return result
+
+def intersect(first, second):
+  '''
+    intersection of two sorted, merged lists of intervals
+  '''
+  result = []
+  i = j = 0
+  while i < len(first) and j < len(second):
+    start = max(first[i][0], second[j][0])
+    end = min(first[i][1], second[j][1])
+    if start < end:
+      result.append((start, end))
+    if first[i][1] < second[j][1]:
+      i += 1
+    else:
+      j += 1
+  return result
+
+def subtract(first, second):
+  '''
+    first with the sorted, merged intervals in second removed
+  '''
+  result = []
+  j = 0
+  for start, end in first:
+    while j < len(second) and second[j][1] <= start:
+      j += 1
+    k = j
+    while k < len(second) and second[k][0] < end:
+      if second[k][0] > start:
+        result.append((start, second[k][0]))
+      start = max(start, second[k][1])
+      k += 1
+    if start < end:
+      result.append((start, end))
+  return result
+
+def units(lengths, regions=None, gaps=None, access=None, min_gap=3000):
+  '''
+    smallest pieces of work in genome order, which are never split across shards
+    - targets closer than min_gap are kept together so padded calling intervals from different shards cannot overlap
+  '''
+  result = []
+  for chrom, length in lengths:
+    callable_intervals = [(0, length)]
+    if gaps is not None:
+      callable_intervals = subtract(callable_intervals, gaps.get(chrom, []))
+    if access is not None:
+      callable_intervals = intersect(callable_intervals, access.get(chrom, []))
+    if regions is not None:
+      targets = intersect(regions.get(chrom, []), callable_intervals)
+    else:
+      targets = callable_intervals
+
+    current = []
+    for start, end in targets:
+      if len(current) > 0 and start - current[-1][1] >= min_gap:
+        result.append(Unit(chrom, current, sum([e - s for s, e in current])))
+        current = []
+      current.append((start, end))
+    if len(current) > 0:
+      result.append(Unit(chrom, current, sum([e - s for s, e in current])))
+  return result
+
+def split(unit, size):
+  '''
+    unit as pieces of at most size bases of work, cut at fixed intervals
+    - the padded calling intervals of neighbouring pieces overlap, as fixed windows always have
+  '''
+  pieces = int(math.ceil(unit.weight / size))
+  if pieces <= 1:
+    return [unit]
+  cuts = [int(round(unit.weight * piece / pieces)) for piece in range(1, pieces)] + [unit.weight]
+  result = []
+  current = []
+  done = 0 # work before the current interval
+  for start, end in unit.intervals:
+    while start < end:
+      take = min(end - start, cuts[len(result)] - done)
+      current.append((start, start + take))
+      start += take
+      done += take
+      if done == cuts[len(result)]:
+        result.append(Unit(unit.chrom, current, sum([e - s for s, e in current])))
+        current = []
+  return result
+
+def pack(weights, capacity):
+  '''
+    shard index of each weight, filling each shard in order up to capacity
+  '''
+  result = []
+  shard = load = 0
+  for weight in weights:
+    if load > 0 and load + weight > capacity:
+      shard += 1
+      load = 0
+    result.append(shard)
+    load += weight
+  return result
+
+def balance(weights, count):
+  '''
+    contiguous assignment of weights to at most count shards minimising the largest shard
+  '''
+  if len(weights) == 0:
+    return []
+  low, high = max(weights), sum(weights)
+  while low < high:
+    capacity = (low + high) // 2
+    if pack(weights, capacity)[-1] < count:
+      high = capacity
+    else:
+      low = capacity + 1
+  return pack(weights, low)
+
+def territories(lengths, shard_units, assignment):
+  '''
+    (chrom, start, end) spans for each shard covering the whole genome
+    - a chromosome is cut halfway across the gap between units in different shards
+    - chromosomes without units belong to the shard of the previous chromosome
+  '''
+  result = collections.defaultdict(list)
+  by_chrom = collections.defaultdict(list)
+  for unit, shard in zip(shard_units, assignment):
+    by_chrom[unit.chrom].append((unit, shard))
+
+  current = 0
+  for chrom, length in lengths:
+    start = 0
+    for (unit, shard), (next_unit, next_shard) in zip(by_chrom[chrom], by_chrom[chrom][1:]):
+      if shard != next_shard:
+        cut = (unit.intervals[-1][1] + next_unit.intervals[0][0]) // 2
+        result[shard].append((chrom, start, cut))
+        start = cut
+    if len(by_chrom[chrom]) > 0:
+      current = by_chrom[chrom][-1][1]
+    result[current].append((chrom, start, length))
+  return result
+
+def shards(lengths, count, regions=None, gaps=None, access=None, min_gap=3000):
+  '''
+    list of (intervals, territory, weight) for each shard, intervals and territory are lists of (chrom, start, end)
+  '''
+  shard_units = units(lengths, regions, gaps, access, min_gap)
+  if count > 0 and len(shard_units) > 0:
+    size = max(1, int(math.ceil(sum([unit.weight for unit in shard_units]) / (count * PIECES_PER_SHARD))))
+    shard_units = [piece for unit in shard_units for piece in split(unit, size)]
+  assignment = balance([unit.weight for unit in shard_units], count)
+  shard_territories = territories(lengths, shard_units, assignment)
+  result = []
+  for shard in range(max(assignment) + 1 if len(assignment) > 0 else 0):
+    members = [unit for unit, unit_shard in zip(shard_units, assignment) if unit_shard == shard]
+    intervals = [(unit.chrom, start, end) for unit in members for start, end in unit.intervals]
+    result.append((intervals, shard_territories[shard], sum([unit.weight for unit in members])))
+  return result
+
+def shard_name(idx):
+  return 'shard_{:04d}'.format(idx + 1)
+
+def regions(territory):
+  '''
+    territory as 1-based regions for tabix and samtools
+  '''
+  return ['{}:{}-{}'.format(chrom, start + 1, end) for chrom, start, end in territory]
+
+def write_bed(fn, intervals):
+  '''
+    leaves fn untouched if it already has these intervals, so shards can be regenerated while jobs are using them
+  '''
+  content = ''.join(['{}\t{}\t{}\n'.format(chrom, start, end) for chrom, start, end in intervals])
+  if os.path.exists(fn) and open(fn, 'r').read() == content:
+    return
+  tmp_fn = '{}.{}.tmp'.format(fn, os.getpid())
+  with open(tmp_fn, 'w') as fh:
+    fh.write(content)
+  os.replace(tmp_fn, fn)
+
+def write_shards(output_dir, result):
+  '''
+    writes shard_NNNN.bed and shard_NNNN.territory.bed to output_dir, returns the shard names
+  '''
+  os.makedirs(output_dir, exist_ok=True)
+  names = []
+  for idx, (intervals, territory, weight) in enumerate(result):
+    name = shard_name(idx)
+    write_bed(os.path.join(output_dir, '{}.bed'.format(name)), intervals)
+    write_bed(os.path.join(output_dir, '{}.territory.bed'.format(name)), territory)
+    names.append(name)
+  return names
+
+def main(lengths_fn, count, regions_fn, gaps_fn, access_fn, min_gap, output_dir):
+  lengths = read_lengths(lengths_fn)
+  logging.info('read %i chromosomes from %s', len(lengths), lengths_fn)
+  target_regions = read_bed(regions_fn) if regions_fn is not None else None
+  gaps = read_bed(gaps_fn) if gaps_fn is not None else None
+  access = read_bed(access_fn) if access_fn is not None else None
+
+  result = shards(lengths, count, target_regions, gaps, access, min_gap)
+  names = write_shards(output_dir, result)
+
+  sys.stdout.write('shard\tintervals\tbases\tterritory\n')
+  for name, (intervals, territory, weight) in zip(names, result):
+    sys.stdout.write('{}\t{}\t{}\t{}\n'.format(name, len(intervals), weight, ','.join(regions(territory))))
+  weights = [weight for _, _, weight in result]
+  if len(weights) > 0:
+    logging.info('wrote %i shards to %s. bases per shard: min %i mean %.0f max %i', len(names), output_dir, min(weights), sum(weights) / len(weights), max(weights))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Split the genome into shards balanced by target bases')
+  parser.add_argument('--lengths', required=True, help='chromosome lengths in genome order e.g. reference/genome.lengths')
+  parser.add_argument('--shards', required=True, type=int, help='maximum number of shards')
+  parser.add_argument('--regions', required=False, help='target bed, work is measured in target bases')
+  parser.add_argument('--gaps', required=False, help='bed of gaps such as runs of N, never called and safe to break at')
+  parser.add_argument('--access', required=False, help='bed of accessible regions, everything else is treated as a gap')
+  parser.add_argument('--min_gap', required=False, type=int, default=3000, help='only break between targets at least this far apart, should exceed twice the interval padding used when calling')
+  parser.add_argument('--output_dir', required=True, help='where to write the shard beds')
+  parser.add_argument('--verbose', action='store_true', help='more logging')
+  args = parser.parse_args()
+  if args.verbose:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
+  else:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+  main(args.lengths, args.shards, args.regions, args.gaps, args.access, args.min_gap, args.output_dir)
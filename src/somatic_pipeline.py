@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+'''
+  single entry point for the scripts in src/
+  - somatic_pipeline.py <command> [args...] runs src/<command>.py in this process
+  - heavy libraries (cyvcf2, numpy, matplotlib) are only imported by the commands that use them
+  - --batch runs many commands from a file in one process so imports are paid once
+    each line is: command args... [< input] [> output]
+  - --cache restores the outputs of a command from a content addressed cache if the script, arguments and inputs are unchanged
+    inputs are stdin and any argument naming an existing file, outputs are stdout and the values of OUTPUT_OPTIONS
+'''
+
+import argparse
+import logging
+import os
+import runpy
+import shlex
+import shutil
+import stat
+import sys
+import time
+
+import result_cache
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+NOT_COMMANDS = ('somatic_pipeline', 'vcf_io', 'result_cache', 'progress')
+OUTPUT_OPTIONS = ('--output', '--target')
+
+def commands():
+  return sorted([fn[:-3] for fn in os.listdir(SRC) if fn.endswith('.py') and fn[:-3] not in NOT_COMMANDS])
+
+def script_for(command):
+  name = command.replace('-', '_')
+  if name not in commands():
+    raise ValueError('unknown command {}. available: {}'.format(command, ', '.join(commands())))
+  return os.path.join(SRC, '{}.py'.format(name))
+
+class Redirect(object):
+  '''
+    point stdin/stdout at files at the file descriptor level so htslib ('-') sees them as well
+  '''
+  def __init__(self, stdin_fn, stdout_fn):
+    self.stdin_fn = stdin_fn
+    self.stdout_fn = stdout_fn
+
+  def __enter__(self):
+    sys.stdout.flush()
+    self.saved_stdin = self.saved_stdout = None
+    if self.stdin_fn is not None:
+      self.saved_stdin = (os.dup(0), sys.stdin)
+      fd = os.open(self.stdin_fn, os.O_RDONLY)
+      os.dup2(fd, 0)
+      os.close(fd)
+      sys.stdin = open(0, 'r', closefd=False)
+    if self.stdout_fn is not None:
+      self.saved_stdout = (os.dup(1), sys.stdout)
+      fd = os.open(self.stdout_fn, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+      os.dup2(fd, 1)
+      os.close(fd)
+      sys.stdout = open(1, 'w', closefd=False)
+    return self
+
+  def __exit__(self, *args):
+    if self.saved_stdout is not None:
+      sys.stdout.flush()
+      os.dup2(self.saved_stdout[0], 1)
+      os.close(self.saved_stdout[0])
+      sys.stdout = self.saved_stdout[1]
+    if self.saved_stdin is not None:
+      os.dup2(self.saved_stdin[0], 0)
+      os.close(self.saved_stdin[0])
+      sys.stdin = self.saved_stdin[1]
+    return False
+
+def run(command, args, stdin_fn=None, stdout_fn=None):
+  '''
+    run a script as if from the command line, returns its exit code
+  '''
+  try:
+    script = script_for(command)
+  except ValueError as ex:
+    logging.error('%s', ex)
+    return 1
+  saved_argv = sys.argv
+  sys.argv = [script] + list(args)
+  try:
+    with Redirect(stdin_fn, stdout_fn):
+      runpy.run_path(script, run_name='__main__')
+    return 0
+  except SystemExit as ex:
+    if ex.code is None:
+      return 0
+    if isinstance(ex.code, int):
+      return ex.code
+    sys.stderr.write('{}\n'.format(ex.code))
+    return 1
+  except Exception:
+    logging.exception('%s failed', command)
+    return 1
+  finally:
+    sys.argv = saved_argv
+
+def stdin_digest():
+  '''
+    digest of stdin if it is a regular file, leaving it at the same position
+  '''
+  position = os.lseek(0, 0, os.SEEK_CUR)
+  with os.fdopen(os.dup(0), 'rb') as fh:
+    digest = result_cache.stream_digest(fh)
+  os.lseek(0, position, os.SEEK_SET)
+  return digest
+
+def run_cached(cache, command, args, stdin_fn=None, stdout_fn=None, ignore_stdin=False):
+  '''
+    run a script, or restore its outputs from cache if it has already been run on the same inputs
+  '''
+  try:
+    script = script_for(command)
+  except ValueError as ex:
+    logging.error('%s', ex)
+    return 1
+
+  if stdin_fn is not None:
+    stdin = cache.file_digest(stdin_fn)
+  elif ignore_stdin:
+    stdin = None
+  else:
+    mode = os.fstat(0).st_mode
+    if stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode):
+      logging.info('not caching %s: stdin is a pipe (use --ignore_stdin if the command does not read it)', command)
+      return run(command, args, stdin_fn, stdout_fn)
+    stdin = stdin_digest() if stat.S_ISREG(mode) else None
+
+  outputs = [args[idx + 1] for idx, arg in enumerate(args[:-1]) if arg in OUTPUT_OPTIONS and args[idx + 1] != '-']
+  inputs = [arg for arg in args if arg not in outputs and os.path.isfile(arg)]
+  key = cache.key(script, args, inputs, outputs, stdin, stdout=True)
+
+  cached = cache.outputs(key)
+  if cached is not None:
+    for cached_fn, fn in zip(cached, outputs):
+      result_cache.restore(cached_fn, fn)
+    if stdout_fn is not None:
+      result_cache.restore(cached[-1], stdout_fn)
+    else:
+      sys.stdout.flush()
+      with open(cached[-1], 'rb') as fh:
+        shutil.copyfileobj(fh, sys.stdout.buffer)
+      sys.stdout.flush()
+    logging.info('restored %s from cache entry %s', command, key)
+    return 0
+
+  capture_fn = stdout_fn
+  if capture_fn is None:
+    capture_fn = os.path.join(cache.directory, 'stdout.{}.tmp'.format(os.getpid()))
+  try:
+    code = run(command, args, stdin_fn, capture_fn)
+    if stdout_fn is None:
+      with open(capture_fn, 'rb') as fh:
+        shutil.copyfileobj(fh, sys.stdout.buffer)
+      sys.stdout.flush()
+    if code == 0 and all([os.path.isfile(fn) for fn in outputs]):
+      cache.store(key, outputs + [capture_fn], ' '.join([command] + list(args)))
+  finally:
+    if stdout_fn is None and os.path.exists(capture_fn):
+      os.remove(capture_fn)
+  return code
+
+def parse_batch_line(line):
+  '''
+    command, args, stdin, stdout from a line of a batch file
+  '''
+  tokens = shlex.split(line, comments=True)
+  stdin_fn = stdout_fn = None
+  args = []
+  idx = 0
+  while idx < len(tokens):
+    if tokens[idx] in ('<', '>'):
+      if idx + 1 >= len(tokens):
+        raise ValueError('missing filename after {} in: {}'.format(tokens[idx], line.strip()))
+      if tokens[idx] == '<':
+        stdin_fn = tokens[idx + 1]
+      else:
+        stdout_fn = tokens[idx + 1]
+      idx += 2
+    else:
+      args.append(tokens[idx])
+      idx += 1
+  if len(args) == 0:
+    return None
+  return args[0], args[1:], stdin_fn, stdout_fn
+
+def batch(fh, keep_going, cache=None):
+  failed = total = 0
+  for line_num, line in enumerate(fh):
+    parsed = parse_batch_line(line)
+    if parsed is None:
+      continue
+    command, args, stdin_fn, stdout_fn = parsed
+    total += 1
+    start = time.time()
+    logging.info('line %i: running %s...', line_num + 1, line.strip())
+    if cache is None:
+      code = run(command, args, stdin_fn, stdout_fn)
+    else:
+      # commands in a batch only read stdin if it is redirected from a file
+      code = run_cached(cache, command, args, stdin_fn, stdout_fn, ignore_stdin=True)
+    logging.info('line %i: %s finished with exit code %i in %.1fs', line_num + 1, command, code, time.time() - start)
+    if code != 0:
+      failed += 1
+      if not keep_going:
+        break
+  logging.info('done. ran %i commands, %i failed', total, failed)
+  return 1 if failed > 0 else 0
+
+def main(argv):
+  if len(argv) > 0 and not argv[0].startswith('-'):
+    return run(argv[0], argv[1:])
+
+  parser = argparse.ArgumentParser(description='Run somatic pipeline scripts. Usage: somatic_pipeline.py [--cache dir] command [args...] or somatic_pipeline.py [--cache dir] --batch commands.txt', epilog='commands: {}'.format(', '.join(commands())))
+  parser.add_argument('--batch', required=False, help='file of commands to run, one per line (- for stdin)')
+  parser.add_argument('--keep_going', action='store_true', help='continue batch after a command fails')
+  parser.add_argument('--cache', required=False, help='directory of cached results to restore unchanged work from')
+  parser.add_argument('--ignore_stdin', action='store_true', help='with --cache, the command does not read stdin so it is not part of the cache key')
+  parser.add_argument('--list', action='store_true', help='list available commands')
+  parser.add_argument('--verbose', action='store_true', help='more logging')
+  parser.add_argument('command', nargs='?', help='command to run')
+  parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments for command')
+  args = parser.parse_args(argv)
+  # the command is run in this process so its own --verbose only takes effect if logging is configured here
+  if args.verbose or '--verbose' in args.args:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
+  else:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+  if args.list:
+    sys.stdout.write('{}\n'.format('\n'.join(commands())))
+    return 0
+
+  cache = None
+  if args.cache is not None:
+    cache = result_cache.ResultCache(args.cache)
+
+  if args.command is not None:
+    if cache is None:
+      return run(args.command, args.args)
+    return run_cached(cache, args.command, args.args, ignore_stdin=args.ignore_stdin)
+  if args.batch is None:
+    parser.print_help()
+    return 1
+  if args.batch == '-':
+    return batch(sys.stdin, args.keep_going, cache)
+  return batch(open(args.batch, 'r'), args.keep_going, cache)
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -6,6 +6,7 @@
 import argparse
 import collections
 import logging
+import multiprocessing
 import sys
 
 import numpy as np
@@ -16,6 +17,11 @@ ORDER=('HIGH_transcript_ablation', 'HIGH_splice_acceptor_variant', 'HIGH_splice_
 
 #IDS=['0'..'9'] + ['a'..'z'] + ['A'..'Z']
 
+# assumed vep format if the CSQ header does not describe it
+DEFAULT_VEP_FORMAT='Consequence|IMPACT|Codons|Amino_acids|Gene|SYMBOL|Feature|EXON|PolyPhen|SIFT|Protein_position|BIOTYPE|HGVSc|HGVSp|cDNA_position|CDS_position|HGVSc|HGVSp|cDNA_position|CDS_position|gnomAD_AF|gnomAD_AFR_AF|gnomAD_AMR_AF|gnomAD_ASJ_AF|gnomAD_EAS_AF|gnomAD_FIN_AF|gnomAD_NFE_AF|gnomAD_OTH_AF|gnomAD_SAS_AF|MaxEntScan_alt|MaxEntScan_diff|MaxEntScan_ref|PICK'
+
+VEP_COLUMNS=('Consequence', 'IMPACT', 'SYMBOL', 'PolyPhen', 'SIFT', 'HGVSc', 'HGVSp', 'PICK')
+
 def add_change(variant, change, gene, candidate, results, sample):
   result = results[sample]
   if gene not in result:
@@ -23,79 +29,161 @@ def add_change(variant, change, gene, candidate, results, sample):
   if candidate not in result[gene]:
     result[gene][candidate] = list()
   result[gene][candidate].append(change)
- 
-def main(vcfs, lohs, genes, loci, plot, multisample):
+
+def vep_columns(vcf_in):
+  '''
+    index of each column of interest, resolved once from the CSQ header, None if the header lacks it
+  '''
+  try:
+    description = vcf_in.get_header_type('CSQ')['Description']
+    vep_format = description.split('Format: ')[1].strip('"').strip()
+  except (KeyError, IndexError):
+    logging.info('CSQ format not found in header, using default')
+    vep_format = DEFAULT_VEP_FORMAT
+  fields = vep_format.split('|')
+  missing = [name for name in VEP_COLUMNS if name not in fields]
+  if len(missing) > 0:
+    logging.warn('CSQ format has no %s, these are treated as empty', ', '.join(missing))
+  return dict((name, fields.index(name) if name in fields else None) for name in VEP_COLUMNS), len(fields)
+
+def locus_index(genes, loci):
+  '''
+    parse loci once into sorted start, finish and gene arrays per chromosome, with the longest locus length
+  '''
+  parsed = collections.defaultdict(list)
+  for gene, locus in zip(genes, loci):
+    locus_chrom, rest = locus.split(':')
+    locus_start, locus_finish = [int(x) for x in rest.split('-')]
+    parsed[locus_chrom].append((locus_start, locus_finish, gene))
+
+  index = {}
+  for chrom in parsed:
+    intervals = sorted(parsed[chrom])
+    index[chrom] = (np.array([x[0] for x in intervals]), np.array([x[1] for x in intervals]), [x[2] for x in intervals], max(x[1] - x[0] for x in intervals))
+  return index
+
+def overlapping_genes(index, chrom, starts, finishes):
+  '''
+    gene for each overlap of a segment on chrom with a locus
+  '''
+  if chrom not in index or len(starts) == 0:
+    return []
+  locus_starts, locus_finishes, locus_genes, longest = index[chrom]
+  # candidate loci for each segment start before the segment finishes, and no locus starting before start - longest can reach the segment
+  los = np.searchsorted(locus_starts, np.array(starts) - longest, side='right')
+  his = np.searchsorted(locus_starts, np.array(finishes), side='left')
+  found = []
+  for start, lo, hi in zip(starts, los, his):
+    found.extend([locus_genes[lo + idx] for idx in np.nonzero(locus_finishes[lo:hi] > start)[0]])
+  return found
+
+def process_vcf(vcf, genes, multisample):
+  '''
+    candidate changes in genes of interest for a single vcf
+  '''
+  logging.info('processing %s...', vcf)
+  results = collections.defaultdict(dict)
+  variants = {}
+  if not multisample:
+    sample = vcf.split('/')[-1].split('.')[0]
+
+  vcf_in = cyvcf2.VCF(vcf)
+  columns, _ = vep_columns(vcf_in)
+  consequence_idx, impact_idx, symbol_idx, polyphen_idx, sift_idx, hgvsc_idx, hgvsp_idx, pick_idx = [columns[name] for name in VEP_COLUMNS]
+  for variant in vcf_in:
+    veps = variant.INFO.get('CSQ')
+    if veps is None:
+      continue
+    # find PICK=1
+    for vep in veps.split(','):
+      fields = vep.split('|')
+      value = lambda idx: fields[idx] if idx is not None and idx < len(fields) else ''
+      if value(pick_idx) != '1':
+        continue
+      gene = value(symbol_idx)
+      if gene not in genes:
+        continue
+
+      impact = value(impact_idx)
+      if impact not in ('MODERATE', 'HIGH'):
+        continue
+
+      consequence = value(consequence_idx).split('&')[0]
+      #candidate = '{}_{}'.format(impact, consequence)
+      candidate = consequence
+      polyphen = value(polyphen_idx)
+      sift = value(sift_idx)
+      #if candidate not in ORDER:
+      #  logging.warn('unexpected candidate: %s', candidate)
+      if impact == 'HIGH' or 'damaging' in polyphen or 'deleterious' in sift: # include
+        change = '{}:{} {}>{}'.format(variant.CHROM, variant.POS, variant.REF, variant.ALT[0])
+        if multisample:
+          gt_types = variant.gt_types
+          for sample, gt in zip(vcf_in.samples, gt_types):
+            if gt != 0: # real variant
+              add_change(variant, change, gene, candidate, results, sample)
+        else:
+          add_change(variant, change, gene, candidate, results, sample)
+
+        # keep track of found variants
+        if change not in variants:
+          variants[change] = '{}\t{}\t{}'.format(gene, value(hgvsc_idx), value(hgvsp_idx))
+
+  return dict(results), variants
+
+def _process_vcf(args):
+  return process_vcf(*args)
+
+def main(vcfs, lohs, genes, loci, plot, multisample, processes=1):
   logging.info('starting...')
 
   results = collections.defaultdict(dict)
 
   variants = {}
-  count = 0
-
-  for vcf in vcfs:
-    logging.info('processing %s...', vcf)
-    if not multisample:
-      sample = vcf.split('/')[-1].split('.')[0]
-    
-    vcf_in = cyvcf2.VCF(vcf)
-    for variant in vcf_in:
-      try:
-        # assume vep format is Consequence|IMPACT|Codons|Amino_acids|Gene|SYMBOL|Feature|EXON|PolyPhen|SIFT|Protein_position|BIOTYPE|HGVSc|HGVSp|cDNA_position|CDS_position|HGVSc|HGVSp|cDNA_position|CDS_position|gnomAD_AF|gnomAD_AFR_AF|gnomAD_AMR_AF|gnomAD_ASJ_AF|gnomAD_EAS_AF|gnomAD_FIN_AF|gnomAD_NFE_AF|gnomAD_OTH_AF|gnomAD_SAS_AF|MaxEntScan_alt|MaxEntScan_diff|MaxEntScan_ref|PICK
-        veps = variant.INFO['CSQ'].split(',')
-      except KeyError:
-        continue
-      # find PICK=1
-      for vep in veps:
-        fields = vep.split('|')
-        if fields[-1] != '1':
-          continue
-        gene = fields[5]
-        if gene not in genes:
-          continue
-
-        impact = fields[1]
-        if impact not in ('MODERATE', 'HIGH'):
-          continue
-
-        consequence = fields[0].split('&')[0]
-        #candidate = '{}_{}'.format(impact, consequence)
-        candidate = consequence
-        polyphen = fields[8]
-        sift = fields[9]
-        #if candidate not in ORDER:
-        #  logging.warn('unexpected candidate: %s', candidate)
-        if impact == 'HIGH' or 'damaging' in polyphen or 'deleterious' in sift: # include
-          change = '{}:{} {}>{}'.format(variant.CHROM, variant.POS, variant.REF, variant.ALT[0])
-          if multisample:
-            gt_types = variant.gt_types
-            for sample, gt in zip(vcf_in.samples, gt_types):
-              if gt != 0: # real variant
-                add_change(variant, change, gene, candidate, results, sample)
-          else:
-            add_change(variant, change, gene, candidate, results, sample)
-
-         # keep track of found variants
-          if change not in variants:
-            variants[change] = '{}\t{}\t{}'.format(gene, fields[12], fields[13])
+  gene_set = set(genes)
+
+  jobs = [(vcf, gene_set, multisample) for vcf in vcfs]
+  if processes > 1 and len(vcfs) > 1:
+    pool = multiprocessing.Pool(processes)
+    vcf_results = pool.imap(_process_vcf, jobs)
+  else:
+    pool = None
+    vcf_results = map(_process_vcf, jobs)
+
+  # merge in input order
+  for vcf_result, vcf_variants in vcf_results:
+    for sample in vcf_result:
+      for gene in vcf_result[sample]:
+        for candidate, changes in vcf_result[sample][gene].items():
+          results[sample].setdefault(gene, {}).setdefault(candidate, list()).extend(changes)
+    for change in vcf_variants:
+      if change not in variants:
+        variants[change] = vcf_variants[change]
+
+  if pool is not None:
+    pool.close()
+    pool.join()
 
   if lohs is not None:
+    index = locus_index(genes, loci)
     for loh in lohs:
       logging.info('processing %s...', loh)
       sample = loh.split('/')[-1].split('.')[0]
       result = results[sample] # dict
+      segments = collections.defaultdict(lambda: ([], []))
       for line in open(loh, 'r'):
         fields = line.strip('\n').split('\t')
         chrom, start, finish = fields[0], int(fields[1]), int(fields[2]) # loh bed
-        # find matching loci
-        for idx, locus in enumerate(loci): # check each gene
-          locus_chrom, rest = locus.split(':')
-          locus_start, locus_finish = [int(x) for x in rest.split('-')]
-          if locus_chrom == chrom and finish > locus_start and start < locus_finish:
-            if genes[idx] not in result:
-              result[genes[idx]] = {}
-            if 'LOH' not in result[genes[idx]]:
-              result[genes[idx]]['LOH'] = list()
-            results[sample][genes[idx]]['LOH'].append('1')
+        segments[chrom][0].append(start)
+        segments[chrom][1].append(finish)
+
+      for chrom in segments:
+        for gene in overlapping_genes(index, chrom, *segments[chrom]):
+          if gene not in result:
+            result[gene] = {}
+          if 'LOH' not in result[gene]:
+            result[gene]['LOH'] = list()
+          result[gene]['LOH'].append('1')
 
   # print results
   sys.stdout.write('Sample\t{}\n'.format('\t'.join(sorted(genes))))
@@ -127,6 +215,7 @@ if __name__ == '__main__':
   parser.add_argument('--loci', required=True, nargs='+', help='tumour vcf')
   parser.add_argument('--plot', required=False, help='tumour vcf')
   parser.add_argument('--multisample', action='store_true', help='sample names from vcf')
+  parser.add_argument('--processes', required=False, type=int, default=1, help='number of vcfs to process concurrently')
   parser.add_argument('--verbose', action='store_true', help='more logging')
   args = parser.parse_args()
   if args.verbose:
@@ -134,5 +223,5 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-  main(args.vcfs, args.lohs, args.genes, args.loci, args.plot, args.multisample)
+  main(args.vcfs, args.lohs, args.genes, args.loci, args.plot, args.multisample, args.processes)
 
@@ -1,43 +1,148 @@
 #!/usr/bin/env python
 '''
   write out details of a variant if found
+  - single mode: stream a vcf from stdin and look for one sample/chrom/pos
+  - batch mode: take an indexed vcf and a tsv of sample, chrom, pos and answer them all
 '''
 
 import argparse
+import collections
+import csv
 import logging
 import sys
 
 import cyvcf2
 
+# above this many expected sites, one pass over the vcf is cheaper than a tabix query per site
+SWEEP_THRESHOLD = 1000
+
+def found(variant, sample_id, nofilter):
+  '''
+    returns (ad, gt) if the variant passes and the sample carries it, else None
+  '''
+  if not nofilter and variant.FILTER is not None:
+    return None
+  # check gt 0,1,2,3==HOM_REF, HET, UNKNOWN, HOM_ALT
+  gt = variant.gt_types[sample_id]
+  if gt == 1 or gt == 3:
+    ad = variant.format('AD')[sample_id]
+    gt_str = ['0/0', '0/1', './.', '1/1'][gt]
+    return ', '.join([str(x) for x in ad]), gt_str
+  return None
+
+def sample_indexes(vcf_in, samples):
+  '''
+    sample -> index in the vcf, absent samples are None with a warning so their sites are reported as not found
+  '''
+  result = {}
+  for sample in samples:
+    if sample in vcf_in.samples:
+      result[sample] = vcf_in.samples.index(sample)
+    elif sample not in result:
+      logging.warn('sample %s is not in the vcf. samples are: %s', sample, ', '.join(vcf_in.samples))
+      result[sample] = None
+  return result
+
+def write_result(out, sample, chrom, pos, result):
+  if result is None:
+    out.write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(sample, chrom, pos, 'NA', 'NA', '0'))
+  else:
+    out.write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(sample, chrom, pos, result[0], result[1], '1'))
+
 def main(sample, chrom, pos, nofilter):
   logging.info('reading from stdin...')
 
-  vcf_in = cyvcf2.VCF('-')  
-  sample_id = vcf_in.samples.index(sample)
+  vcf_in = cyvcf2.VCF('-')
+  sample_id = sample_indexes(vcf_in, [sample])[sample]
+  if sample_id is None:
+    write_result(sys.stdout, sample, chrom, pos, None)
+    logging.info('done')
+    return
 
   for variant in vcf_in:
-    if not nofilter and variant.FILTER is not None:
-      continue
-
     if variant.POS == pos and variant.CHROM == chrom:
-      # check gt 0,1,2,3==HOM_REF, HET, UNKNOWN, HOM_ALT
-      gt = variant.gt_types[sample_id]
-      if gt == 1 or gt == 3:
-        ad = variant.format('AD')[sample_id]
-        gt_str = ['0/0', '0/1', './.', '1/1'][gt]
-        sys.stdout.write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(sample, chrom, pos, ', '.join([str(x) for x in ad]), gt_str, '1'))
+      result = found(variant, sample_id, nofilter)
+      if result is not None:
+        write_result(sys.stdout, sample, chrom, pos, result)
         logging.info('done')
         sys.exit(0)
 
   # not found
-  sys.stdout.write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(sample, chrom, pos, 'NA', 'NA', '0'))
+  write_result(sys.stdout, sample, chrom, pos, None)
   logging.info('done')
 
+def read_expected(fh):
+  '''
+    sample, chrom, pos per line, optional header
+  '''
+  expected = []
+  for row in csv.reader(fh, delimiter='\t'):
+    if len(row) < 3 or row[0].startswith('#') or not row[2].isdigit():
+      continue
+    expected.append((row[0], row[1], int(row[2])))
+  return expected
+
+def query(vcf_in, expected, nofilter):
+  '''
+    tabix lookup for each expected site
+  '''
+  sample_ids = sample_indexes(vcf_in, [x[0] for x in expected])
+  results = {}
+  for sample, chrom, pos in expected:
+    sample_id = sample_ids[sample]
+    result = None
+    if sample_id is None:
+      results[(sample, chrom, pos)] = result
+      continue
+    for variant in vcf_in('{}:{}-{}'.format(chrom, pos, pos)):
+      if variant.POS == pos:
+        result = found(variant, sample_id, nofilter)
+        if result is not None:
+          break
+    results[(sample, chrom, pos)] = result
+  return results
+
+def sweep(vcf_in, expected, nofilter):
+  '''
+    one pass over the vcf for all expected sites
+  '''
+  sample_ids = sample_indexes(vcf_in, [x[0] for x in expected])
+  sites = collections.defaultdict(list)
+  for sample, chrom, pos in expected:
+    if sample_ids[sample] is not None:
+      sites[(chrom, pos)].append((sample, sample_ids[sample]))
+
+  results = {}
+  for variant in vcf_in:
+    key = (variant.CHROM, variant.POS)
+    if key not in sites:
+      continue
+    for sample, sample_id in sites[key]:
+      if results.get((sample, variant.CHROM, variant.POS)) is None:
+        results[(sample, variant.CHROM, variant.POS)] = found(variant, sample_id, nofilter)
+  return results
+
+def main_batch(vcf_fn, expected_fh, nofilter):
+  expected = read_expected(expected_fh)
+  logging.info('checking %i sites in %s...', len(expected), vcf_fn)
+
+  vcf_in = cyvcf2.VCF(vcf_fn)
+  if len(expected) > SWEEP_THRESHOLD:
+    results = sweep(vcf_in, expected, nofilter)
+  else:
+    results = query(vcf_in, expected, nofilter)
+
+  for sample, chrom, pos in expected:
+    write_result(sys.stdout, sample, chrom, pos, results.get((sample, chrom, pos)))
+  logging.info('done. %i of %i sites found', len([x for x in results.values() if x is not None]), len(expected))
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Max coverage')
-  parser.add_argument('--sample', required=True, help='sample name')
-  parser.add_argument('--chrom', required=True, help='location of variant')
-  parser.add_argument('--pos', required=True, type=int, help='location of variant')
+  parser.add_argument('--sample', required=False, help='sample name')
+  parser.add_argument('--chrom', required=False, help='location of variant')
+  parser.add_argument('--pos', required=False, type=int, help='location of variant')
+  parser.add_argument('--vcf', required=False, help='bgzipped and indexed vcf for batch mode')
+  parser.add_argument('--expected', required=False, help='tsv of sample, chrom, pos for batch mode')
   parser.add_argument('--verbose', action='store_true', help='more logging')
   parser.add_argument('--nofilter', action='store_true', help='allow non-pass')
   args = parser.parse_args()
@@ -46,4 +151,11 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-  main(args.sample, args.chrom, args.pos, args.nofilter)
+  if args.expected is not None:
+    if args.vcf is None:
+      parser.error('--expected requires --vcf')
+    main_batch(args.vcf, open(args.expected, 'r'), args.nofilter)
+  else:
+    if args.sample is None or args.chrom is None or args.pos is None:
+      parser.error('--sample, --chrom and --pos are required without --expected')
+    main(args.sample, args.chrom, args.pos, args.nofilter)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+'''
+  indexed store of the variant tsvs written by vcf2tsv/extract_vep, so reports can ask small questions without scanning them
+  - sqlite, indexed by sample, gene, position and clinvar class, with each row kept as its original tsv line
+  - loading is incremental: a file is only (re)loaded if it is new or its size or mtime has changed
+  - usage:
+    variant_store.py --store out/aggregate/variants.db --load out/aggregate/*.tsv.gz
+    variant_store.py --store out/aggregate/variants.db --query --genes MLH1 --clinvar Pathogenic Likely_pathogenic > mlh1.tsv
+'''
+
+import argparse
+import csv
+import datetime
+import gzip
+import logging
+import os
+import sqlite3
+import sys
+
+import progress
+
+# store column: tsv columns to take it from, first present wins
+INDEXED = (
+  ('sample', ('VCF_SAMPLE_ID',)),
+  ('chrom', ('CHROM',)),
+  ('pos', ('POS',)),
+  ('gene', ('vep_SYMBOL',)),
+  ('clinvar', ('clinvar_pathogenic', 'CLNSIG')),
+  ('gt', ('GT',))
+)
+
+# the same as the scan in make_report.variants_of_interest
+NO_CALL = ('0/0', './.')
+BATCH = 10000
+# stored as the sqlite user_version, files loaded by another version are reloaded
+VERSION = 2
+
+SCHEMA = '''
+create table if not exists files (id integer primary key, path text unique, size integer, mtime_ns integer, header text, rows integer, loaded text);
+create table if not exists variants (file_id integer, line integer, sample text, chrom text, pos integer, gene text, clinvar text, genotyped integer, row text);
+create index if not exists variants_file on variants (file_id, clinvar);
+create index if not exists variants_sample on variants (sample, gene);
+create index if not exists variants_gene on variants (gene);
+create index if not exists variants_position on variants (chrom, pos);
+create index if not exists variants_clinvar on variants (clinvar);
+'''
+
+def split_line(line):
+  if '"' in line:
+    return next(csv.reader([line.rstrip('\r\n')], delimiter='\t'))
+  return line.rstrip('\r\n').split('\t')
+
+def open_tsv(fn):
+  if fn.endswith('.gz'):
+    return gzip.open(fn, 'rt')
+  return open(fn, 'r')
+
+def parse_region(region):
+  '''
+    chrom, chrom:pos or chrom:start-end as (chrom, start, end)
+  '''
+  if ':' not in region:
+    return region, None, None
+  chrom, rest = region.rsplit(':', 1)
+  if '-' in rest:
+    start, end = rest.split('-')
+    return chrom, int(start.replace(',', '')), int(end.replace(',', ''))
+  return chrom, int(rest.replace(',', '')), int(rest.replace(',', ''))
+
+class VariantStore(object):
+  '''
+    query api over a store file
+  '''
+  def __init__(self, fn, readonly=False):
+    self.fn = fn
+    if readonly:
+      self.db = sqlite3.connect('file:{}?mode=ro'.format(fn), uri=True)
+    else:
+      self.db = sqlite3.connect(fn, timeout=600)
+      self.db.executescript(SCHEMA)
+      if self.db.execute('pragma user_version').fetchone()[0] != VERSION:
+        with self.db:
+          self.db.execute('delete from variants')
+          self.db.execute('delete from files')
+        self.db.execute('pragma user_version = {}'.format(VERSION))
+    self.version = self.db.execute('pragma user_version').fetchone()[0]
+    self.headers = {} # file id -> header
+
+  def close(self):
+    self.db.close()
+
+  def file_id(self, fn):
+    '''
+      id of fn if it is loaded and unchanged since, otherwise None
+    '''
+    if self.version != VERSION:
+      return None
+    path = os.path.abspath(fn)
+    row = self.db.execute('select id, size, mtime_ns from files where path = ?', (path,)).fetchone()
+    if row is None or not os.path.isfile(path):
+      return None
+    stat = os.stat(path)
+    if (row[1], row[2]) != (stat.st_size, stat.st_mtime_ns):
+      return None
+    return row[0]
+
+  def current(self, fn):
+    return self.file_id(fn) is not None
+
+  def header(self, file_id):
+    if file_id not in self.headers:
+      self.headers[file_id] = self.db.execute('select header from files where id = ?', (file_id,)).fetchone()[0].split('\t')
+    return self.headers[file_id]
+
+  def load(self, fn, force=False):
+    '''
+      add or replace the rows of fn, returns the number of rows loaded
+    '''
+    if not force and self.current(fn):
+      logging.info('%s is unchanged', fn)
+      return 0
+    path = os.path.abspath(fn)
+    stat = os.stat(path)
+    logging.info('loading %s...', fn)
+    with self.db:
+      existing = self.db.execute('select id from files where path = ?', (path,)).fetchone()
+      if existing is not None:
+        self.db.execute('delete from variants where file_id = ?', (existing[0],))
+        self.db.execute('delete from files where id = ?', (existing[0],))
+        self.headers.pop(existing[0], None)
+
+      fh = open_tsv(fn)
+      first = fh.readline()
+      if first == '':
+        logging.warn('%s is empty', fn)
+        fh.close()
+        return 0
+      header = split_line(first)
+      file_id = self.db.execute('insert into files (path, size, mtime_ns, header, rows, loaded) values (?, ?, ?, ?, 0, ?)', (path, stat.st_size, stat.st_mtime_ns, '\t'.join(header), datetime.datetime.now().isoformat(timespec='seconds'))).lastrowid
+      columns = []
+      for name, candidates in INDEXED:
+        present = [header.index(x) for x in candidates if x in header]
+        columns.append(present[0] if len(present) > 0 else None)
+      sample_idx, chrom_idx, pos_idx, gene_idx, clinvar_idx, gt_idx = columns
+
+      counter = progress.Progress('load {}'.format(os.path.basename(fn)), unit='rows')
+      batch = []
+      count = 0
+      for count, line in enumerate(fh, 1):
+        counter.update()
+        row = split_line(line)
+        value = lambda idx: row[idx] if idx is not None and idx < len(row) else None
+        pos = value(pos_idx)
+        gt = value(gt_idx)
+        batch.append((file_id, count, value(sample_idx), value(chrom_idx), int(pos) if pos is not None and pos.isdigit() else None, value(gene_idx), value(clinvar_idx), 1 if gt is not None and gt not in NO_CALL else 0, line.rstrip('\r\n')))
+        if len(batch) == BATCH:
+          self.db.executemany('insert into variants values (?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+          batch = []
+      counter.finish()
+      fh.close()
+      if len(batch) > 0:
+        self.db.executemany('insert into variants values (?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+      self.db.execute('update files set rows = ? where id = ?', (count, file_id))
+    logging.info('loaded %i rows from %s', count, fn)
+    return count
+
+  def query(self, sources=None, samples=None, genes=None, regions=None, clinvar=None, genotyped=False):
+    '''
+      (file id, tsv line) of matching rows in the order they were loaded
+      sources are filenames that must be loaded and unchanged, regions are (chrom, start, end) with start and end optional
+    '''
+    conditions = []
+    values = []
+    if sources is not None:
+      file_ids = []
+      for fn in sources:
+        file_id = self.file_id(fn)
+        if file_id is None:
+          raise ValueError('{} is not loaded in {} or has changed since it was'.format(fn, self.fn))
+        file_ids.append(file_id)
+      conditions.append('file_id in ({})'.format(','.join(['?'] * len(file_ids))))
+      values.extend(file_ids)
+    for column, wanted in (('sample', samples), ('gene', genes), ('clinvar', clinvar)):
+      if wanted is not None:
+        wanted = list(wanted)
+        conditions.append('{} in ({})'.format(column, ','.join(['?'] * len(wanted))))
+        values.extend(wanted)
+    if regions is not None:
+      alternatives = []
+      for chrom, start, end in regions:
+        alternative = ['chrom = ?']
+        values.append(chrom)
+        if start is not None:
+          alternative.append('pos >= ?')
+          values.append(start)
+        if end is not None:
+          alternative.append('pos <= ?')
+          values.append(end)
+        alternatives.append('({})'.format(' and '.join(alternative)))
+      conditions.append('({})'.format(' or '.join(alternatives)))
+    if genotyped:
+      conditions.append('genotyped = 1')
+    sql = 'select file_id, row from variants{} order by file_id, line'.format(' where {}'.format(' and '.join(conditions)) if len(conditions) > 0 else '')
+    logging.debug('query: %s %s', sql, values)
+    for file_id, line in self.db.execute(sql, values):
+      yield file_id, line
+
+  def rows(self, **kwargs):
+    '''
+      matching rows as dicts of their tsv columns, takes the arguments of query
+    '''
+    for file_id, line in self.query(**kwargs):
+      header = self.header(file_id)
+      row = split_line(line)
+      yield dict((name, row[idx] if idx < len(row) else None) for idx, name in enumerate(header))
+
+  def write_tsv(self, out, **kwargs):
+    '''
+      matching rows as a tsv, lines are written as loaded if every matching file has the same header
+    '''
+    file_ids = [x[0] for x in self.db.execute('select id from files order by id')]
+    if kwargs.get('sources') is not None:
+      file_ids = [self.file_id(fn) for fn in kwargs['sources']]
+    headers = [self.header(file_id) for file_id in file_ids if file_id is not None]
+    if len(headers) == 0:
+      return 0
+    count = 0
+    if all([header == headers[0] for header in headers]):
+      out.write('{}\n'.format('\t'.join(headers[0])))
+      for _, line in self.query(**kwargs):
+        out.write('{}\n'.format(line))
+        count += 1
+    else:
+      columns = []
+      for header in headers:
+        columns.extend([name for name in header if name not in columns])
+      writer = csv.DictWriter(out, delimiter='\t', fieldnames=columns, restval='', lineterminator='\n')
+      writer.writeheader()
+      for row in self.rows(**kwargs):
+        writer.writerow(row)
+        count += 1
+    return count
+
+def main(store_fn, load, force, query, sources, samples, genes, regions, clinvar, genotyped):
+  logging.info('starting...')
+  store = VariantStore(store_fn, readonly=load is None)
+  for fn in load or []:
+    store.load(fn, force)
+  if query:
+    count = store.write_tsv(sys.stdout, sources=sources, samples=samples, genes=genes, regions=None if regions is None else [parse_region(region) for region in regions], clinvar=clinvar, genotyped=genotyped)
+    logging.info('wrote %i rows', count)
+  store.close()
+  logging.info('done')
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Indexed store of variant tsvs')
+  parser.add_argument('--store', required=True, help='sqlite file')
+  parser.add_argument('--load', required=False, nargs='+', help='tsvs to add or update')
+  parser.add_argument('--force', action='store_true', help='reload files even if unchanged')
+  parser.add_argument('--query', action='store_true', help='write matching rows to stdout')
+  parser.add_argument('--sources', required=False, nargs='+', help='only rows from these loaded tsvs')
+  parser.add_argument('--samples', required=False, nargs='+', help='only these VCF_SAMPLE_IDs')
+  parser.add_argument('--genes', required=False, nargs='+', help='only these genes (vep_SYMBOL)')
+  parser.add_argument('--regions', required=False, nargs='+', help='only these regions chrom[:start[-end]]')
+  parser.add_argument('--clinvar', required=False, nargs='+', help='only these clinvar classes (clinvar_pathogenic or CLNSIG)')
+  parser.add_argument('--genotyped', action='store_true', help='skip 0/0 and ./. genotypes')
+  parser.add_argument('--verbose', action='store_true', help='more logging')
+  args = parser.parse_args()
+  if args.verbose:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
+  else:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+  progress.run(main, args.store, args.load, args.force, args.query, args.sources, args.samples, args.genes, args.regions, args.clinvar, args.genotyped)
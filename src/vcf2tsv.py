@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 
 import argparse
+import logging
 import numpy as np
 import re
 import sys
 
 from cyvcf2 import VCF, Writer
 
+import progress
+
 def __main__():
    parser = argparse.ArgumentParser(description='Convert a VCF file with genomic variants to a file with tab-separated values (TSV). One entry (TSV line) per sample genotype', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
    parser.add_argument('query_vcf', help='Bgzipped input VCF file with query variants (SNVs/InDels)')
@@ -14,15 +17,24 @@ def __main__():
    parser.add_argument("--skip_genotype_data", action="store_true", help="Skip printing of genotype_data (FORMAT columns)")
    parser.add_argument("--keep_rejected_calls", action="store_true", help="Print data for rejected calls")
    parser.add_argument("--print_data_type_header", action="store_true", help="Print a header line with data types of VCF annotations")
+   parser.add_argument("--columns", nargs="+", help="Only print these INFO and FORMAT fields (fixed columns, VCF_SAMPLE_ID and GT are always printed)")
+   parser.add_argument("--samples", nargs="+", help="Only read and print genotype data for these samples")
+   parser.add_argument("--non_ref_only", action="store_true", help="Only print sample genotypes that carry an alternative allele (skip 0/0 and ./.)")
    args = parser.parse_args()
+   logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
    
-   vcf2tsv(args.query_vcf, args.skip_info_data, args.skip_genotype_data, args.keep_rejected_calls, args.print_data_type_header)
+   progress.run(vcf2tsv, args.query_vcf, args.skip_info_data, args.skip_genotype_data, args.keep_rejected_calls, args.print_data_type_header, args.columns, args.samples, args.non_ref_only)
          
 
-def vcf2tsv(query_vcf, skip_info_data, skip_genotype_data, keep_rejected_calls, print_data_type_header):
+def vcf2tsv(query_vcf, skip_info_data, skip_genotype_data, keep_rejected_calls, print_data_type_header, columns=None, samples=None, non_ref_only=False):
    
-   vcf = VCF(query_vcf, gts012 = True)
+   # htslib only unpacks the requested samples
+   vcf = VCF(query_vcf, gts012 = True, samples = samples)
    out = sys.stdout
+   if samples is not None:
+      missing = [s for s in samples if s not in vcf.samples]
+      if len(missing) > 0:
+         logging.warn("samples not found in %s: %s", query_vcf, ", ".join(missing))
    
    fixed_columns_header = ['CHROM','POS','ID','REF','ALT','QUAL','FILTER']
    fixed_columns_header_type = ['String','Integer','String','String','String','Float','String']
@@ -51,6 +63,14 @@ def vcf2tsv(query_vcf, skip_info_data, skip_genotype_data, keep_rejected_calls,
                else:
                   gt_present_header = 1
 
+   # unrequested fields are never read from the records
+   if columns is not None:
+      missing = [c for c in columns if c != 'GT' and c not in column_types]
+      if len(missing) > 0:
+         logging.warn("columns not found in %s: %s", query_vcf, ", ".join(missing))
+      info_columns_header = [c for c in info_columns_header if c in columns]
+      format_columns_header = [c for c in format_columns_header if c in columns]
+
    header_line = '\t'.join(fixed_columns_header)
    if skip_info_data is False:
       header_line = '\t'.join(fixed_columns_header) + '\t' + '\t'.join(sorted(info_columns_header))
@@ -78,7 +98,9 @@ def vcf2tsv(query_vcf, skip_info_data, skip_genotype_data, keep_rejected_calls,
    else:
       out.write(str(header_line) + '\n')
    
+   counter = progress.Progress('reading {}'.format(query_vcf), unit='variants')
    for rec in vcf:
+      counter.update()
       rec_id = '.'
       rec_qual = '.'
       rec_filter = '.'
@@ -97,6 +119,17 @@ def vcf2tsv(query_vcf, skip_info_data, skip_genotype_data, keep_rejected_calls,
       
       if not 'PASS' in rec_filter and not keep_rejected_calls:
          continue
+
+      sample_indices = range(len(samples))
+      if len(samples) > 0 and skip_genotype_data is False:
+         gt_cyvcf = rec.gt_types
+         if non_ref_only:
+            ## carriers (0/1 or 1/1) only, records and samples without them are never formatted
+            if gt_present_header == 0:
+               continue
+            sample_indices = np.flatnonzero((gt_cyvcf == 1) | (gt_cyvcf == 2)).tolist()
+            if len(sample_indices) == 0:
+               continue
       
       variant_info = rec.INFO
       vcf_info_data = []
@@ -145,9 +178,7 @@ def vcf2tsv(query_vcf, skip_info_data, skip_genotype_data, keep_rejected_calls,
       #dictionary, with sample names as keys, values being genotype data (dictionary with format tags as keys)
       vcf_sample_genotype_data = {}
       if len(samples) > 0 and skip_genotype_data is False:
-         gt_cyvcf = rec.gt_types
-         i = 0
-         while i < len(samples):
+         for i in sample_indices:
             vcf_sample_genotype_data[samples[i]] = {}
             gt = './.'
             if gt_present_header == 1:
@@ -158,22 +189,16 @@ def vcf2tsv(query_vcf, skip_info_data, skip_genotype_data, keep_rejected_calls,
                if gt_cyvcf[i] == 2:
                   gt = '1/1'
             vcf_sample_genotype_data[samples[i]]['GT'] = gt
-            i = i + 1
                
       for format_tag in sorted(format_columns_header):
          if len(samples) > 0 and skip_genotype_data is False:
             sample_dat = rec.format(format_tag)
             if sample_dat is None:
-               k = 0
-               while k < len(samples):
-                  if samples[k] in vcf_sample_genotype_data:
-                     vcf_sample_genotype_data[samples[k]][format_tag] = '.'
-                  k = k + 1               
+               for k in sample_indices:
+                  vcf_sample_genotype_data[samples[k]][format_tag] = '.'
                continue
-            dim = sample_dat.shape
-            j = 0
             ## sample-wise
-            while j < dim[0]:
+            for j in sample_indices:
                if sample_dat[j].size > 1:
                   d = ','.join(str(e) for e in np.ndarray.tolist(sample_dat[j]))
                   if samples[j] in vcf_sample_genotype_data:
@@ -186,7 +211,6 @@ def vcf2tsv(query_vcf, skip_info_data, skip_genotype_data, keep_rejected_calls,
                      d = str(sample_dat[j][0])
                   if samples[j] in vcf_sample_genotype_data:
                      vcf_sample_genotype_data[samples[j]][format_tag] = d
-               j = j + 1
       
       #print(str(vcf_sample_genotype_data))
       tsv_elements = []
@@ -250,6 +274,7 @@ def vcf2tsv(query_vcf, skip_info_data, skip_genotype_data, keep_rejected_calls,
             line_elements.extend(tsv_elements)
             line_elements = tsv_elements
             out.write('\t'.join(line_elements) + '\n')
+   counter.finish()
    
 if __name__=="__main__": __main__()
 
@@ -5,11 +5,11 @@
 
 import argparse
 import logging
-import sys
 
 import numpy
 
-import cyvcf2
+import progress
+import vcf_io
 
 def is_pass(variant, allowed_filters):
   if variant.FILTER is None:
@@ -22,18 +22,18 @@ def is_pass(variant, allowed_filters):
         return False
     return True
 
-def main(vcfs, rejected, pass_only, pass_one, allowed_filters):
+def main(vcfs, rejected, pass_only, pass_one, allowed_filters, output='-', threads=1):
   '''
   '''
-  vcf_in = cyvcf2.VCF(vcfs[0])  
+  vcf_in = vcf_io.reader(vcfs[0], threads)
   variant_base_count = 0
   variant_base_pass = 0
   base = {}
   already_passed = {}
   logging.info('reading %s...', vcfs[0])
+  counter = progress.Progress('reading {}'.format(vcfs[0]), unit='variants')
   for variant_base_count, variant in enumerate(vcf_in):
-    if (variant_base_count + 1 ) % 100000 == 0:
-      logging.info('reading %s: %i variants processed...', vcfs[0], variant_base_count + 1)
+    counter.update()
     if pass_only and not is_pass(variant, allowed_filters):
       continue
     # variant is a pass or pass_only is false
@@ -48,24 +48,24 @@ def main(vcfs, rejected, pass_only, pass_one, allowed_filters):
       base[variant.CHROM].add(variant.POS) # wait and see the others
     else:
       base[variant.CHROM].add(variant.POS) # wait and see the others
+  counter.finish()
 
   logging.info('done reading %s: %i variants processed, %i already passed...', vcfs[0], variant_base_count + 1, sum([len(already_passed[c]) for c in already_passed]))
 
   logging.info('reading %s...', vcfs[1])
-  vcf_cand = cyvcf2.VCF(vcfs[1])  
+  vcf_cand = vcf_io.reader(vcfs[1], threads)
   variant_cand_count = 0
   variant_cand_pass = 0
   included = 0
   reject = 0
-  sys.stdout.write(vcf_cand.raw_header)
+  vcf_out = vcf_io.writer(output, vcf_cand, threads)
 
   if rejected is not None:
-    rejected_fh = open(rejected, 'w')
-    rejected_fh.write(vcf_cand.raw_header)
+    rejected_fh = vcf_io.writer(rejected, vcf_cand, threads)
 
+  counter = progress.Progress('reading {}'.format(vcfs[1]), unit='variants', details=lambda: 'wrote {}'.format(included))
   for variant_cand_count, variant in enumerate(vcf_cand):
-    if (variant_cand_count + 1 ) % 100000 == 0:
-      logging.info('reading %s: processed %i variants. wrote %i...', vcfs[1], variant_cand_count + 1, included)
+    counter.update()
     if pass_only and not is_pass(variant, allowed_filters): # pass is required
       continue
     # it's a pass or pass_only is false
@@ -74,25 +74,30 @@ def main(vcfs, rejected, pass_only, pass_one, allowed_filters):
       if pass_one:
         if is_pass(variant, allowed_filters): # 2nd is a pass
           logging.debug('pass in second: %s:%s', variant.CHROM, variant.POS)
-          sys.stdout.write(str(variant))
+          vcf_out.write_record(variant)
           included += 1
         elif variant.CHROM in already_passed and variant.POS in already_passed[variant.CHROM]: # wasn't a pass but seen in first
           logging.debug('pass in first: %s:%s', variant.CHROM, variant.POS)
-          sys.stdout.write(str(variant))
+          vcf_out.write_record(variant)
           included += 1
         else:
           logging.debug('no pass in second, no pass in first: %s:%s', variant.CHROM, variant.POS)
           reject += 1
           if rejected is not None:
-            rejected_fh.write(str(variant))
+            rejected_fh.write_record(variant)
       else: # print regardless
-        sys.stdout.write(str(variant))
+        vcf_out.write_record(variant)
         included += 1
     else:
       logging.debug('variant %s:%s not seen in first', variant.CHROM, variant.POS)
       reject += 1
       if rejected is not None:
-        rejected_fh.write(str(variant))
+        rejected_fh.write_record(variant)
+  counter.finish()
+
+  vcf_out.close()
+  if rejected is not None:
+    rejected_fh.close()
 
   logging.info('done. %s: %i passed variants. %s: %i passed variants. wrote %i variants. rejected %i variants', vcfs[1], variant_cand_pass + 1, vcfs[0], variant_base_pass + 1, included, reject)
 
@@ -104,10 +109,11 @@ if __name__ == '__main__':
   parser.add_argument('--pass_one', action='store_true', help='just one pass is required')
   parser.add_argument('--allowed_filters', required=False, nargs='*', help='input vcf files')
   parser.add_argument('--rejected', required=False, help='file to write rejected to')
+  vcf_io.add_arguments(parser)
   args = parser.parse_args()
   if args.verbose:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
-  main(args.inputs, args.rejected, args.pass_only, args.pass_one, args.allowed_filters)
+  progress.run(main, args.inputs, args.rejected, args.pass_only, args.pass_one, args.allowed_filters, args.output, args.threads)
 
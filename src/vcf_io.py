@@ -0,0 +1,35 @@
+'''
+  shared vcf input and output for the src/ scripts
+  - inputs are a filename or '-' for stdin, decompressed with htslib threads
+  - outputs are written by cyvcf2.Writer, bgzipped if the filename ends with .gz, compressed with htslib threads
+  - cyvcf2 does not expose the htslib write buffer size: bgzipped output is written in whole 64kb bgzf blocks, plain output uses the htslib default buffer
+'''
+
+import cyvcf2
+
+def add_arguments(parser, output=True):
+  '''
+    --threads and optionally --output for a script's argument parser
+  '''
+  if output:
+    parser.add_argument('--output', required=False, default='-', help='output vcf, bgzipped if it ends with .gz (default stdout)')
+  parser.add_argument('--threads', required=False, type=int, default=1, help='htslib compression and decompression threads')
+
+def reader(fn='-', threads=1, **kwargs):
+  '''
+    vcf from a file or stdin
+  '''
+  return cyvcf2.VCF(fn, threads=threads, **kwargs)
+
+def writer(fn, template, threads=1):
+  '''
+    write records with the header of template, which should be complete before calling this
+  '''
+  if fn.endswith('.gz'):
+    mode = 'wz'
+  else:
+    mode = 'w'
+  vcf_out = cyvcf2.Writer(fn, template, mode=mode)
+  if threads > 1:
+    vcf_out.set_threads(threads)
+  return vcf_out
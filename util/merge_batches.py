@@ -5,6 +5,9 @@
 
 import argparse
 import collections
+import concurrent.futures
+import hashlib
+import json
 import logging
 import os
 import re
@@ -25,6 +28,9 @@ TMB_CLEANED=False
 
 KEEP_SIGS=False
 
+# bump when a parser changes what it returns, to drop existing caches
+CACHE_VERSION=1
+
 GENES_OF_INTEREST = set([
   'MUTYH',
   'NRAS',
@@ -63,7 +69,7 @@ GENES_OF_INTEREST = set([
   'SMAD4',
   'POLD1'])
 
-def add_signature(fn, samples, header, source, prefix):
+def parse_signature(fn, source, prefix):
   for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
     sample = row['Filename']
     del row['Filename'] # include everything but
@@ -90,244 +96,314 @@ def add_signature(fn, samples, header, source, prefix):
       row['{}{}'.format(prefix, key)] = row[key]
       del row[key]
 
-    logging.debug('add_signature: adding %s to %s', source, sample)
-    samples['{}/{}'.format(sample, source)].update(row) # add results
-    samples['{}/{}'.format(sample, source)]['source'] = source
-    header.update(row.keys())
-    logging.debug('add_signature: header is now %s', header)
-
-def display_value(samples, key, name):
-  if name == 'LOH':
-    return ' '.join(sorted(list(samples[key].get(name, set()))))
-  else:
-    return samples[key].get(name, 'NA') 
-
-def main(directories, phenotype, require):
-  logging.info('starting...')
-
-  samples = collections.defaultdict(dict)
-  header = set()
-
-  for directory in directories:
-    logging.info('parsing %s...', directory)
-    source = os.path.basename(directory)
-
-    # mutational_signatures_v2.filter.combined.tsv
-    # mutational_signatures_v3_dbs.combined.tsv
-    # mutational_signatures_v3_sbs.filter.combined.tsv
-    # mutational_signatures_v3_id_strelka.filter.combined.tsv
-
-    # targetted gene summary
-    #fn = os.path.join(directory, 'out', 'aggregate', 'targetted_gene_summary.tsv')
-    #if not os.path.isfile(fn):
-    #  logging.info('skipping %s', directory)
-    #else: 
-    #  for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
-
-
-    # signatures - v2
-    if V2_SBS:
-      fn = os.path.join(directory, 'out', 'aggregate', 'mutational_signatures_v2.filter.combined.tsv')
-      if not os.path.isfile(fn):
-        logging.info('skipping %s: no v2 sbs', directory)
-        continue
-      add_signature(fn, samples, header, source, 'v2')
-
-    # v3 sbs signatures
-    if V3_SBS:
-      fn = os.path.join(directory, 'out', 'aggregate', 'mutational_signatures_v3_sbs_capture.filter.combined.tsv')
-      if not os.path.isfile(fn):
-        logging.info('skipping %s: no v3 sbs', directory)
-        continue
-      add_signature(fn, samples, header, source, 'SBS.')
-
-    # v3 id signatures
-    if V3_ID:
-      fn = os.path.join(directory, 'out', 'aggregate', 'mutational_signatures_v3_id_strelka.filter.combined.tsv')
-      #fn = os.path.join(directory, 'out', 'aggregate', 'mutational_signatures_v3_id_capture.filter.combined.tsv')
-      if not os.path.isfile(fn):
-        logging.info('skipping %s: no v3 id', directory)
-        continue
-      add_signature(fn, samples, header, source, 'ID.')
-
-    if V3_DBS:
-      fn = os.path.join(directory, 'out', 'aggregate', 'mutational_signatures_v3_dbs.filter.combined.tsv')
-      #fn = os.path.join(directory, 'out', 'aggregate', 'mutational_signatures_v3_id_capture.filter.combined.tsv')
-      if not os.path.isfile(fn):
-        logging.info('skipping %s: no v3 id', directory)
-        continue
-      add_signature(fn, samples, header, source, 'DB.')
+    logging.debug('parse_signature: adding %s to %s', source, sample)
+    row['source'] = source
+    yield (sample, row)
 
-    # v3 sbs signatures
-    if V31_SBS:
-      fn = os.path.join(directory, 'out', 'aggregate', 'mutational_signatures_v3.1_sbs.combined.tsv')
-      if not os.path.isfile(fn):
-        logging.info('skipping %s: no v3.1 sbs', directory)
-        continue
-      add_signature(fn, samples, header, source, 'SBS.')
-
-    # v3 id signatures
-    if V31_ID:
-      #fn = os.path.join(directory, 'out', 'aggregate', 'mutational_signatures_v3_id_strelka.filter.combined.tsv')
-      #fn = os.path.join(directory, 'out', 'aggregate', 'mutational_signatures_v3.1_id.combined.tsv')
-      fn = os.path.join(directory, 'out', 'aggregate', 'mutational_signatures_v3.1_id.combined.tsv')
-      if not os.path.isfile(fn):
-        logging.info('skipping %s no v3.1 id', directory)
-        continue
-      add_signature(fn, samples, header, source, 'ID.')
-
-
-    # tmb
-    fn = os.path.join(directory, 'out', 'aggregate', 'mutation_rate.tsv')
-    for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
-      sample = row['Filename'].split('/')[-1].split('.')[0]
-      del row['Filename'] # include everything but
-      samples['{}/{}'.format(sample, source)]['TMB'] = row['PerMB']
-      logging.debug('add_signature: adding %s to %s', source, sample)
-      header.add('TMB')
-
-    # tmb with signature artefacts removed
-    if TMB_CLEANED:
-      fn = os.path.join(directory, 'out', 'aggregate', 'mutation_rate.artefact_filter.tsv')
-      for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
-        sample = row['Filename'].split('/')[-1].split('.')[0]
-        del row['Filename'] # include everything but
-        samples['{}/{}'.format(sample, source)]['TMB.cleaned'] = row['PerMB']
-        header.add('TMB.cleaned')
-
-    # msisensor
-    fn = os.path.join(directory, 'out', 'aggregate', 'msisensor.tsv')
-    try:
-      for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
-        sample = row['Sample']
-        del row['Sample'] # include everything but
-        samples['{}/{}'.format(sample, source)]['MSISensor'] = row['%']
-        header.add('MSISensor')
-    except:
-      logging.error('failed to add msisensor')
-
-    # mantis
-    fn = os.path.join(directory, 'out', 'aggregate', 'mantis.tsv')
-    try:
-      for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
-        sample = row['Sample'].split('/')[-1].split('.')[0]
-        del row['Sample'] # include everything but
-        samples['{}/{}'.format(sample, source)]['Mantis'] = row['Pct']
-        header.add('Mantis')
-    except:
-      logging.error('failed to add mantis')
+def parse_column(fn, sample_column, column, name, path_sample=True):
+  '''
+    one value per sample from a single column
+  '''
+  for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
+    sample = row[sample_column]
+    if path_sample:
+      sample = sample.split('/')[-1].split('.')[0]
+    yield (sample, {name: row[column]})
 
-    # msiseq
-    fn = os.path.join(directory, 'out', 'aggregate', 'msiseq.tsv')
+def parse_optitype(fn):
+  for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
+    sample = row['Sample'].split('/')[-1].split('.')[0]
+    #A1^IA2^IB1^IB2^IC1^IC2^IReads^IObjective
+    yield (sample, {'HLAType': ' '.join([row[x] for x in ('A1', 'A2', 'B1', 'B2', 'C1', 'C2')])})
+
+def parse_ontarget(fn):
+  # first line can contain spaces in older pipeline
+  lines = [re.sub('  *', '\t', x) for x in open(fn, 'r').readlines()]
+  for row in csv.DictReader(lines, delimiter='\t'):
+    sample = row['Filename'].split('/')[-1].split('.')[0]
+    yield (sample, {'MeanOnTargetCoverage': row['Mean']})
+
+def parse_loh(fn):
+  for row in csv.DictReader(open(fn, 'r'), delimiter='\t'): # sample gene accept
+    if row['gene'] in GENES_OF_INTEREST:
+      yield (row['sample'], {'LOH': [row['gene']]})
+
+def parse_somalier(fn):
+  #sample_id      predicted_ancestry      given_ancestry  EAS_prob        AFR_prob        AMR_prob        SAS_prob        EUR_prob        PC1     PC2     PC3     PC4     PC5
+  #HG02855 AFR     AFR     0.0000  1.0000  0.0000  0.0000  0.0000  11.7211 -2.1820 0.7847  -1.7377 1.3824
+  logging.info('processing %s', fn)
+  for row in csv.DictReader(open(fn, 'r'), delimiter='\t'): # sample gene accept
+    prediction = row['predicted_ancestry']
+    yield (row['#sample_id'], {'Ethnicity': '{} ({})'.format(prediction, row['{}_prob'.format(prediction)])})
+
+# how to handle a source that fails to parse
+SKIP_DIRECTORY = 'skip' # stop reading the batch if missing, stop if it fails
+REQUIRED = 'required' # stop
+OPTIONAL = 'optional' # log and continue
+FATAL = 'fatal' # log and stop
+
+def sources(source):
+  '''
+    (description, filename, parser, on failure) for each aggregate file of a batch
+  '''
+  result = []
+  if V2_SBS:
+    result.append(('v2 sbs', 'mutational_signatures_v2.filter.combined.tsv', lambda fn: parse_signature(fn, source, 'v2'), SKIP_DIRECTORY))
+  if V3_SBS:
+    result.append(('v3 sbs', 'mutational_signatures_v3_sbs_capture.filter.combined.tsv', lambda fn: parse_signature(fn, source, 'SBS.'), SKIP_DIRECTORY))
+  if V3_ID:
+    #'mutational_signatures_v3_id_capture.filter.combined.tsv'
+    result.append(('v3 id', 'mutational_signatures_v3_id_strelka.filter.combined.tsv', lambda fn: parse_signature(fn, source, 'ID.'), SKIP_DIRECTORY))
+  if V3_DBS:
+    result.append(('v3 id', 'mutational_signatures_v3_dbs.filter.combined.tsv', lambda fn: parse_signature(fn, source, 'DB.'), SKIP_DIRECTORY))
+  if V31_SBS:
+    result.append(('v3.1 sbs', 'mutational_signatures_v3.1_sbs.combined.tsv', lambda fn: parse_signature(fn, source, 'SBS.'), SKIP_DIRECTORY))
+  if V31_ID:
+    result.append(('v3.1 id', 'mutational_signatures_v3.1_id.combined.tsv', lambda fn: parse_signature(fn, source, 'ID.'), SKIP_DIRECTORY))
+
+  # tmb
+  result.append(('tmb', 'mutation_rate.tsv', lambda fn: parse_column(fn, 'Filename', 'PerMB', 'TMB'), REQUIRED))
+  # tmb with signature artefacts removed
+  if TMB_CLEANED:
+    result.append(('tmb cleaned', 'mutation_rate.artefact_filter.tsv', lambda fn: parse_column(fn, 'Filename', 'PerMB', 'TMB.cleaned'), REQUIRED))
+
+  result.extend([
+    ('msisensor', 'msisensor.tsv', lambda fn: parse_column(fn, 'Sample', '%', 'MSISensor', path_sample=False), OPTIONAL),
+    ('mantis', 'mantis.tsv', lambda fn: parse_column(fn, 'Sample', 'Pct', 'Mantis'), OPTIONAL),
+    ('msiseq', 'msiseq.tsv', lambda fn: parse_column(fn, 'Sample', 'S.ind', 'msiseq', path_sample=False), OPTIONAL),
+    ('purity', 'purity.tsv', lambda fn: parse_column(fn, 'Sample', 'Best', 'Purity'), OPTIONAL),
+    ('msmutect', 'msmutect.combined.tsv', lambda fn: parse_column(fn, 'Filename', 'Count', 'msmutect'), OPTIONAL),
+    ('hlatype', 'optitype.tsv', parse_optitype, OPTIONAL),
+    ('ontarget', 'ontarget.tsv', parse_ontarget, OPTIONAL),
+    ('loh', 'loh.genes.tsv', parse_loh, OPTIONAL),
+    ('ethnicity', 'somalier-ancestry.somalier-ancestry.tsv', parse_somalier, FATAL)])
+  return result
+
+def cache_fingerprint():
+  '''
+    the settings that decide what the parsers return, a cache written with different settings is dropped
+  '''
+  return {
+    'version': CACHE_VERSION,
+    'settings': [V2_SBS, V3_SBS, V3_DBS, V31_SBS, V2_ID, V3_ID, V31_ID, TMB_CLEANED, KEEP_SIGS],
+    'genes': sorted(GENES_OF_INTEREST)}
+
+def cache_filename(cache_dir, directory):
+  name = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+  return os.path.join(cache_dir, '{}.json'.format(name))
+
+def load_cache(cache_dir, directory):
+  if cache_dir is None:
+    return {}
+  fn = cache_filename(cache_dir, directory)
+  if not os.path.isfile(fn):
+    return {}
+  try:
+    cache = json.load(open(fn, 'r'))
+  except ValueError:
+    logging.warn('ignoring unreadable cache %s', fn)
+    return {}
+  if not isinstance(cache, dict) or cache.get('fingerprint') != cache_fingerprint():
+    logging.info('ignoring cache %s written with different settings', fn)
+    return {}
+  return cache['files']
+
+def save_cache(cache_dir, directory, cache):
+  if cache_dir is None:
+    return
+  fn = cache_filename(cache_dir, directory)
+  tmp_fn = '{}.{}.tmp'.format(fn, os.getpid())
+  with open(tmp_fn, 'w') as fh:
+    json.dump({'fingerprint': cache_fingerprint(), 'files': cache}, fh)
+  os.replace(tmp_fn, fn)
+
+def parse_directory(directory, cache_dir):
+  '''
+    returns a list of (sample, values) fragments for the batch
+    parsing stops at the first missing signature file, keeping the fragments of the files before it,
+    and a file that fails partway keeps the rows parsed before the failure
+    files that parse completely are cached on path, size, mtime and source, under the parser settings
+  '''
+  logging.info('parsing %s...', directory)
+  source = os.path.basename(directory)
+  cache = load_cache(cache_dir, directory)
+  updated = {}
+  fragments = []
+  for description, name, parser, on_failure in sources(source):
+    fn = os.path.join(directory, 'out', 'aggregate', name)
+    if on_failure == SKIP_DIRECTORY and not os.path.isfile(fn):
+      logging.info('skipping %s: no %s', directory, description)
+      break
+    rows = []
     try:
-      for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
-        sample = row['Sample']
-        del row['Sample'] # include everything but
-        samples['{}/{}'.format(sample, source)]['msiseq'] = row['S.ind']
-        header.add('msiseq')
+      stat = os.stat(fn)
+      key = [stat.st_size, stat.st_mtime_ns, description]
+      if fn in cache and cache[fn]['key'] == key:
+        logging.debug('using cached %s', fn)
+        rows = cache[fn]['rows']
+      else:
+        for row in parser(fn):
+          rows.append(row)
+      updated[fn] = {'key': key, 'rows': rows}
+      fragments.extend(rows)
     except:
-      logging.error('failed to add msiseq')
+      fragments.extend(rows)
+      if on_failure in (REQUIRED, SKIP_DIRECTORY):
+        raise
+      logging.error('failed to add %s', description)
+      if on_failure == FATAL:
+        raise
+
+  if updated != cache:
+    save_cache(cache_dir, directory, updated)
+  return fragments
+
+class CohortTable(object):
+  '''
+    one array per column, with rows indexed by (sample, source)
+  '''
+  HIDDEN = ('source',) # kept for --require but not written
+
+  def __init__(self):
+    self.index = {} # (sample, source) -> row
+    self.keys = []
+    self.columns = {} # name -> list of values, None if missing
+
+  def row(self, sample, source):
+    key = (sample, source)
+    if key not in self.index:
+      self.index[key] = len(self.keys)
+      self.keys.append(key)
+      for values in self.columns.values():
+        values.append(None)
+    return self.index[key]
+
+  def set(self, row, name, value):
+    if name not in self.columns:
+      self.columns[name] = [None] * len(self.keys)
+    if name == 'LOH':
+      if self.columns[name][row] is None:
+        self.columns[name][row] = set()
+      self.columns[name][row].update(value)
+    else:
+      self.columns[name][row] = value
+
+  def add_column(self, name):
+    if name not in self.columns:
+      self.columns[name] = [None] * len(self.keys)
+
+  def header(self):
+    return sorted([name for name in self.columns if name not in self.HIDDEN])
+
+  def rows(self, require=None):
+    '''
+      row numbers in output order
+    '''
+    result = []
+    for row in sorted(range(len(self.keys)), key=lambda row: '{}/{}'.format(*self.keys[row])):
+      if require is not None and (require not in self.columns or self.columns[require][row] is None):
+        logging.debug('skipping %s...', self.keys[row])
+        continue
+      result.append(row)
+    return result
+
+  def column_type(self, name):
+    '''
+      int, float, list or str, inferred from every value in the column
+    '''
+    if name == 'LOH':
+      return list
+    present = [value for value in self.columns[name] if value is not None and value != 'NA']
+    for candidate in (int, float):
+      try:
+        for value in present:
+          candidate(value)
+        return candidate
+      except ValueError:
+        continue
+    return str
+
+  def typed(self, name, rows):
+    column_type = self.column_type(name)
+    values = self.columns[name]
+    if column_type is list:
+      return [sorted(list(values[row] or set())) for row in rows]
+    return [None if values[row] is None or values[row] == 'NA' else column_type(values[row]) for row in rows]
+
+  def display(self, name, rows):
+    values = self.columns[name]
+    if name == 'LOH':
+      return [' '.join(sorted(list(values[row] or set()))) for row in rows]
+    return ['NA' if values[row] is None else values[row] for row in rows]
+
+  def write_tsv(self, out, require=None):
+    header = self.header()
+    rows = self.rows(require)
+    columns = [[self.keys[row][0] for row in rows], [self.keys[row][1] for row in rows]] + [self.display(name, rows) for name in header]
+    out.write('Sample\tSource\t{}\n'.format('\t'.join(header)))
+    for line in zip(*columns):
+      out.write('{}\n'.format('\t'.join(line)))
+
+  def to_arrow(self, require=None):
+    import pyarrow # only needed for columnar output
+    header = self.header()
+    rows = self.rows(require)
+    data = {'Sample': [self.keys[row][0] for row in rows], 'Source': [self.keys[row][1] for row in rows]}
+    for name in header:
+      data[name] = self.typed(name, rows)
+    return pyarrow.Table.from_pydict(data)
+
+  def write_parquet(self, fn, require=None):
+    import pyarrow.parquet
+    pyarrow.parquet.write_table(self.to_arrow(require), fn)
+
+  def write_arrow(self, fn, require=None):
+    import pyarrow.feather
+    pyarrow.feather.write_feather(self.to_arrow(require), fn)
+
+def main(directories, phenotype, require, cache_dir=None, threads=1, parquet=None, arrow=None):
+  logging.info('starting...')
 
-    # purity
-    fn = os.path.join(directory, 'out', 'aggregate', 'purity.tsv')
-    try:
-      for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
-        sample = row['Sample'].split('/')[-1].split('.')[0]
-        del row['Sample'] # include everything but
-        samples['{}/{}'.format(sample, source)]['Purity'] = row['Best']
-        header.add('Purity')
-    except:
-      logging.error('failed to add purity')
+  table = CohortTable()
 
-    # msmutect
-    fn = os.path.join(directory, 'out', 'aggregate', 'msmutect.combined.tsv')
-    try:
-      for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
-        sample = row['Filename'].split('/')[-1].split('.')[0]
-        del row['Filename'] # include everything but
-        #A1^IA2^IB1^IB2^IC1^IC2^IReads^IObjective
-        samples['{}/{}'.format(sample, source)]['msmutect'] = row['Count']
-        header.add('msmutect')
-    except:
-      logging.error('failed to add hlatype')
+  if cache_dir is not None and not os.path.isdir(cache_dir):
+    os.makedirs(cache_dir)
 
-    # optitype
-    fn = os.path.join(directory, 'out', 'aggregate', 'optitype.tsv')
-    try:
-      for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
-        sample = row['Sample'].split('/')[-1].split('.')[0]
-        del row['Sample'] # include everything but
-        #A1^IA2^IB1^IB2^IC1^IC2^IReads^IObjective
-        samples['{}/{}'.format(sample, source)]['HLAType'] = ' '.join([row[x] for x in ('A1', 'A2', 'B1', 'B2', 'C1', 'C2')])
-        header.add('HLAType')
-    except:
-      logging.error('failed to add hlatype')
+  # reads are latency bound so scan batches concurrently, then combine in the original order
+  with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+    batches = list(executor.map(lambda directory: parse_directory(directory, cache_dir), directories))
 
-    # ontarget coverage
-    try:
-      fn = os.path.join(directory, 'out', 'aggregate', 'ontarget.tsv')
-      # first line can contain spaces in older pipeline
-      lines = [re.sub('  *', '\t', x) for x in open(fn, 'r').readlines()]
-      
-      for row in csv.DictReader(lines, delimiter='\t'):
-        sample = row['Filename'].split('/')[-1].split('.')[0]
-        del row['Filename'] # include everything but
-        samples['{}/{}'.format(sample, source)]['MeanOnTargetCoverage'] = row['Mean']
-        header.add('MeanOnTargetCoverage')
-    except:
-      logging.error('failed to add ontarget')
-      #raise
-
-    # loh
-    try:
-      fn = os.path.join(directory, 'out', 'aggregate', 'loh.genes.tsv')
-      for row in csv.DictReader(open(fn, 'r'), delimiter='\t'): # sample gene accept
-        if row['gene'] in GENES_OF_INTEREST:
-          if 'LOH' not in samples['{}/{}'.format(row['sample'], source)]:
-            samples['{}/{}'.format(row['sample'], source)]['LOH'] = set()
-          samples['{}/{}'.format(row['sample'], source)]['LOH'].add(row['gene'])
-          header.add('LOH')
-    except:
-      logging.error('failed to add loh')
-
-    # somalier
-    #sample_id      predicted_ancestry      given_ancestry  EAS_prob        AFR_prob        AMR_prob        SAS_prob        EUR_prob        PC1     PC2     PC3     PC4     PC5
-    #HG02855 AFR     AFR     0.0000  1.0000  0.0000  0.0000  0.0000  11.7211 -2.1820 0.7847  -1.7377 1.3824
-    try:
-      fn = os.path.join(directory, 'out', 'aggregate', 'somalier-ancestry.somalier-ancestry.tsv')
-      logging.info('processing %s', fn)
-      for row in csv.DictReader(open(fn, 'r'), delimiter='\t'): # sample gene accept
-        #logging.debug('rows are %s', row)
-        prediction = row['predicted_ancestry']
-        samples['{}/{}'.format(row['#sample_id'], source)]['Ethnicity'] = '{} ({})'.format(prediction, row['{}_prob'.format(prediction)])
-        header.add('Ethnicity')
-    except:
-      logging.error('failed to add ethnicity')
-      raise
+  for directory, fragments in zip(directories, batches):
+    source = os.path.basename(directory)
+    for sample, values in fragments:
+      row = table.row(sample, source)
+      for name, value in values.items():
+        table.set(row, name, value)
 
   if phenotype is not None:
-    header.add('Phenotype')
-    header.add('Category')
-    for row in csv.DictReader(open(phenotype, 'r'), delimiter='\t'):
-      for key in samples.keys():
-        if key.startswith('{}/'.format(row['Sample Name'])):
-          samples[key]['Phenotype'] = row['Phenotype']
-          samples[key]['Category'] = row['Category']
-          logging.debug('adding phenotype for %s', key)
-        else:
-          pass #logging.info('skipping phenotype for %s', row['Sample Name'])
+    table.add_column('Phenotype')
+    table.add_column('Category')
+    rows = collections.defaultdict(list)
+    for (sample, source), row in table.index.items():
+      rows[sample].append(row)
+    for line in csv.DictReader(open(phenotype, 'r'), delimiter='\t'):
+      for row in rows.get(line['Sample Name'], []):
+        table.set(row, 'Phenotype', line['Phenotype'])
+        table.set(row, 'Category', line['Category'])
+        logging.debug('adding phenotype for %s', table.keys[row])
   else:
     logging.info('Not adding phenotype data')
 
   # now write everything to stdout
-  sys.stdout.write('Sample\tSource\t{}\n'.format('\t'.join(sorted(list(header)))))
-  for key in sorted(samples.keys()):
-    if require is not None and require not in samples[key]:
-      logging.debug('skipping %s...', key)
-      continue
-    logging.debug('writing %s...', key)
-    sample, source = key.split('/')
-    sys.stdout.write('{}\t{}\t{}\n'.format(sample, source, '\t'.join([display_value(samples, key, name)for name in sorted(list(header))])))
+  table.write_tsv(sys.stdout, require)
+
+  if parquet is not None:
+    logging.info('writing %s...', parquet)
+    table.write_parquet(parquet, require)
+
+  if arrow is not None:
+    logging.info('writing %s...', arrow)
+    table.write_arrow(arrow, require)
 
   logging.info('done')
 
@@ -336,6 +412,10 @@ if __name__ == '__main__':
   parser.add_argument('--directories', required=True, nargs='+', help='location of each batch')
   parser.add_argument('--phenotype', required=False, help='location of phenotype')
   parser.add_argument('--require', required=False, help='field to require')
+  parser.add_argument('--cache', required=False, help='directory to cache parsed batch files')
+  parser.add_argument('--threads', required=False, type=int, default=8, help='number of batch directories to scan concurrently')
+  parser.add_argument('--parquet', required=False, help='also write typed table to this parquet file (requires pyarrow)')
+  parser.add_argument('--arrow', required=False, help='also write typed table to this arrow/feather file (requires pyarrow)')
   parser.add_argument('--verbose', action='store_true', help='more logging')
   args = parser.parse_args()
   if args.verbose:
@@ -343,4 +423,4 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-  main(args.directories, args.phenotype, args.require)
+  main(args.directories, args.phenotype, args.require, args.cache, args.threads, args.parquet, args.arrow)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 '''
-  given tumour and normal fastqs, generate a script to merge them
+  given tumour and normal fastqs, merge lanes into outdir
+  - single lanes are symlinked, multiple lanes are concatenated concurrently and checked by size
+  - --dry_run writes a bash script to do the same instead
 '''
 
 # ./Exome_fastq/1053-D-T-1_D13N8ACXX_AGTCAA_L002_R1.fastq.gz
@@ -19,11 +21,20 @@
 
 import argparse
 import collections
+import concurrent.futures
+import errno
 import logging
+import os
+import shutil
 import sys
 
-def merge(files, outdir, sample_components, skip_components):
-  logging.info('starting...')
+# largest single zero copy request
+COPY_CHUNK = 1 << 30
+
+def plan(files, sample_components, skip_components):
+  '''
+    (sample, readnum) -> input files in the order given
+  '''
   samples = collections.defaultdict(list)
   logging.info('considering input files...')
   for f in files:
@@ -34,7 +45,13 @@ def merge(files, outdir, sample_components, skip_components):
     readnum = components[-1]
     samples[(sample, readnum)].append(f)
     logging.debug('added %s to %s...', f, (sample, readnum))
-  logging.info('generating merged files...')
+  return samples
+
+def merged_name(sources):
+  target = sorted([x[::-1] for x in sources])[0] # take sample with lowest lane number
+  return target[::-1].split('/')[-1]
+
+def write_script(files, outdir, samples):
   sys.stdout.write('#!/usr/bin/env bash\n# generated for {} for {}\n\n'.format(', '.join(files)[:1000], outdir))
   sys.stdout.write('echo "starting at $(date)"\n\n')
   sys.stdout.write('set -o errexit\nset -x\n')
@@ -45,12 +62,98 @@ def merge(files, outdir, sample_components, skip_components):
       sys.stdout.write('ln -s "{}" "{}"\n'.format(samples[s][0], outdir))
     else:
       # merge
-      target = sorted([x[::-1] for x in samples[s]])[0] # take sample with lowest lane number
-      target = target[::-1].split('/')[-1]
-      sys.stdout.write('cat {} > {}/{}\n'.format(' '.join(samples[s]), outdir, target))
+      sys.stdout.write('cat {} > {}/{}\n'.format(' '.join(samples[s]), outdir, merged_name(samples[s])))
 
   sys.stdout.write('echo "finished at $(date)"\n')
- 
+
+def zero_copy_methods():
+  methods = []
+  if hasattr(os, 'copy_file_range'):
+    methods.append(lambda in_fd, out_fd, count: os.copy_file_range(in_fd, out_fd, count))
+  if hasattr(os, 'sendfile'):
+    methods.append(lambda in_fd, out_fd, count: os.sendfile(out_fd, in_fd, None, count))
+  return methods
+
+def append_file(out_fh, fn):
+  '''
+    append fn to the unbuffered out_fh, in the kernel where the os and filesystem allow it
+  '''
+  with open(fn, 'rb', buffering=0) as in_fh:
+    remaining = os.fstat(in_fh.fileno()).st_size
+    for method in zero_copy_methods():
+      try:
+        while remaining > 0:
+          copied = method(in_fh.fileno(), out_fh.fileno(), min(remaining, COPY_CHUNK))
+          if copied == 0:
+            break
+          remaining -= copied
+        if remaining == 0:
+          return
+      except OSError as ex:
+        if ex.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+          raise
+        logging.debug('zero copy not available for %s: %s', fn, ex)
+    # both methods continue from the current offsets so finish with a plain copy
+    shutil.copyfileobj(in_fh, out_fh, 1 << 24)
+
+def concatenate(sources, target):
+  '''
+    concatenate the gzip members of sources into target, checking the size of the result
+  '''
+  expected = sum([os.stat(fn).st_size for fn in sources])
+  if os.path.isfile(target) and not os.path.islink(target) and os.stat(target).st_size == expected:
+    logging.info('%s is already merged', target)
+    return target
+  tmp_target = '{}.{}.tmp'.format(target, os.getpid())
+  try:
+    with open(tmp_target, 'wb', buffering=0) as out_fh:
+      for fn in sources:
+        append_file(out_fh, fn)
+      size = os.fstat(out_fh.fileno()).st_size
+    if size != expected:
+      raise IOError('{}: merged size {} does not match inputs {}'.format(target, size, expected))
+    os.replace(tmp_target, target)
+  finally:
+    if os.path.exists(tmp_target):
+      os.remove(tmp_target)
+  logging.info('merged %i files into %s (%i bytes)', len(sources), target, expected)
+  return target
+
+def link(source, outdir):
+  target = os.path.join(outdir, os.path.basename(source))
+  if os.path.islink(target) and os.readlink(target) == source:
+    logging.info('%s is already linked', target)
+  else:
+    os.symlink(source, target)
+    logging.debug('linked %s to %s', source, target)
+  return target
+
+def stage(outdir, samples, threads):
+  '''
+    symlink single lanes and concatenate multiple lanes, threads merges at a time
+  '''
+  links = merges = 0
+  with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+    jobs = []
+    for s in samples:
+      if len(samples[s]) == 1:
+        link(samples[s][0], outdir)
+        links += 1
+      else:
+        jobs.append(executor.submit(concatenate, samples[s], os.path.join(outdir, merged_name(samples[s]))))
+    for job in concurrent.futures.as_completed(jobs):
+      job.result()
+      merges += 1
+  logging.info('linked %i and merged %i files into %s', links, merges, outdir)
+
+def merge(files, outdir, sample_components, skip_components, dry_run=False, threads=4):
+  logging.info('starting...')
+  samples = plan(files, sample_components, skip_components)
+  if dry_run:
+    logging.info('generating merged files...')
+    write_script(files, outdir, samples)
+  else:
+    stage(outdir, samples, threads)
   logging.info('done')
 
 if __name__ == '__main__':
@@ -59,6 +162,8 @@ if __name__ == '__main__':
   parser.add_argument('--outdir', required=True, help='fastq target')
   parser.add_argument('--skip_components', required=False, type=int, default=0, help='skip initial components')
   parser.add_argument('--sample_components', required=False, type=int, default=1, help='number of components in sample')
+  parser.add_argument('--dry_run', action='store_true', help='write a bash script to do the merge instead of doing it')
+  parser.add_argument('--threads', required=False, type=int, default=4, help='number of files to merge at once')
   parser.add_argument('--verbose', action='store_true', help='more logging')
   args = parser.parse_args()
   if args.verbose:
@@ -66,4 +171,4 @@ if __name__ == '__main__':
   else:
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
-  merge(args.files, args.outdir, args.sample_components, args.skip_components)
+  merge(args.files, args.outdir, args.sample_components, args.skip_components, args.dry_run, args.threads)
@@ -3,6 +3,7 @@
 set -o errexit
 
 # remove files so that a new sample can run
+# set result_cache in cfg/config.yaml so that python steps of unchanged tumours are restored rather than rerun
 BCK=out.bck.$(date +%Y-%m-%d)
 echo "backing up to $BCK..."
 
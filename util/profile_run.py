@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+'''
+  where did the wall clock time of a pipeline run go
+  - jobs, their rules, inputs and outputs come from snakemake --detailed-summary and/or the slurm job logs (log/slurm-*.out)
+  - job times come from snakemake --stats, or from a sacct export which also gives queue wait and cpu time
+  - a job depends on the jobs that wrote its inputs. the critical path is followed back from the last job to finish through the dependency that finished last
+  - writes a tsv of time per rule to stdout, optionally a tsv per job and a static html timeline with parallelism over time
+  - usage: util/profile_run.py --stats log/snakemake_stats.json --summary summary.tsv --slurm_logs log/slurm-*.out --sacct log/sacct.txt --html log/timeline.html
+'''
+
+import argparse
+import collections
+import csv
+import datetime
+import html
+import json
+import logging
+import sys
+
+import right_size
+
+class Job(object):
+  def __init__(self, rule, inputs, outputs):
+    self.rule = rule
+    self.inputs = inputs
+    self.outputs = outputs
+    self.submit = self.start = self.end = None
+    self.cpu_seconds = None
+    self.cpus = None
+    self.dependencies = []
+    self.critical = False
+
+  def duration(self):
+    return (self.end - self.start).total_seconds()
+
+  def wait(self):
+    if self.submit is None:
+      return None
+    return max(0.0, (self.start - self.submit).total_seconds())
+
+def parse_ctime(value):
+  # snakemake writes times with time.ctime
+  return datetime.datetime.strptime(value, '%a %b %d %H:%M:%S %Y')
+
+def parse_sacct_time(value):
+  if value is None or value in ('Unknown', 'None'):
+    return None
+  return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+
+def read_summary(fn):
+  '''
+    jobs from snakemake --detailed-summary, which has a row per output file
+  '''
+  jobs = collections.OrderedDict()
+  for row in csv.DictReader(open(fn, 'r'), delimiter='\t'):
+    rule = row.get('rule', '-')
+    if rule in ('-', '', None):
+      continue # not created by the workflow
+    inputs = [x for x in (row.get('input-file(s)') or '').split(',') if x not in ('', '-')]
+    key = (rule, tuple(inputs))
+    if key not in jobs:
+      jobs[key] = Job(rule, inputs, [])
+    jobs[key].outputs.append(row['output_file'])
+  logging.info('read %i jobs from %s', len(jobs), fn)
+  return list(jobs.values())
+
+def read_slurm_logs(fns, sacct):
+  '''
+    a job per slurm log, with times from sacct if available
+  '''
+  result = []
+  for fn in fns:
+    parsed = right_size.parse_slurm_log(fn)
+    if parsed is None:
+      continue
+    job = Job(parsed.rule, parsed.inputs, parsed.outputs)
+    accounting = sacct.get(right_size.slurm_id(fn))
+    if accounting is not None:
+      job.submit = parse_sacct_time(accounting['submit'])
+      job.start = parse_sacct_time(accounting['start'])
+      job.end = parse_sacct_time(accounting['end'])
+      job.cpus = accounting['cpus']
+      if accounting['cpu_minutes'] is not None:
+        job.cpu_seconds = accounting['cpu_minutes'] * 60
+    result.append(job)
+  logging.info('read %i jobs from %i slurm logs', len(result), len(fns))
+  return result
+
+def merge_jobs(summary_jobs, slurm_jobs):
+  '''
+    slurm jobs, plus summary jobs for outputs that no slurm job wrote e.g. local rules
+  '''
+  written = set([output for job in slurm_jobs for output in job.outputs])
+  return slurm_jobs + [job for job in summary_jobs if not any([output in written for output in job.outputs])]
+
+def add_stats_times(jobs, stats_fn):
+  '''
+    start and end of jobs without them from the times snakemake recorded for their outputs
+  '''
+  files = json.load(open(stats_fn, 'r')).get('files', {})
+  for job in jobs:
+    if job.start is not None and job.end is not None:
+      continue
+    times = [files[output] for output in job.outputs if output in files]
+    if len(times) > 0:
+      job.start = min([parse_ctime(value['start-time']) for value in times])
+      job.end = max([parse_ctime(value['stop-time']) for value in times])
+
+def link(jobs):
+  writer = {}
+  for job in jobs:
+    for output in job.outputs:
+      writer[output] = job
+  for job in jobs:
+    job.dependencies = list(set([writer[fn] for fn in job.inputs if fn in writer and writer[fn] is not job]))
+
+def critical_path(jobs):
+  '''
+    jobs from the first to the last to finish, each step being the dependency that finished last
+  '''
+  timed = [job for job in jobs if job.start is not None and job.end is not None]
+  if len(timed) == 0:
+    return []
+  path = [max(timed, key=lambda job: job.end)]
+  while True:
+    previous = [job for job in path[-1].dependencies if job.start is not None and job.end is not None]
+    if len(previous) == 0:
+      break
+    path.append(max(previous, key=lambda job: job.end))
+  path.reverse()
+  for job in path:
+    job.critical = True
+  return path
+
+def parallelism(jobs, buckets=200):
+  '''
+    (time, running jobs) at evenly spaced times over the run
+  '''
+  timed = [job for job in jobs if job.start is not None and job.end is not None]
+  if len(timed) == 0:
+    return []
+  first = min([job.start for job in timed])
+  last = max([job.end for job in timed])
+  step = max(1.0, (last - first).total_seconds() / buckets)
+  result = []
+  for idx in range(buckets + 1):
+    moment = first + datetime.timedelta(seconds=idx * step)
+    if moment > last:
+      break
+    result.append((moment, sum([1 for job in timed if job.start <= moment < job.end])))
+  return result
+
+def rule_summary(jobs, path):
+  '''
+    per rule totals sorted by total wall time
+  '''
+  critical_seconds = collections.defaultdict(float)
+  for job in path:
+    critical_seconds[job.rule] += job.duration()
+  rules = collections.defaultdict(list)
+  for job in jobs:
+    if job.start is not None and job.end is not None:
+      rules[job.rule].append(job)
+  result = []
+  for rule, rule_jobs in rules.items():
+    durations = [job.duration() for job in rule_jobs]
+    waits = [job.wait() for job in rule_jobs if job.wait() is not None]
+    cpus = [job.cpu_seconds for job in rule_jobs if job.cpu_seconds is not None]
+    allocated = [job.cpus * job.duration() for job in rule_jobs if job.cpus is not None]
+    result.append({
+      'rule': rule,
+      'jobs': len(rule_jobs),
+      'wall_seconds': sum(durations),
+      'mean_seconds': sum(durations) / len(durations),
+      'max_seconds': max(durations),
+      'span_seconds': (max([job.end for job in rule_jobs]) - min([job.start for job in rule_jobs])).total_seconds(),
+      'cpu_seconds': sum(cpus) if len(cpus) > 0 else None,
+      'cpu_efficiency': sum(cpus) / sum(allocated) if len(cpus) > 0 and len(allocated) > 0 and sum(allocated) > 0 else None,
+      'wait_seconds': sum(waits) if len(waits) > 0 else None,
+      'critical_seconds': critical_seconds.get(rule, 0.0)
+    })
+  return sorted(result, key=lambda x: -x['wall_seconds'])
+
+COLUMNS = ['rule', 'jobs', 'wall_seconds', 'mean_seconds', 'max_seconds', 'span_seconds', 'cpu_seconds', 'cpu_efficiency', 'wait_seconds', 'critical_seconds']
+
+def format_value(value):
+  if value is None:
+    return ''
+  if isinstance(value, float):
+    return '{:.2f}'.format(value) if value < 10 else '{:.0f}'.format(value)
+  return str(value)
+
+def write_rules(fh, summary):
+  fh.write('{}\n'.format('\t'.join(COLUMNS)))
+  for row in summary:
+    fh.write('{}\n'.format('\t'.join([format_value(row[column]) for column in COLUMNS])))
+
+def write_jobs(fn, jobs):
+  with open(fn, 'w') as fh:
+    fh.write('rule\tstart\tend\tseconds\twait_seconds\tcpu_seconds\tcritical\toutputs\n')
+    for job in sorted([job for job in jobs if job.start is not None and job.end is not None], key=lambda job: job.start):
+      fh.write('{}\t{}\t{}\t{:.0f}\t{}\t{}\t{}\t{}\n'.format(job.rule, job.start.isoformat(), job.end.isoformat(), job.duration(), format_value(job.wait()), format_value(job.cpu_seconds), 'Y' if job.critical else 'N', ','.join(job.outputs)))
+
+def colour(rule):
+  value = sum([ord(c) * (idx + 1) for idx, c in enumerate(rule)])
+  return 'hsl({},60%,60%)'.format(value % 360)
+
+def lanes(jobs):
+  '''
+    row of each job so that jobs in a row do not overlap, rows are grouped by rule
+  '''
+  result = {}
+  row = 0
+  by_rule = collections.defaultdict(list)
+  for job in jobs:
+    by_rule[job.rule].append(job)
+  for rule in sorted(by_rule, key=lambda rule: min([job.start for job in by_rule[rule]])):
+    ends = []
+    for job in sorted(by_rule[rule], key=lambda job: job.start):
+      for idx, end in enumerate(ends):
+        if end <= job.start:
+          ends[idx] = job.end
+          result[job] = row + idx
+          break
+      else:
+        ends.append(job.end)
+        result[job] = row + len(ends) - 1
+    row += len(ends)
+  return result, row
+
+def write_html(fn, jobs, path, summary, counts):
+  timed = [job for job in jobs if job.start is not None and job.end is not None]
+  if len(timed) == 0:
+    logging.warn('no job times, not writing %s', fn)
+    return
+  first = min([job.start for job in timed])
+  total = max(1.0, (max([job.end for job in timed]) - first).total_seconds())
+  width, row_height, left = 1200, 6, 10
+  x = lambda moment: left + (moment - first).total_seconds() / total * width
+
+  rows, row_count = lanes(timed)
+  out = []
+  out.append('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>pipeline timeline</title><style>body{font-family:sans-serif;font-size:12px} table{border-collapse:collapse} td,th{padding:2px 8px;text-align:right} td:first-child,th:first-child{text-align:left}</style></head><body>')
+  out.append('<h2>Timeline</h2><p>{} jobs over {:.1f} hours. critical path of {} jobs in red.</p>'.format(len(timed), total / 3600, len(path)))
+
+  height = row_count * row_height + 20
+  out.append('<svg width="{}" height="{}" xmlns="http://www.w3.org/2000/svg">'.format(width + 2 * left, height))
+  for job in timed:
+    out.append('<rect x="{:.1f}" y="{}" width="{:.1f}" height="{}" fill="{}"{}><title>{}: {:.0f}s {}</title></rect>'.format(x(job.start), rows[job] * row_height, max(0.5, x(job.end) - x(job.start)), row_height - 1, colour(job.rule), ' stroke="red" stroke-width="1"' if job.critical else '', html.escape(job.rule), job.duration(), html.escape(', '.join(job.outputs[:3]))))
+  for hour in range(int(total // 3600) + 1):
+    position = left + hour * 3600 / total * width
+    out.append('<line x1="{0:.1f}" x2="{0:.1f}" y1="0" y2="{1}" stroke="#ccc"/><text x="{0:.1f}" y="{2}">{3}h</text>'.format(position, row_count * row_height, height - 5, hour))
+  out.append('</svg>')
+
+  if len(counts) > 0:
+    peak = max(1, max([count for _, count in counts]))
+    chart_height = 120
+    points = ' '.join(['{:.1f},{:.1f}'.format(x(moment), chart_height - count / peak * (chart_height - 10)) for moment, count in counts])
+    out.append('<h2>Parallelism</h2><p>running jobs over time, peak {}</p>'.format(peak))
+    out.append('<svg width="{}" height="{}" xmlns="http://www.w3.org/2000/svg"><polyline points="{}" fill="none" stroke="steelblue"/></svg>'.format(width + 2 * left, chart_height, points))
+
+  out.append('<h2>Critical path</h2><table><tr><th>rule</th><th>start (h)</th><th>seconds</th><th>gap before (s)</th></tr>')
+  previous = None
+  for job in path:
+    gap = (job.start - previous.end).total_seconds() if previous is not None else 0
+    out.append('<tr><td>{}</td><td>{:.2f}</td><td>{:.0f}</td><td>{:.0f}</td></tr>'.format(html.escape(job.rule), (job.start - first).total_seconds() / 3600, job.duration(), gap))
+    previous = job
+  out.append('</table>')
+
+  out.append('<h2>Rules</h2><table><tr>{}</tr>'.format(''.join(['<th>{}</th>'.format(column) for column in COLUMNS])))
+  for row in summary:
+    out.append('<tr>{}</tr>'.format(''.join(['<td>{}</td>'.format(html.escape(format_value(row[column]))) for column in COLUMNS])))
+  out.append('</table></body></html>')
+  with open(fn, 'w') as fh:
+    fh.write('\n'.join(out))
+  logging.info('wrote %s', fn)
+
+def main(stats_fn, summary_fn, slurm_logs, sacct_fns, jobs_fn, html_fn):
+  sacct = {}
+  for fn in sacct_fns or []:
+    sacct.update(right_size.read_sacct(fn))
+  summary_jobs = read_summary(summary_fn) if summary_fn is not None else []
+  slurm_jobs = read_slurm_logs(slurm_logs or [], sacct)
+  jobs = merge_jobs(summary_jobs, slurm_jobs)
+  if stats_fn is not None:
+    add_stats_times(jobs, stats_fn)
+  untimed = len([job for job in jobs if job.start is None or job.end is None])
+  if untimed > 0:
+    logging.warn('%i of %i jobs have no times', untimed, len(jobs))
+
+  link(jobs)
+  path = critical_path(jobs)
+  if len(path) > 0:
+    logging.info('critical path: %i jobs from %s to %s, %.1f hours of which %.1f hours running', len(path), path[0].start, path[-1].end, (path[-1].end - path[0].start).total_seconds() / 3600, sum([job.duration() for job in path]) / 3600)
+  summary = rule_summary(jobs, path)
+  write_rules(sys.stdout, summary)
+  if jobs_fn is not None:
+    write_jobs(jobs_fn, jobs)
+  if html_fn is not None:
+    write_html(html_fn, jobs, path, summary, parallelism(jobs))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Critical path and timeline of a pipeline run')
+  parser.add_argument('--stats', required=False, help='snakemake --stats json')
+  parser.add_argument('--summary', required=False, help='output of snakemake --detailed-summary')
+  parser.add_argument('--slurm_logs', required=False, nargs='*', help='slurm job logs e.g. log/slurm-*.out')
+  parser.add_argument('--sacct', required=False, nargs='*', help='sacct -P exports with JobID, JobName, Submit, Start, End, Elapsed, TotalCPU and AllocCPUS')
+  parser.add_argument('--jobs', required=False, help='write a tsv of every job')
+  parser.add_argument('--html', required=False, help='write a timeline')
+  parser.add_argument('--verbose', action='store_true', help='more logging')
+  args = parser.parse_args()
+  if args.verbose:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
+  else:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+  main(args.stats, args.summary, args.slurm_logs, args.sacct, args.jobs, args.html)
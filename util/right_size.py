@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+'''
+  recommend cluster memory and time for each rule from what previous runs actually used
+  - jobs are found in the slurm logs (log/slurm-*.out), which give the rule, its inputs, outputs and log
+  - memory and elapsed time come from a slurm accounting export, e.g. sacct -P --format=JobID,JobName,State,Elapsed,Timelimit,MaxRSS,ReqMem > sacct.txt
+  - otherwise runtime comes from the snakemake stats (--stats log/snakemake_stats.json) and memory from the METRICS lines in each job's log
+  - for each rule memory and runtime are fitted as base + per_gb * input size so the fit is above every observed job, then headroom is added
+  - writes a cluster yaml with the fitted values for the largest observed input and a model file that the Snakefile uses to size each job from its own inputs
+  - usage: util/right_size.py --slurm_logs log/slurm-*.out --sacct sacct.txt --stats log/snakemake_stats.json --cluster cfg/cluster.wes.yaml --cluster_output cfg/cluster.wes.yaml --models cfg/resources.yaml
+'''
+
+import argparse
+import collections
+import csv
+import json
+import logging
+import math
+import os
+import re
+import sys
+
+import yaml
+
+Job = collections.namedtuple('Job', ['rule', 'inputs', 'outputs', 'logs'])
+
+GB = 1024 * 1024 * 1024
+
+def parse_slurm_log(fn):
+  '''
+    the job snakemake ran in this slurm log, or None if there is no rule
+  '''
+  rule = None
+  fields = {'input': [], 'output': [], 'log': []}
+  for line in open(fn, 'r', errors='replace'):
+    match = re.match(r'^(local)?rule (\S+):$', line.strip())
+    if match is not None and rule is None:
+      rule = match.group(2)
+      continue
+    match = re.match(r'^\s+(input|output|log): (.*)$', line.rstrip('\n'))
+    if match is not None and rule is not None and len(fields[match.group(1)]) == 0:
+      fields[match.group(1)] = [x.strip() for x in match.group(2).split(',') if x.strip() != '']
+  if rule is None:
+    return None
+  return Job(rule, fields['input'], fields['output'], fields['log'])
+
+def slurm_id(fn):
+  match = re.search(r'slurm-(\d+)', os.path.basename(fn))
+  return match.group(1) if match is not None else None
+
+def to_mb(value):
+  '''
+    slurm memory such as 1234K, 12G or 4000Mn
+  '''
+  match = re.match(r'^([\d.]+)([KMGT]?)', value)
+  if match is None:
+    return None
+  return float(match.group(1)) * {'': 1.0 / 1024 / 1024, 'K': 1.0 / 1024, 'M': 1.0, 'G': 1024.0, 'T': 1024.0 * 1024}[match.group(2)]
+
+def to_minutes(value):
+  '''
+    slurm duration such as 1-02:03:04, 02:03:04 or 03:04.123
+  '''
+  if value in ('', 'UNLIMITED', 'Partition_Limit'):
+    return None
+  days = 0
+  if '-' in value:
+    days, value = value.split('-', 1)
+  parts = [float(x) for x in value.split(':')]
+  while len(parts) < 3:
+    parts.insert(0, 0.0)
+  return int(days) * 24 * 60 + parts[0] * 60 + parts[1] + parts[2] / 60
+
+def format_time(minutes):
+  return '{}:{:02d}:00'.format(int(minutes) // 60, int(minutes) % 60)
+
+def read_sacct(fn):
+  '''
+    slurm job id -> {'rule', 'state', 'minutes', 'memory', 'limit_minutes', 'requested_memory', 'cpu_minutes', 'cpus', 'submit', 'start', 'end'} from sacct -P output
+    - the rule is taken from job names of the form prefix-rule-jobid, as submitted by run.sh
+    - submit, start and end are the timestamps as written by sacct if those columns were exported
+  '''
+  result = {}
+  for row in csv.DictReader(open(fn, 'r'), delimiter='|'):
+    job_id, _, step = row['JobID'].partition('.')
+    job_id = job_id.split('_')[0]
+    entry = result.setdefault(job_id, {'rule': None, 'state': None, 'minutes': None, 'memory': None, 'limit_minutes': None, 'requested_memory': None, 'cpu_minutes': None, 'cpus': None, 'submit': None, 'start': None, 'end': None})
+    if step == '':
+      name = row.get('JobName', '').rsplit('-', 2)
+      entry['rule'] = name[1] if len(name) == 3 else None
+      entry['state'] = row.get('State', '').split(' ')[0]
+      entry['minutes'] = to_minutes(row.get('Elapsed', ''))
+      entry['limit_minutes'] = to_minutes(row.get('Timelimit', ''))
+      entry['requested_memory'] = to_mb(row.get('ReqMem', ''))
+      entry['cpu_minutes'] = to_minutes(row.get('TotalCPU', ''))
+      entry['cpus'] = int(row['AllocCPUS']) if row.get('AllocCPUS', '').isdigit() else None
+      for name in ('submit', 'start', 'end'):
+        entry[name] = row.get(name.capitalize()) or None
+    memory = to_mb(row.get('MaxRSS', '') or '')
+    if memory is not None:
+      entry['memory'] = max(entry['memory'] or 0, memory)
+  logging.info('read %i jobs from %s', len(result), fn)
+  return result
+
+def read_stats(fn):
+  '''
+    output file -> duration in minutes, and rule -> max runtime in minutes, from snakemake --stats
+  '''
+  stats = json.load(open(fn, 'r'))
+  files = dict((name, value['duration'] / 60) for name, value in stats.get('files', {}).items() if value.get('duration') is not None)
+  rules = dict((name, value['max-runtime'] / 60) for name, value in stats.get('rules', {}).items() if value.get('max-runtime') is not None)
+  logging.info('read %i files and %i rules from %s', len(files), len(rules), fn)
+  return files, rules
+
+def log_peak_rss(fns):
+  '''
+    largest peak_rss_mb in the METRICS lines of the job logs
+  '''
+  result = None
+  for fn in fns:
+    if not os.path.isfile(fn):
+      continue
+    for line in open(fn, 'r', errors='replace'):
+      if ' METRICS ' in line:
+        try:
+          value = json.loads(line.split(' METRICS ', 1)[1])['peak_rss_mb']
+        except (ValueError, KeyError):
+          continue
+        result = max(result or 0, value)
+  return result
+
+def input_gb(inputs):
+  return sum([os.path.getsize(fn) for fn in inputs if os.path.isfile(fn)]) / GB
+
+def observations(slurm_logs, sacct, files, rule_runtimes):
+  '''
+    rule -> {'memory': [(gb, mb)...], 'runtime': [(gb, minutes)...], 'exceeded': count} with gb None if the input size is unknown
+  '''
+  result = collections.defaultdict(lambda: {'memory': [], 'runtime': [], 'exceeded': 0})
+  jobs = []
+  for fn in slurm_logs:
+    job = parse_slurm_log(fn)
+    if job is None:
+      logging.debug('%s: no rule found', fn)
+      continue
+    jobs.append((job, input_gb(job.inputs), sacct.get(slurm_id(fn), {})))
+  # accounting for jobs whose slurm logs are gone, with unknown input size
+  seen = set([slurm_id(fn) for fn in slurm_logs])
+  for job_id, accounting in sacct.items():
+    if job_id not in seen and accounting['rule'] is not None:
+      jobs.append((Job(accounting['rule'], [], [], []), None, accounting))
+
+  for job, size, accounting in jobs:
+    state = accounting.get('state')
+    if state in ('OUT_OF_MEMORY', 'TIMEOUT'):
+      # the job needed more than it asked for, which is at least what it was given
+      result[job.rule]['exceeded'] += 1
+      if state == 'OUT_OF_MEMORY' and accounting.get('requested_memory') is not None:
+        result[job.rule]['memory'].append((size, accounting['requested_memory']))
+      if state == 'TIMEOUT' and accounting.get('limit_minutes') is not None:
+        result[job.rule]['runtime'].append((size, accounting['limit_minutes']))
+      continue
+    if state not in (None, 'COMPLETED'):
+      logging.debug('%s: skipping job in state %s', job.rule, state)
+      continue
+
+    memory = accounting.get('memory') or log_peak_rss(job.logs)
+    if memory is not None:
+      result[job.rule]['memory'].append((size, memory))
+    minutes = accounting.get('minutes')
+    if minutes is None:
+      durations = [files[output] for output in job.outputs if output in files]
+      minutes = max(durations) if len(durations) > 0 else None
+    if minutes is not None:
+      result[job.rule]['runtime'].append((size, minutes))
+
+  # rules only seen in the snakemake stats
+  for rule, minutes in rule_runtimes.items():
+    if len(result[rule]['runtime']) == 0:
+      result[rule]['runtime'].append((None, minutes))
+  return result
+
+def fit(points, headroom, min_jobs):
+  '''
+    base and per_gb such that base + per_gb * gb is at least every observation, multiplied by headroom
+    - the slope is a least squares fit, only used with at least min_jobs jobs of known and varying input size
+  '''
+  values = [y for _, y in points]
+  sizes = [x for x, _ in points]
+  slope = 0.0
+  if len(points) >= min_jobs and None not in sizes and max(sizes) > min(sizes):
+    mean_x = sum(sizes) / len(sizes)
+    mean_y = sum(values) / len(values)
+    slope = max(0.0, sum([(x - mean_x) * (y - mean_y) for x, y in points]) / sum([(x - mean_x) ** 2 for x in sizes]))
+  base = max([y - slope * (x or 0) for x, y in points])
+  return {'base': round(base * headroom, 1), 'per_gb': round(slope * headroom, 1)}
+
+def evaluate(model, gb):
+  return model['base'] + model['per_gb'] * gb
+
+def recommend(observed, cluster, headroom, min_jobs, min_memory, min_minutes):
+  '''
+    models for each rule and the cluster config updated with the fitted values at the largest observed input
+  '''
+  models = {}
+  updated = dict((rule, dict(values)) for rule, values in cluster.items())
+  default = cluster.get('__default__', {})
+  for rule in sorted(observed):
+    entry = observed[rule]
+    model = {'jobs': max(len(entry['memory']), len(entry['runtime']))}
+    largest = max([x or 0 for x, _ in entry['memory'] + entry['runtime']])
+    current = dict(default, **cluster.get(rule, {}))
+    if len(entry['memory']) > 0:
+      model['memory'] = fit(entry['memory'], headroom, min_jobs)
+      memory = max(min_memory, int(math.ceil(evaluate(model['memory'], largest) / 1024)) * 1024)
+      updated.setdefault(rule, {})['memory'] = memory
+      sys.stdout.write('{}\tmemory\t{}\t{}\t{:.0f}\t{}\t{}\n'.format(rule, len(entry['memory']), current.get('memory'), max([y for _, y in entry['memory']]), memory, entry['exceeded']))
+    if len(entry['runtime']) > 0:
+      model['runtime'] = fit(entry['runtime'], headroom, min_jobs)
+      minutes = max(min_minutes, int(math.ceil(evaluate(model['runtime'], largest) / 15)) * 15)
+      updated.setdefault(rule, {})['time'] = format_time(minutes)
+      sys.stdout.write('{}\ttime\t{}\t{}\t{}\t{}\t{}\n'.format(rule, len(entry['runtime']), current.get('time'), format_time(math.ceil(max([y for _, y in entry['runtime']]))), format_time(minutes), entry['exceeded']))
+    models[rule] = model
+  return models, updated
+
+def main(slurm_logs, sacct_fns, stats_fn, cluster_fn, cluster_output, models_fn, headroom, min_jobs, min_memory, min_minutes):
+  sacct = {}
+  for fn in sacct_fns or []:
+    sacct.update(read_sacct(fn))
+  files, rule_runtimes = {}, {}
+  if stats_fn is not None:
+    files, rule_runtimes = read_stats(stats_fn)
+  observed = observations(slurm_logs or [], sacct, files, rule_runtimes)
+  logging.info('found jobs for %i rules', len(observed))
+
+  cluster = yaml.safe_load(open(cluster_fn, 'r'))
+  sys.stdout.write('rule\tresource\tjobs\tcurrent\tmax_used\trecommended\texceeded\n')
+  models, updated = recommend(observed, cluster, headroom, min_jobs, min_memory, min_minutes)
+
+  if cluster_output is not None:
+    with open(cluster_output, 'w') as fh:
+      yaml.safe_dump(updated, fh, default_flow_style=False)
+    logging.info('wrote %s', cluster_output)
+  if models_fn is not None:
+    with open(models_fn, 'w') as fh:
+      fh.write('# memory in MB and runtime in minutes as base + per_gb * GB of input, written by util/right_size.py\n')
+      yaml.safe_dump(models, fh, default_flow_style=False)
+    logging.info('wrote models for %i rules to %s', len(models), models_fn)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Recommend cluster resources from previous runs')
+  parser.add_argument('--slurm_logs', required=False, nargs='*', help='slurm job logs e.g. log/slurm-*.out')
+  parser.add_argument('--sacct', required=False, nargs='*', help='sacct -P exports with JobID, JobName, State, Elapsed, Timelimit, MaxRSS and ReqMem')
+  parser.add_argument('--stats', required=False, help='snakemake stats json')
+  parser.add_argument('--cluster', required=True, help='current cluster yaml')
+  parser.add_argument('--cluster_output', required=False, help='write recommended cluster yaml')
+  parser.add_argument('--models', required=False, help='write per rule models for the Snakefile')
+  parser.add_argument('--headroom', required=False, type=float, default=1.25, help='multiply fitted values by this')
+  parser.add_argument('--min_jobs', required=False, type=int, default=3, help='jobs needed to fit a dependence on input size')
+  parser.add_argument('--min_memory', required=False, type=int, default=1024, help='smallest memory to recommend in MB')
+  parser.add_argument('--min_minutes', required=False, type=int, default=15, help='shortest time to recommend')
+  parser.add_argument('--verbose', action='store_true', help='more logging')
+  args = parser.parse_args()
+  if args.verbose:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG)
+  else:
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+  main(args.slurm_logs, args.sacct, args.stats, args.cluster, args.cluster_output, args.models, args.headroom, args.min_jobs, args.min_memory, args.min_minutes)